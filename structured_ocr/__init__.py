@@ -1,3 +1 @@
-from dotenv import load_dotenv
-
-load_dotenv()
+# `.env` is loaded lazily by `structured_ocr.env.load_env`, keeping the import free of side effects
@@ -0,0 +1,46 @@
+import json
+from pathlib import Path
+from typing import Any, Optional
+
+
+def flatten(value: Any, prefix: str = "") -> dict[str, Any]:
+    """Flatten nested dicts and lists into `path -> leaf`, e.g. `enemies.0.kd`."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+
+    leaves = {}
+    for key, item in items:
+        leaves.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+    return leaves
+
+
+def field_accuracy(predicted: Optional[dict], expected: dict) -> float:
+    """Share of the ground-truth leaf fields the prediction gets exactly right, players compared by position.
+
+    Args:
+        predicted (Optional[dict]): The extraction result, None when it failed.
+        expected (dict): The ground truth.
+
+    Returns:
+        float: The accuracy from 0 to 1.
+    """
+    expected_leaves = flatten(expected)
+    if not expected_leaves:
+        return 1.0
+    predicted_leaves = flatten(predicted or {})
+    correct = sum(1 for path, value in expected_leaves.items() if path in predicted_leaves and predicted_leaves[path] == value)
+    return correct / len(expected_leaves)
+
+
+def load_label(labels_dir: Optional[str], image_path: str) -> Optional[dict]:
+    """Load the ground truth `<labels_dir>/<image stem>.json`, if any."""
+    if labels_dir is None:
+        return None
+    label_path = Path(labels_dir) / f"{Path(image_path).stem}.json"
+    if not label_path.exists():
+        return None
+    return json.loads(label_path.read_text())
@@ -0,0 +1,76 @@
+"""Check the package import time against a budget, so heavy imports do not creep back in.
+
+Usage:
+    python -m structured_ocr.benchmarks.import_time [--module structured_ocr.llm_ocr.graph] [--budget-ms 750] [--runs 5]
+
+Each run imports the module in a fresh interpreter with `-X importtime`. Exits non-zero when the median cumulative time is over budget or when a lazily loaded dependency is imported eagerly.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+from rich import print
+from rich.table import Table
+
+# Modules that must only be loaded when their route or helper is used
+LAZY_MODULES = ["langgraph", "langchain_openai", "google.genai", "google.cloud.documentai", "cv2", "IPython", "dotenv", "tqdm"]
+
+
+def measure_import(module: str) -> tuple[dict[str, int], set[str]]:
+    """Import `module` in a fresh interpreter.
+
+    Args:
+        module (str): The module to import.
+
+    Returns:
+        tuple[dict[str, int], set[str]]: The cumulative import time in microseconds per imported module, and the lazy modules that ended up in `sys.modules`.
+    """
+    code = f"import sys, {module}; print(' '.join(name for name in {LAZY_MODULES!r} if name in sys.modules))"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = (part.strip() for part in line.removeprefix("import time:").split("|"))
+        cumulative[name] = int(cumulative_us)
+    return cumulative, set(completed.stdout.split())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="structured_ocr.llm_ocr.graph", help="The module to import, the graph module is what a worker loads before its first run")
+    parser.add_argument("--budget-ms", type=float, default=750, help="The maximum median cumulative import time")
+    parser.add_argument("--runs", type=int, default=5, help="The number of fresh interpreters to measure")
+    parser.add_argument("--top", type=int, default=10, help="The number of slowest imports to show")
+    args = parser.parse_args()
+
+    runs = [measure_import(args.module) for _ in range(args.runs)]
+    median_ms = statistics.median(cumulative[args.module] for cumulative, _ in runs) / 1000
+    eager = set().union(*(loaded for _, loaded in runs))
+
+    table = Table(title=f"Slowest imports under {args.module} (last run)")
+    table.add_column("module")
+    table.add_column("cumulative ms", justify="right")
+    cumulative, _ = runs[-1]
+    for name, cumulative_us in sorted(cumulative.items(), key=lambda item: item[1], reverse=True)[: args.top]:
+        table.add_row(name, f"{cumulative_us / 1000:.1f}")
+    print(table)
+
+    failed = False
+    if median_ms > args.budget_ms:
+        print(f"❌ {args.module} imports in {median_ms:.1f} ms, over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    else:
+        print(f"✅ {args.module} imports in {median_ms:.1f} ms, within the {args.budget_ms:.0f} ms budget")
+    if eager:
+        print(f"❌ Loaded eagerly: {', '.join(sorted(eager))}")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
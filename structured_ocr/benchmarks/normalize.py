@@ -0,0 +1,124 @@
+"""Benchmark the per-document overhead of converting the result text with OpenCC.
+
+Usage:
+    python -m structured_ocr.benchmarks.normalize [--labels path/to/labels] [--documents 200] [--non-ascii-share 0.5] [--config s2hk]
+
+The results are the ground-truth `<image stem>.json` files of `--labels`, or synthetic scoreboards with a share of simplified Chinese names. Each strategy converts every string field of every result and rebuilds it:
+- uncached per field: a new converter per string, as `s2hk` used to do, timed on a few documents only
+- cached per field: the shared converter, one call per string
+- bulk per document: `normalize_result`, one call per document
+- bulk per batch: `normalize_results`, one call for every document
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+from pydantic import BaseModel
+from rich import print
+from rich.table import Table
+
+from ..llm_ocr.normalize import get_converter, iter_strings, normalize_result, normalize_results, replace_strings
+from ..llm_ocr.profiles import get_profile
+from ..llm_ocr.schema import Match, Player
+
+# Documents timed with a new converter per string, which takes tens of milliseconds each
+UNCACHED_DOCUMENTS = 3
+
+
+# Simplified names, as OCR gives them before conversion
+NON_ASCII_NAMES = ["头发", "简体", "龙战士", "东方", "风云", "无敌"]
+
+
+def synthetic_results(documents: int, non_ascii_share: float = 0.5) -> list[Match]:
+    """Full lobbies with distinct names and stats, every `1 / non_ascii_share`th player with a simplified Chinese name."""
+    every = round(1 / non_ascii_share) if non_ascii_share > 0 else 0
+
+    def player(index: int, name: str) -> Player:
+        kills, deaths = 3 + index % 20, 1 + index % 9
+        fields = {"level": 1 + index % 1000, "kills": kills, "deaths": deaths, "assists": index % 7, "kd": round(kills / deaths, 2), "score": 100 * kills}
+        if every and index % every == 0:
+            # The scoreboard names are ASCII only, so these bypass validation
+            return Player.model_construct(name=f"{NON_ASCII_NAMES[index % len(NON_ASCII_NAMES)]}{index}", **fields)
+        return Player(name=f"{name}_{index}", **fields)
+
+    return [
+        Match(
+            side="Heroes" if document % 2 else "Villains",
+            me=player(document, "me"),
+            squad=[player(document + 1, "squad")],
+            teammates=[player(document + 2, "mate"), player(document + 3, "mate")],
+            enemies=[player(document + offset, "enemy") for offset in range(4, 8)],
+        )
+        for document in range(documents)
+    ]
+
+
+def load_results(labels_dir: str, schema: type[BaseModel]) -> list[BaseModel]:
+    """Validate every label file against `schema`, skipping the ones that do not fit."""
+    results = []
+    for path in sorted(Path(labels_dir).glob("*.json")):
+        try:
+            results.append(schema.model_validate(json.loads(path.read_text())))
+        except ValueError as e:
+            print(f"⏭️ {path.name}: {e}")
+    return results
+
+
+def _per_field(results: list[BaseModel], converter: Callable[[], Any]) -> list[BaseModel]:
+    return [replace_strings(result, (converter().convert(text) for text in iter_strings(result))) for result in results]
+
+
+def run_benchmark(results: list[BaseModel], config: str = "s2hk") -> Table:
+    """Time each strategy on `results`.
+
+    Returns:
+        Table: Milliseconds per document and per string of each strategy.
+    """
+    import opencc
+
+    strings = sum(1 for result in results for _ in iter_strings(result))
+    per_document = strings / len(results)
+
+    start = time.perf_counter()
+    get_converter(config)
+    load_ms = (time.perf_counter() - start) * 1000
+
+    uncached = results[:UNCACHED_DOCUMENTS]
+    strategies: dict[str, tuple[list[BaseModel], Callable[[list[BaseModel]], Any]]] = {
+        "uncached per field": (uncached, lambda batch: _per_field(batch, lambda: opencc.OpenCC(config))),
+        "cached per field": (results, lambda batch: _per_field(batch, lambda: get_converter(config))),
+        "bulk per document": (results, lambda batch: [normalize_result(result, config) for result in batch]),
+        "bulk per batch": (results, lambda batch: normalize_results(batch, config)),
+    }
+
+    table = Table(title=f"OpenCC {config} on {len(results)} documents, {per_document:.0f} strings each, converter loaded in {load_ms:.1f} ms")
+    for column in ("strategy", "ms per document", "µs per string"):
+        table.add_column(column, justify="left" if column == "strategy" else "right")
+    for name, (batch, convert) in strategies.items():
+        start = time.perf_counter()
+        convert(batch)
+        elapsed = time.perf_counter() - start
+        table.add_row(name, f"{elapsed / len(batch) * 1000:.3f}", f"{elapsed / (len(batch) * per_document) * 1e6:.2f}")
+    return table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--labels", help="A directory of ground-truth <image stem>.json files, synthetic scoreboards when omitted")
+    parser.add_argument("--profile", default="scoreboard", help="The profile whose target schema the labels follow")
+    parser.add_argument("--documents", type=int, default=200, help="The number of synthetic documents")
+    parser.add_argument("--non-ascii-share", type=float, default=0.5, help="The share of synthetic players with a simplified Chinese name")
+    parser.add_argument("--config", default="s2hk", help="The OpenCC config")
+    args = parser.parse_args()
+
+    results = load_results(args.labels, get_profile(args.profile).target_schema) if args.labels else synthetic_results(args.documents, args.non_ascii_share)
+    if not results:
+        parser.error("No results to convert")
+    print(run_benchmark(results, args.config))
+
+
+if __name__ == "__main__":
+    main()
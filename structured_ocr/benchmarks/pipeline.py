@@ -0,0 +1,202 @@
+"""Benchmark the whole pipeline on a labelled image set, offline from recorded provider responses.
+
+Usage:
+    python -m structured_ocr.benchmarks.pipeline path/to/images --fixtures path/to/fixtures --mode record [--labels path/to/labels]
+    python -m structured_ocr.benchmarks.pipeline path/to/images --fixtures path/to/fixtures [--labels path/to/labels] [--runner batch] [--latency-scale 1] [--error-rate 0.05]
+
+Record once against the real providers, then replay in CI without network or API keys: every LLM and OCR call is answered from the fixtures, after the recorded latency times `--latency-scale` plus `--latency-ms`, and fails with a retryable error at `--error-rate`. A call without a fixture fails the image in replay mode.
+
+Reports docs/sec, p50/p95/p99 latency per document, LLM calls per document, the correction loop depth, the time to the first field and to the abort decisions of streamed extractions (`--config '{"streaming": true}'`) and, with `--labels`, the field accuracy against the ground-truth `<image stem>.json` files. The result and stage caches are off, so every run makes the same calls.
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from pydantic import BaseModel
+from rich import print
+from rich.table import Table
+
+from ..llm_ocr.graph import batch_run_graph, run_graph
+from ..llm_ocr.stream import iter_image_paths
+from ..telemetry import Sink, Span, add_sink, remove_sink
+from .accuracy import field_accuracy, load_label
+from .replay import ReplaySettings, ReplayStats, replaying
+
+
+class DocumentRun(BaseModel):
+    image_path: Optional[str] = None
+    latency: float = 0.0
+    llm_calls: int = 0
+    correction_depth: int = 0
+    first_field_seconds: Optional[float] = None  # Of the first streamed call
+    abort_seconds: Optional[float] = None  # Of the first stream found certainly wrong
+    error: Optional[str] = None
+
+
+class DocumentSink(Sink):
+    """Collect the latency, LLM call count and correction depth of every `run_graph`, one trace per document."""
+
+    def __init__(self):
+        self._documents: dict[str, DocumentRun] = defaultdict(DocumentRun)
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        with self._lock:
+            document = self._documents[span.trace_id]
+            if span.kind == "llm":
+                document.llm_calls += 1
+                if document.first_field_seconds is None:
+                    document.first_field_seconds = span.attributes.get("first_field_seconds")
+                if document.abort_seconds is None:
+                    document.abort_seconds = span.attributes.get("abort_seconds")
+            elif span.kind == "graph" and span.parent is None:
+                document.image_path = span.image_path
+                document.latency = span.duration
+                document.correction_depth = span.correction_depth or 0
+                document.error = span.error
+
+    def documents(self) -> list[DocumentRun]:
+        with self._lock:
+            # Traces without a graph span are the queue waits of `batch_run_graph`
+            return [document for document in self._documents.values() if document.image_path is not None]
+
+
+def _run_graph(image_paths: list[str], concurrency: int, config: dict) -> dict[str, Optional[dict]]:
+    """Run each image on its own, a failed image is None."""
+
+    def _run(image_path: str) -> Optional[dict]:
+        try:
+            return run_graph(image_path, config)
+        except Exception as e:
+            print(f"❌ {image_path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return dict(zip(image_paths, executor.map(_run, image_paths)))
+
+
+def _batch_run_graph(image_paths: list[str], concurrency: int, config: dict) -> dict[str, Optional[dict]]:
+    """Run the images as one `batch_run_graph` batch, a failed image fails the batch."""
+    return dict(zip(image_paths, batch_run_graph(image_paths, max_concurrency=concurrency, config=config)))
+
+
+RUNNERS = {"graph": _run_graph, "batch": _batch_run_graph}
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run_benchmark(
+    image_paths: list[str],
+    fixtures_dir: str,
+    settings: ReplaySettings,
+    labels_dir: Optional[str] = None,
+    runner: str = "graph",
+    concurrency: int = 8,
+    configurable: Optional[dict[str, Any]] = None,
+) -> Table:
+    """Run the pipeline over `image_paths` with every provider call recorded or replayed.
+
+    Args:
+        image_paths (list[str]): The images.
+        fixtures_dir (str): The directory of the recorded responses.
+        settings (ReplaySettings): The replay mode, synthetic latency and error injection.
+        labels_dir (Optional[str]): A directory of ground-truth `<image stem>.json` files.
+        runner (str): "graph" for `run_graph` per image on a thread pool, "batch" for one `batch_run_graph`.
+        concurrency (int): The images in flight at once.
+        configurable (Optional[dict[str, Any]]): `Configuration` overrides.
+
+    Returns:
+        Table: Throughput, latency percentiles, LLM calls, correction depth and accuracy.
+    """
+    config = {"configurable": {**(configurable or {}), "use_result_cache": False, "use_stage_cache": False}}
+    sink = add_sink(DocumentSink())
+    try:
+        with replaying(fixtures_dir, settings) as stats:
+            start = time.perf_counter()
+            results = RUNNERS[runner](image_paths, concurrency, config)
+            elapsed = time.perf_counter() - start
+    finally:
+        remove_sink(sink)
+    return _table(image_paths, results, sink.documents(), stats, elapsed, labels_dir, settings)
+
+
+def _table(
+    image_paths: list[str],
+    results: dict[str, Optional[dict]],
+    documents: list[DocumentRun],
+    stats: ReplayStats,
+    elapsed: float,
+    labels_dir: Optional[str],
+    settings: ReplaySettings,
+) -> Table:
+    latencies = sorted(document.latency for document in documents) or [0.0]
+    depths = [document.correction_depth for document in documents] or [0]
+    first_fields = sorted(document.first_field_seconds for document in documents if document.first_field_seconds is not None)
+    aborts = sorted(document.abort_seconds for document in documents if document.abort_seconds is not None)
+    accuracies = [field_accuracy(results.get(image_path), label) for image_path in image_paths if (label := load_label(labels_dir, image_path)) is not None]
+
+    table = Table(title=f"Pipeline benchmark ({len(image_paths)} images, {settings.mode} mode)")
+    table.add_column("metric")
+    table.add_column("value", justify="right")
+    rows = {
+        "docs/sec": f"{len(image_paths) / elapsed:.2f}",
+        "p50 latency s": f"{_percentile(latencies, 0.5):.3f}",
+        "p95 latency s": f"{_percentile(latencies, 0.95):.3f}",
+        "p99 latency s": f"{_percentile(latencies, 0.99):.3f}",
+        "LLM calls/doc": f"{statistics.fmean(document.llm_calls for document in documents):.2f}" if documents else "-",
+        "correction depth mean": f"{statistics.fmean(depths):.2f}",
+        "correction depth max": f"{max(depths)}",
+        "time to first field p50 s": f"{_percentile(first_fields, 0.5):.3f}" if first_fields else "-",
+        "time to abort p50 s": f"{_percentile(aborts, 0.5):.3f} on {len(aborts)} docs" if aborts else "-",
+        "failed docs": f"{sum(result is None for result in results.values())}",
+        "provider calls": f"{stats.calls} ({stats.replayed} replayed, {stats.recorded} recorded, {stats.misses} missed, {stats.injected_errors} injected errors)",
+        "field accuracy": f"{statistics.fmean(accuracies):.3f} on {len(accuracies)} labels" if accuracies else "-",
+    }
+    for metric, value in rows.items():
+        table.add_row(metric, value)
+    return table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="A directory, glob pattern or manifest of images")
+    parser.add_argument("--fixtures", required=True, help="The directory of the recorded provider responses")
+    parser.add_argument("--mode", choices=["record", "replay", "auto"], default="replay", help="Record real responses, replay recorded ones, or replay and record the missing ones")
+    parser.add_argument("--labels", help="A directory of ground-truth <image stem>.json files")
+    parser.add_argument("--runner", choices=sorted(RUNNERS), default="graph", help="run_graph per image, or one batch_run_graph")
+    parser.add_argument("--concurrency", type=int, default=8, help="The images in flight at once")
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="Wait this multiple of the recorded latency before each replayed response")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="A fixed delay added to each replayed response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="The relative spread of the delay, 0.2 for ±20%%")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="The share of replayed responses failing with a retryable error")
+    parser.add_argument("--error-status", type=int, default=503, help="The status of the injected errors")
+    parser.add_argument("--seed", type=int, default=0, help="The seed of the jitter and error injection")
+    parser.add_argument("--config", default="{}", help="Configuration overrides as JSON, e.g. '{\"use_ocr\": true}'")
+    parser.add_argument("--limit", type=int, help="Use at most this many images")
+    args = parser.parse_args()
+
+    settings = ReplaySettings(
+        mode=args.mode,
+        latency_scale=args.latency_scale,
+        latency_seconds=args.latency_ms / 1000,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+    )
+    image_paths = list(iter_image_paths(args.images))[: args.limit]
+    if not image_paths:
+        parser.error(f"No images in {args.images}")
+    print(run_benchmark(image_paths, args.fixtures, settings, args.labels, args.runner, args.concurrency, json.loads(args.config)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark preprocessing settings on payload size, encode time and extraction accuracy.
+
+Usage:
+    python -m structured_ocr.benchmarks.preprocess path/to/images [--labels path/to/labels] [--model gemini-2.5-flash]
+
+Accuracy is measured only with `--labels`, a directory of ground-truth `<image stem>.json` files, and calls the model once per image and setting.
+"""
+
+import argparse
+import os
+import statistics
+import time
+from typing import Any, Optional
+
+from PIL import Image
+from rich import print
+from rich.table import Table
+
+from ..llm_ocr.llm import run_llm
+from ..llm_ocr.prompt import TEXT_EXTRACTION_PROMPT
+from ..llm_ocr.schema import TARGET_SCHEMA
+from ..llm_ocr.stream import iter_image_paths
+from ..utils import encode_array, encode_image, preprocess_image
+from .accuracy import field_accuracy, load_label
+
+# Setting name -> (preprocess_image arguments, upload format, quality), "original" uploads the file untouched
+SETTINGS: dict[str, tuple[dict[str, Any], str, int]] = {
+    "original": ({}, "original", 0),
+    "png": ({}, "png", 0),
+    "webp-90": ({}, "webp", 90),
+    "jpeg-90": ({}, "jpeg", 90),
+    "max2048-webp-90": ({"max_dimension": 2048}, "webp", 90),
+    "max1536-webp-85": ({"max_dimension": 1536}, "webp", 85),
+    "max1024-webp-80": ({"max_dimension": 1024}, "webp", 80),
+    "crop-max1536-webp-85": ({"crop": True, "max_dimension": 1536}, "webp", 85),
+    "crop-deskew-contrast-max1536-webp-85": ({"crop": True, "straighten": True, "contrast": True, "max_dimension": 1536}, "webp", 85),
+    "gray-max1536-webp-85": ({"grayscale": True, "max_dimension": 1536}, "webp", 85),
+}
+
+
+def run_benchmark(image_paths: list[str], labels_dir: Optional[str] = None, model: Optional[str] = None) -> Table:
+    """Encode every image with every setting, and extract when labels are given.
+
+    Returns:
+        Table: Mean payload size, mean preprocess+encode time and mean field accuracy per setting.
+    """
+    table = Table(title=f"Preprocessing benchmark ({len(image_paths)} images)")
+    for column in ("setting", "payload KB", "encode ms", "accuracy"):
+        table.add_column(column, justify="left" if column == "setting" else "right")
+
+    for name, (preprocessing, image_format, quality) in SETTINGS.items():
+        sizes, times, accuracies = [], [], []
+        for image_path in image_paths:
+            start = time.perf_counter()
+            if image_format == "original":
+                payload = encode_image(image_path)
+            else:
+                payload = encode_array(preprocess_image(Image.open(image_path), **preprocessing), image_format, quality)
+            times.append(time.perf_counter() - start)
+            sizes.append(len(payload.data))
+
+            label = load_label(labels_dir, image_path)
+            if label is not None and model:
+                try:
+                    result = run_llm(model, TEXT_EXTRACTION_PROMPT, payload, "", TARGET_SCHEMA)
+                    accuracies.append(field_accuracy(result.model_dump() if result else None, label))
+                except Exception as e:
+                    print(f"❌ {name} {image_path}: {e}")
+                    accuracies.append(0.0)
+
+        table.add_row(
+            name,
+            f"{statistics.mean(sizes) / 1024:.1f}",
+            f"{statistics.mean(times) * 1000:.1f}",
+            f"{statistics.mean(accuracies):.3f}" if accuracies else "-",
+        )
+    return table
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("images", help="A directory, glob pattern or manifest of images")
+    parser.add_argument("--labels", help="A directory of ground-truth <image stem>.json files")
+    parser.add_argument("--model", default=os.getenv("LLM_OCR"), help="The extraction model used for accuracy")
+    parser.add_argument("--limit", type=int, help="Use at most this many images")
+    args = parser.parse_args()
+
+    image_paths = list(iter_image_paths(args.images))[: args.limit]
+    print(run_benchmark(image_paths, args.labels, args.model))
+
+
+if __name__ == "__main__":
+    main()
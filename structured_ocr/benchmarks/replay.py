@@ -0,0 +1,325 @@
+"""Record and replay the LLM and OCR provider calls, so benchmarks run offline at no API cost.
+
+`replaying` swaps every `LLM_PROVIDERS` and `LLM_STREAM_PROVIDERS` route and `OCR_BACKENDS` engine for a wrapper, under the rate limiter like the real call:
+- "record" calls the real provider and writes the response and its latency to the fixture directory
+- "replay" answers from the fixtures only, a call without one raises `ReplayMiss`
+- "auto" replays what is recorded and records the rest
+
+Fixtures are keyed like the stage cache, so a change to a prompt, schema, model or image is a miss rather than a stale answer. One JSON file per call, under `<directory>/llm/` and `<directory>/ocr/`, keeps them reviewable in git for CI.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Awaitable, Callable, Iterator, Literal, Optional
+
+from pydantic import BaseModel, Field
+
+from ..llm_ocr.cache import llm_cache_key, ocr_cache_key
+from ..llm_ocr.llm import LLM_PROVIDERS, LLM_STREAM_PROVIDERS, register_llm_provider, register_llm_stream_provider
+from ..ocr import OCR_BACKENDS, OCRBackend, register_ocr_backend
+from ..ratelimit import acall_limited, call_limited
+from ..utils import ImagePayload
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+ReplayMode = Literal["record", "replay", "auto"]
+
+# Characters per chunk of a replayed stream, spread evenly over the delay of the call
+REPLAY_CHUNK_CHARS = 64
+
+
+class ReplayMiss(KeyError):
+    """No fixture was recorded for a call in "replay" mode."""
+
+
+class ReplayError(Exception):
+    """A synthetic provider error, with a status the rate limiter treats like the real one."""
+
+    def __init__(self, stage: str, status_code: int):
+        super().__init__(f"Injected {stage} error {status_code}")
+        self.status_code = status_code
+
+
+class ReplaySettings(BaseModel):
+    mode: ReplayMode = Field(default="replay", description="Record real responses, replay recorded ones, or both")
+    latency_scale: float = Field(default=0.0, description="The share of the recorded latency to wait before replying, 1 replays at recorded speed", ge=0)
+    latency_seconds: float = Field(default=0.0, description="A fixed delay added to every replayed call", ge=0)
+    jitter: float = Field(default=0.0, description="The relative spread of the delay, 0.2 for ±20%", ge=0, le=1)
+    error_rate: float = Field(default=0.0, description="The share of replayed calls failing with a `ReplayError`", ge=0, le=1)
+    error_status: int = Field(default=503, description="The status of injected errors, 429 and 5xx are retried by the rate limiter")
+    seed: Optional[int] = Field(default=None, description="The seed of the latency jitter and error injection")
+
+
+class ReplayStats(BaseModel):
+    calls: int = 0
+    replayed: int = 0
+    recorded: int = 0
+    misses: int = 0
+    injected_errors: int = 0
+
+
+class FixtureStore:
+    """Recorded responses on disk, one JSON file per call under `<directory>/<stage>/<key>.json`."""
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory).expanduser()
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.directory / stage / f"{key}.json"
+
+    def get(self, stage: str, key: str) -> Optional[dict[str, Any]]:
+        path = self._path(stage, key)
+        return json.loads(path.read_text()) if path.exists() else None
+
+    def put(self, stage: str, key: str, record: dict[str, Any]) -> None:
+        path = self._path(stage, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Written aside and renamed, so a concurrent reader never sees half a fixture
+        partial_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        partial_path.write_text(json.dumps(record, ensure_ascii=False, indent=1))
+        partial_path.replace(path)
+
+
+class Replayer:
+    """The shared state of the wrappers: fixtures, settings, stats and the seeded random source."""
+
+    def __init__(self, store: FixtureStore, settings: ReplaySettings):
+        self.store = store
+        self.settings = settings
+        self.stats = ReplayStats()
+        self._random = random.Random(settings.seed)
+        self._lock = threading.Lock()
+
+    def _count(self, field: str) -> None:
+        with self._lock:
+            setattr(self.stats, field, getattr(self.stats, field) + 1)
+
+    def lookup(self, stage: str, key: str) -> Optional[dict[str, Any]]:
+        """The fixture of a call, None when it is to be recorded.
+
+        Raises:
+            ReplayMiss: When no fixture exists in "replay" mode.
+        """
+        self._count("calls")
+        record = self.store.get(stage, key) if self.settings.mode != "record" else None
+        if record is None and self.settings.mode == "replay":
+            self._count("misses")
+            raise ReplayMiss(f"No {stage} fixture {key} in {self.store.directory}")
+        return record
+
+    def plan(self, stage: str, record: dict[str, Any]) -> tuple[float, Optional[ReplayError]]:
+        """The delay of a replayed call and the error it fails with, if any."""
+        with self._lock:
+            delay = self.settings.latency_seconds + self.settings.latency_scale * record["latency"]
+            delay *= 1 + self._random.uniform(-self.settings.jitter, self.settings.jitter)
+            failed = self._random.random() < self.settings.error_rate
+            if failed:
+                self.stats.injected_errors += 1
+            else:
+                self.stats.replayed += 1
+        return max(0.0, delay), ReplayError(stage, self.settings.error_status) if failed else None
+
+    def record(self, stage: str, key: str, latency: float, **fields: Any) -> None:
+        self.store.put(stage, key, {"latency": latency, **fields})
+        self._count("recorded")
+
+
+def _llm_response(record: dict[str, Any], schema: type[BaseModel]) -> Optional[BaseModel]:
+    return schema.model_validate_json(record["response"]) if record["response"] is not None else None
+
+
+def _replay_llm(replayer: Replayer, run: Callable[..., BaseModel], arun: Callable[..., Awaitable[BaseModel]]) -> tuple[Callable[..., BaseModel], Callable[..., Awaitable[BaseModel]]]:
+    """Wrap the provider calls of one `run_llm` route."""
+
+    def _record(key: str, model: str, schema: type[BaseModel], result: Optional[BaseModel], latency: float) -> None:
+        replayer.record("llm", key, latency, model=model, schema=schema.__name__, response=result.model_dump_json() if result is not None else None)
+
+    def replay_run(model, prompt, reference_image=None, reference_text=None, schema=None, temperature=None) -> BaseModel:
+        key = llm_cache_key(model, prompt, reference_image, reference_text, schema, temperature)
+        if (record := replayer.lookup("llm", key)) is None:
+            start = time.monotonic()
+            result = run(model, prompt, reference_image, reference_text, schema, temperature)
+            _record(key, model, schema, result, time.monotonic() - start)
+            return result
+        delay, error = replayer.plan("llm", record)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return _llm_response(record, schema)
+
+    async def areplay_run(model, prompt, reference_image=None, reference_text=None, schema=None, temperature=None) -> BaseModel:
+        key = await asyncio.to_thread(llm_cache_key, model, prompt, reference_image, reference_text, schema, temperature)
+        if (record := await asyncio.to_thread(replayer.lookup, "llm", key)) is None:
+            start = time.monotonic()
+            result = await arun(model, prompt, reference_image, reference_text, schema, temperature)
+            await asyncio.to_thread(_record, key, model, schema, result, time.monotonic() - start)
+            return result
+        delay, error = replayer.plan("llm", record)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return _llm_response(record, schema)
+
+    return replay_run, areplay_run
+
+
+def _replay_llm_stream(
+    replayer: Replayer, stream: Callable[..., Iterator[str]], astream: Callable[..., AsyncIterator[str]]
+) -> tuple[Callable[..., Iterator[str]], Callable[..., AsyncIterator[str]]]:
+    """Wrap the streamed provider calls of one `stream_llm` route, sharing the fixtures of `run_llm`."""
+
+    def _record(key: str, model: str, schema: type[BaseModel], text: str, latency: float) -> None:
+        response = schema.model_validate_json(text).model_dump_json() if text.strip() else None
+        replayer.record("llm", key, latency, model=model, schema=schema.__name__, response=response)
+
+    def _chunks(record: dict[str, Any]) -> list[str]:
+        text = record["response"] or ""
+        return [text[start : start + REPLAY_CHUNK_CHARS] for start in range(0, len(text), REPLAY_CHUNK_CHARS)]
+
+    def replay_stream(model, prompt, reference_image=None, reference_text=None, schema=None) -> Iterator[str]:
+        key = llm_cache_key(model, prompt, reference_image, reference_text, schema)
+        if (record := replayer.lookup("llm", key)) is None:
+            start, chunks = time.monotonic(), []
+            for chunk in stream(model, prompt, reference_image, reference_text, schema):
+                chunks.append(chunk)
+                yield chunk
+            _record(key, model, schema, "".join(chunks), time.monotonic() - start)
+            return
+        delay, error = replayer.plan("llm", record)
+        if error is not None:
+            time.sleep(delay)
+            raise error
+        chunks = _chunks(record)
+        for chunk in chunks:
+            time.sleep(delay / len(chunks))
+            yield chunk
+
+    async def areplay_stream(model, prompt, reference_image=None, reference_text=None, schema=None) -> AsyncIterator[str]:
+        key = await asyncio.to_thread(llm_cache_key, model, prompt, reference_image, reference_text, schema)
+        if (record := await asyncio.to_thread(replayer.lookup, "llm", key)) is None:
+            start, chunks = time.monotonic(), []
+            async for chunk in astream(model, prompt, reference_image, reference_text, schema):
+                chunks.append(chunk)
+                yield chunk
+            await asyncio.to_thread(_record, key, model, schema, "".join(chunks), time.monotonic() - start)
+            return
+        delay, error = replayer.plan("llm", record)
+        if error is not None:
+            await asyncio.sleep(delay)
+            raise error
+        chunks = _chunks(record)
+        for chunk in chunks:
+            await asyncio.sleep(delay / len(chunks))
+            yield chunk
+
+    return replay_stream, areplay_stream
+
+
+class ReplayOCRBackend(OCRBackend):
+    """Wraps the OCR backend registered under `name`, within the rate limits of a route of the same name.
+
+    Args:
+        replayer (Replayer): The shared replay state.
+        name (str): The backend name, part of the fixture key.
+        backend (Callable[[], OCRBackend]): The real backend, created on the first recorded call.
+    """
+
+    def __init__(self, replayer: Replayer, name: str, backend: Callable[[], OCRBackend]):
+        self.replayer = replayer
+        self.name = name
+        self._backend_factory = backend
+        self._backend: Optional[OCRBackend] = None
+        self.max_pages = getattr(backend, "max_pages", None)
+
+    @property
+    def backend(self) -> OCRBackend:
+        if self._backend is None:
+            self._backend = self._backend_factory()
+        return self._backend
+
+    def _key(self, content: bytes, mime_type: str) -> str:
+        return ocr_cache_key(ImagePayload(data=content, mime_type=mime_type), self.name)
+
+    def _record(self, key: str, document: documentai.Document, latency: float) -> None:
+        from google.cloud import documentai
+
+        self.replayer.record("ocr", key, latency, backend=self.name, document=json.loads(documentai.Document.to_json(document)))
+
+    @staticmethod
+    def _document(record: dict[str, Any]) -> documentai.Document:
+        from google.cloud import documentai
+
+        return documentai.Document.from_json(json.dumps(record["document"]), ignore_unknown_fields=True)
+
+    def process(self, content: bytes, mime_type: str) -> documentai.Document:
+        key = self._key(content, mime_type)
+        if (record := self.replayer.lookup("ocr", key)) is None:
+            start = time.monotonic()
+            document = self.backend.process(content, mime_type)
+            self._record(key, document, time.monotonic() - start)
+            return document
+
+        def _replay() -> documentai.Document:
+            delay, error = self.replayer.plan("ocr", record)
+            time.sleep(delay)
+            if error is not None:
+                raise error
+            return self._document(record)
+
+        return call_limited(self.name, _replay)
+
+    async def aprocess(self, content: bytes, mime_type: str) -> documentai.Document:
+        key = await asyncio.to_thread(self._key, content, mime_type)
+        if (record := await asyncio.to_thread(self.replayer.lookup, "ocr", key)) is None:
+            start = time.monotonic()
+            document = await self.backend.aprocess(content, mime_type)
+            await asyncio.to_thread(self._record, key, document, time.monotonic() - start)
+            return document
+
+        async def _replay() -> documentai.Document:
+            delay, error = self.replayer.plan("ocr", record)
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            return await asyncio.to_thread(self._document, record)
+
+        return await acall_limited(self.name, _replay)
+
+
+@contextmanager
+def replaying(directory: str, settings: Optional[ReplaySettings] = None) -> Iterator[ReplayStats]:
+    """Route every LLM and OCR provider call through the fixtures of `directory` within the block.
+
+    Args:
+        directory (str): The fixture directory.
+        settings (Optional[ReplaySettings]): The mode, synthetic latency and error injection, replay only by default.
+
+    Yields:
+        ReplayStats: The live call counts.
+    """
+    replayer = Replayer(FixtureStore(directory), settings or ReplaySettings())
+    llm_providers, stream_providers, ocr_backends = dict(LLM_PROVIDERS), dict(LLM_STREAM_PROVIDERS), dict(OCR_BACKENDS)
+    for route, (run, arun) in llm_providers.items():
+        register_llm_provider(route, *_replay_llm(replayer, run, arun))
+    for route, (stream, astream) in stream_providers.items():
+        register_llm_stream_provider(route, *_replay_llm_stream(replayer, stream, astream))
+    for name, backend in ocr_backends.items():
+        register_ocr_backend(name, partial(ReplayOCRBackend, replayer, name, backend))
+    try:
+        yield replayer.stats
+    finally:
+        for route, (run, arun) in llm_providers.items():
+            register_llm_provider(route, run, arun)
+        for route, (stream, astream) in stream_providers.items():
+            register_llm_stream_provider(route, stream, astream)
+        for name, backend in ocr_backends.items():
+            register_ocr_backend(name, backend)
@@ -0,0 +1,172 @@
+"""Process-wide registry of reusable LLM and Document AI clients.
+
+Clients hold keep-alive HTTP/gRPC connection pools, so they are built once per key and shared by every graph node.
+Sync clients are shared across threads. Async clients are bound to the event loop they were created on, because their connection pools cannot be reused by another loop, and are dropped together with that loop.
+Provider SDKs are imported by the factories, so only the routes in use are loaded.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import weakref
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, Any, Callable, Hashable, Optional
+
+from pydantic import BaseModel
+
+from .env import getenv
+from .specs import openai_tool
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+    from google.genai import Client
+    from langchain_openai import ChatOpenAI
+
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Connection pool limits per HTTP client
+HTTP_LIMITS = {"max_connections": 200, "max_keepalive_connections": 50, "keepalive_expiry": 60}
+
+# Keep idle gRPC channels open between pages
+GRPC_KEEPALIVE_OPTIONS = [
+    ("grpc.keepalive_time_ms", 30_000),
+    ("grpc.keepalive_timeout_ms", 10_000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+
+_lock = threading.RLock()  # Reentrant, factories may resolve other clients
+_clients: dict[Hashable, Any] = {}
+_loop_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[Hashable, Any]]" = weakref.WeakKeyDictionary()
+
+
+def _get_or_create(key: Hashable, factory: Callable[[], Any], asynchronous: bool = False) -> Any:
+    """Return the client registered under `key`, creating it once if missing.
+
+    Args:
+        key (Hashable): The registry key.
+        factory (Callable[[], Any]): Builds the client on a miss.
+        asynchronous (bool): Whether the client is bound to the running event loop.
+
+    Returns:
+        Any: The shared client.
+    """
+    with _lock:
+        if asynchronous:
+            registry = _loop_clients.setdefault(asyncio.get_running_loop(), {})
+        else:
+            registry = _clients
+        client = registry.get(key)
+        if client is None:
+            client = registry[key] = factory()
+    return client
+
+
+def reset_clients() -> None:
+    """Drop every registered client, e.g. after forking a worker process."""
+    with _lock:
+        _clients.clear()
+        _loop_clients.clear()
+    processor_name.cache_clear()
+
+
+def get_chat_model(model: str, asynchronous: bool = False, temperature: Optional[float] = None) -> ChatOpenAI:
+    """Get the shared OpenRouter chat model for `model`, at `temperature` or 0."""
+
+    def _factory() -> ChatOpenAI:
+        import httpx
+        from langchain_openai import ChatOpenAI
+
+        limits = httpx.Limits(**HTTP_LIMITS)
+        http_client = {"http_async_client": httpx.AsyncClient(limits=limits)} if asynchronous else {"http_client": httpx.Client(limits=limits)}
+        return ChatOpenAI(
+            model=model,
+            temperature=0 if temperature is None else temperature,
+            api_key=getenv("OPENROUTER_API_KEY"),
+            base_url=OPENROUTER_BASE_URL,
+            max_retries=0,  # 429s and 5xx are retried by `ratelimit`, which also adapts the concurrency
+            **http_client,
+        )
+
+    return _get_or_create(("chat_model", model, temperature), _factory, asynchronous)
+
+
+def get_structured_llm(model: str, schema: type[BaseModel], asynchronous: bool = False, temperature: Optional[float] = None):
+    """Get the shared OpenRouter chat model bound to the structured output `schema`, returning the raw message alongside for its token usage.
+
+    The model is bound to the precompiled tool of `schema`, so the parsed output is the tool arguments as a dict, validated into `schema` by the caller.
+    """
+    # Upon langchain_openai==0.3.0, the default method changed from “function_calling” to “json_schema”. Pydantic model would cause error and thus it requires to specify to "function_calling". Other BaseChatModel does not support the argument `method` and thus it remains no argument.
+    return _get_or_create(
+        ("structured_llm", model, schema, temperature),
+        lambda: get_chat_model(model, asynchronous, temperature).with_structured_output(openai_tool(schema), method="function_calling", include_raw=True),
+        asynchronous,
+    )
+
+
+def get_tool_llm(model: str, schema: type[BaseModel], asynchronous: bool = False):
+    """Get the shared OpenRouter chat model forced to call the precompiled tool of `schema`, for streaming its arguments as they are generated."""
+    tool = openai_tool(schema)
+    return _get_or_create(
+        ("tool_llm", model, schema),
+        lambda: get_chat_model(model, asynchronous).bind_tools([tool], tool_choice=tool["function"]["name"]),
+        asynchronous,
+    )
+
+
+def get_gemini_client(asynchronous: bool = False) -> Client:
+    """Get the shared Gemini client. Use `.aio` on the async one."""
+
+    def _factory() -> Client:
+        from google.genai import Client
+
+        return Client(
+            api_key=getenv("GEMINI_API_KEY"),
+            http_options={"timeout": 600000},  # 10 minutes
+        )
+
+    return _get_or_create(("gemini",), _factory, asynchronous)
+
+
+def _keepalive_channel(transport_class: type, host: str, **kwargs) -> Any:
+    """Create the transport channel with keep-alive options added."""
+    kwargs["options"] = [*kwargs.get("options", []), *GRPC_KEEPALIVE_OPTIONS]
+    return transport_class.create_channel(host, **kwargs)
+
+
+def get_documentai_client(
+    location: str,
+    asynchronous: bool = False,
+) -> documentai.DocumentProcessorServiceClient | documentai.DocumentProcessorServiceAsyncClient:
+    """Get the shared Document AI client for the regional endpoint of `location`."""
+    # You must set the `api_endpoint` if you use a location other than "us".
+    api_endpoint = f"{location}-documentai.googleapis.com"
+
+    def _factory():
+        from google.api_core.client_options import ClientOptions
+        from google.cloud import documentai
+
+        if asynchronous:
+            client_class = documentai.DocumentProcessorServiceAsyncClient
+            transport_class = client_class.get_transport_class("grpc_asyncio")
+        else:
+            client_class = documentai.DocumentProcessorServiceClient
+            transport_class = client_class.get_transport_class("grpc")
+        return client_class(
+            client_options=ClientOptions(api_endpoint=api_endpoint),
+            transport=partial(transport_class, channel=partial(_keepalive_channel, transport_class)),
+        )
+
+    return _get_or_create(("documentai", api_endpoint), _factory, asynchronous)
+
+
+@lru_cache(maxsize=None)
+def processor_name(project_id: str, location: str, processor_id: str, processor_version: str) -> str:
+    """The full resource name of the processor version.
+
+    e.g. `projects/{project_id}/locations/{location}/processors/{processor_id}/processorVersions/{processor_version_id}`
+    """
+    from google.cloud import documentai
+
+    return documentai.DocumentProcessorServiceClient.processor_version_path(project_id, location, processor_id, processor_version)
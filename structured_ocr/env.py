@@ -0,0 +1,17 @@
+import os
+from functools import cache
+from typing import Optional
+
+
+@cache
+def load_env() -> None:
+    """Load `.env` into the environment once, on first use instead of at import."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+
+def getenv(key: str, default: Optional[str] = None) -> Optional[str]:
+    """`os.getenv` after loading `.env`."""
+    load_env()
+    return os.getenv(key, default)
@@ -1,8 +1,60 @@
-from .graph import batch_run_graph, run_graph
-from .llm import run_llm
-
-__all__ = [
-    "run_llm",
-    "run_graph",
-    "batch_run_graph",
-]
+from importlib import import_module
+from typing import TYPE_CHECKING
+
+# Exports are resolved on first access, so importing the package does not load langgraph or the provider SDKs
+_EXPORTS = {
+    "run_llm": ".llm",
+    "arun_llm": ".llm",
+    "run_llm_streaming": ".streaming",
+    "arun_llm_streaming": ".streaming",
+    "StreamAborted": ".streaming",
+    "run_graph": ".graph",
+    "arun_graph": ".graph",
+    "batch_run_graph": ".graph",
+    "abatch_run_graph": ".graph",
+    "run_pages": ".graph",
+    "arun_pages": ".graph",
+    "cascade_stats": ".cascade",
+    "CascadeTier": ".configuration",
+    "Profile": ".profiles",
+    "register_profile": ".profiles",
+    "get_profile": ".profiles",
+    "stream_run_graph": ".stream",
+    "astream_run_graph": ".stream",
+    "iter_image_paths": ".stream",
+    "bulk_run_graph": ".batch",
+    "GeminiBatchBackend": ".batch",
+    "LocalBatchBackend": ".batch",
+    "ExtractionService": ".server",
+    "create_app": ".server",
+    "open_queue": ".workqueue",
+    "register_queue_backend": ".workqueue",
+    "SQLiteQueue": ".workqueue",
+    "RedisQueue": ".workqueue",
+    "WorkerSettings": ".workqueue",
+    "run_worker": ".workqueue",
+    "arun_worker": ".workqueue",
+    "queue_stats": ".workqueue",
+}
+
+if TYPE_CHECKING:
+    from .batch import GeminiBatchBackend, LocalBatchBackend, bulk_run_graph
+    from .cascade import cascade_stats
+    from .configuration import CascadeTier
+    from .graph import abatch_run_graph, arun_graph, arun_pages, batch_run_graph, run_graph, run_pages
+    from .llm import arun_llm, run_llm
+    from .profiles import Profile, get_profile, register_profile
+    from .server import ExtractionService, create_app
+    from .stream import astream_run_graph, iter_image_paths, stream_run_graph
+    from .streaming import StreamAborted, arun_llm_streaming, run_llm_streaming
+    from .workqueue import RedisQueue, SQLiteQueue, WorkerSettings, arun_worker, open_queue, queue_stats, register_queue_backend, run_worker
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
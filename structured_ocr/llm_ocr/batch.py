@@ -0,0 +1,395 @@
+from __future__ import annotations
+
+import base64
+import json
+import time
+import uuid
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import IO, TYPE_CHECKING, Callable, Iterable, Iterator, Literal, Optional
+
+from pydantic import BaseModel
+
+from ..clients import get_gemini_client
+from ..ocr import serialize_layout
+from ..specs import json_schema
+from ..telemetry import log
+from ..utils import ImagePayload, count_pages, is_multipage
+from .cache import cached_run_ocr, get_stage_cache, llm_cache_key
+from .configuration import Configuration
+from .graph import GraphState, apply_correction, checker_request, correction_plan, extraction_request, local_validator, page_state, prepare_image, should_check, should_continue
+from .llm import run_llm
+from .normalize import normalize_results
+from .pages import ocr_page_texts, reduce_pages
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+
+BatchStatus = Literal["pending", "running", "succeeded", "failed"]
+
+
+def request_to_line(custom_id: str, request: dict) -> dict:
+    """Serialize a `run_llm` request into a provider-neutral batch line."""
+    payload: Optional[ImagePayload] = request.get("reference_image")
+    return {
+        "custom_id": custom_id,
+        "model": request["model"],
+        "prompt": request["prompt"],
+        "reference_text": request.get("reference_text"),
+        "image": {"mime_type": payload.mime_type, "data": payload.base64} if payload else None,
+    }
+
+
+def line_to_request(line: dict, schema: type[BaseModel]) -> dict:
+    """Rebuild the `run_llm` request from a batch line."""
+    image = line.get("image")
+    return {
+        "model": line["model"],
+        "prompt": line["prompt"],
+        "reference_image": ImagePayload(data=base64.b64decode(image["data"]), mime_type=image["mime_type"]) if image else None,
+        "reference_text": line.get("reference_text"),
+        "schema": schema,
+    }
+
+
+class BatchBackend(ABC):
+    """A provider batch API: submit a JSONL job file, poll it, then read the results."""
+
+    @abstractmethod
+    def submit(self, requests_path: Path, model: str, schema: type[BaseModel]) -> str:
+        """Submit the job file and return the job id."""
+
+    @abstractmethod
+    def poll(self, job_id: str) -> BatchStatus:
+        """Get the status of the job."""
+
+    @abstractmethod
+    def results(self, job_id: str) -> dict[str, str]:
+        """Get the JSON output of each succeeded request, keyed by `custom_id`."""
+
+
+class LocalBatchBackend(BatchBackend):
+    """A file-based stand-in for a provider batch API.
+
+    Jobs live under `directory/<job_id>/`, and run when first polled through `responder`, which defaults to calling `run_llm` online.
+    """
+
+    def __init__(self, directory: str, responder: Optional[Callable[[dict, type[BaseModel]], str]] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.responder = responder or self._run_online
+        self._schemas: dict[str, type[BaseModel]] = {}
+
+    @staticmethod
+    def _run_online(line: dict, schema: type[BaseModel]) -> str:
+        return run_llm(**line_to_request(line, schema)).model_dump_json()
+
+    def submit(self, requests_path: Path, model: str, schema: type[BaseModel]) -> str:
+        job_id = uuid.uuid4().hex
+        job_dir = self.directory / job_id
+        job_dir.mkdir()
+        (job_dir / "requests.jsonl").write_bytes(Path(requests_path).read_bytes())
+        self._schemas[job_id] = schema
+        return job_id
+
+    def poll(self, job_id: str) -> BatchStatus:
+        job_dir = self.directory / job_id
+        if not (job_dir / "results.jsonl").exists():
+            schema = self._schemas[job_id]
+            with open(job_dir / "requests.jsonl") as requests, open(job_dir / "results.jsonl", "w") as results:
+                for raw in requests:
+                    line = json.loads(raw)
+                    try:
+                        output = {"custom_id": line["custom_id"], "response": self.responder(line, schema)}
+                    except Exception as e:
+                        output = {"custom_id": line["custom_id"], "error": str(e)}
+                    results.write(json.dumps(output) + "\n")
+        return "succeeded"
+
+    def results(self, job_id: str) -> dict[str, str]:
+        with open(self.directory / job_id / "results.jsonl") as results:
+            lines = [json.loads(raw) for raw in results]
+        return {line["custom_id"]: line["response"] for line in lines if "response" in line}
+
+
+class GeminiBatchBackend(BatchBackend):
+    """Gemini Batch API, billed at the discounted batch rate."""
+
+    _STATES: dict[str, BatchStatus] = {
+        "JOB_STATE_PENDING": "pending",
+        "JOB_STATE_QUEUED": "pending",
+        "JOB_STATE_RUNNING": "running",
+        "JOB_STATE_SUCCEEDED": "succeeded",
+        "JOB_STATE_FAILED": "failed",
+        "JOB_STATE_CANCELLED": "failed",
+        "JOB_STATE_EXPIRED": "failed",
+    }
+
+    def submit(self, requests_path: Path, model: str, schema: type[BaseModel]) -> str:
+        response_schema = json_schema(schema)
+        gemini_path = Path(requests_path).with_suffix(".gemini.jsonl")
+        with open(requests_path) as requests, open(gemini_path, "w") as gemini_requests:
+            for raw in requests:
+                line = json.loads(raw)
+                parts = [{"text": line["prompt"]}]
+                if line["image"]:
+                    parts.append({"inlineData": {"mimeType": line["image"]["mime_type"], "data": line["image"]["data"]}})
+                if line["reference_text"]:
+                    parts.append({"text": line["reference_text"]})
+                request = {
+                    "contents": [{"role": "user", "parts": parts}],
+                    "generationConfig": {
+                        "temperature": 0,
+                        "responseMimeType": "application/json",
+                        "responseJsonSchema": response_schema,
+                        "thinkingConfig": {"thinkingBudget": 1024},
+                    },
+                }
+                gemini_requests.write(json.dumps({"key": line["custom_id"], "request": request}) + "\n")
+
+        client = get_gemini_client()
+        uploaded = client.files.upload(file=gemini_path, config={"mime_type": "jsonl"})
+        job = client.batches.create(model=model, src=uploaded.name)
+        return job.name
+
+    def poll(self, job_id: str) -> BatchStatus:
+        job = get_gemini_client().batches.get(name=job_id)
+        return self._STATES.get(job.state.name, "running")
+
+    def results(self, job_id: str) -> dict[str, str]:
+        client = get_gemini_client()
+        job = client.batches.get(name=job_id)
+        content = client.files.download(file=job.dest.file_name).decode("utf-8")
+
+        outputs = {}
+        for raw in content.splitlines():
+            line = json.loads(raw)
+            candidates = line.get("response", {}).get("candidates") or []
+            if candidates:
+                parts = candidates[0].get("content", {}).get("parts", [])
+                outputs[line["key"]] = "".join(part.get("text", "") for part in parts if not part.get("thought"))
+        return outputs
+
+
+def _run_stage(
+    stage: str,
+    requests: Iterable[tuple[int, dict]],
+    backend: BatchBackend,
+    configuration: Configuration,
+    work_dir: Path,
+    poll_interval: float,
+) -> dict[int, BaseModel]:
+    """Run one stage for many images as batch jobs, one job per model and schema.
+
+    Each request is written to its job file as soon as it is built and then dropped, so only one encoded image is held at a time.
+
+    Args:
+        stage (str): The stage name, used for the job files.
+        requests (Iterable[tuple[int, dict]]): The `run_llm` requests with their image index, built lazily.
+        backend (BatchBackend): The batch backend.
+        configuration (Configuration): The run configuration.
+        work_dir (Path): Where to write the job files.
+        poll_interval (float): Seconds between polls.
+
+    Returns:
+        dict[int, BaseModel]: The parsed outputs of the requests that succeeded.
+    """
+    cache = get_stage_cache(configuration)
+    outputs: dict[int, BaseModel] = {}
+    cache_keys: dict[int, Optional[str]] = {}
+    # One job file per model and schema
+    job_files: dict[tuple[str, type[BaseModel]], tuple[Path, IO[str]]] = {}
+    try:
+        for index, request in requests:
+            cache_key = llm_cache_key(**request) if cache is not None else None
+            if cache_key is not None and (cached := cache.get(cache_key)) is not None:
+                outputs[index] = request["schema"].model_validate_json(cached)
+                continue
+            job = (request["model"], request["schema"])
+            if job not in job_files:
+                requests_path = work_dir / f"{stage}-{uuid.uuid4().hex[:8]}.jsonl"
+                job_files[job] = (requests_path, open(requests_path, "w"))
+            job_files[job][1].write(json.dumps(request_to_line(str(index), request)) + "\n")
+            cache_keys[index] = cache_key
+    finally:
+        for _, requests_file in job_files.values():
+            requests_file.close()
+
+    jobs: dict[str, type[BaseModel]] = {}
+    for (model, schema), (requests_path, _) in job_files.items():
+        jobs[backend.submit(requests_path, model, schema)] = schema
+        log(f"📦 Submitted {stage} batch job for {model}: {requests_path}")
+
+    while waiting := [job_id for job_id in jobs if backend.poll(job_id) in ("pending", "running")]:
+        log(f"⏳ Waiting for {len(waiting)} {stage} batch job(s)")
+        time.sleep(poll_interval)
+
+    for job_id, schema in jobs.items():
+        if backend.poll(job_id) == "failed":
+            log(f"❌ {stage} batch job failed: {job_id}", "error")
+            continue
+        for custom_id, text in backend.results(job_id).items():
+            index = int(custom_id)
+            try:
+                outputs[index] = schema.model_validate_json(text)
+            except ValueError as e:
+                log(f"❌ Invalid {stage} output for request {custom_id}: {e}", "warning")
+                continue
+            if cache_keys.get(index) is not None:
+                cache.set(cache_keys[index], text)
+
+    return outputs
+
+
+def _encode(state: GraphState, configuration: Configuration) -> bool:
+    """Encode the image into `state.image_payload`, logging an image that cannot be read so the rest of the batch goes on without it."""
+    try:
+        state.image_payload = prepare_image(state.image_path, configuration, state.page)[1]
+    except Exception as e:
+        log(f"❌ Could not read the image: {state.image_path}: {e}", "warning")
+        return False
+    return True
+
+
+def _build_requests(states: dict[int, GraphState], build: Callable[[GraphState], dict], configuration: Configuration) -> Iterator[tuple[int, dict]]:
+    """Build the requests one at a time, with the image encoded only until its request has been written out."""
+    for index, state in states.items():
+        if not _encode(state, configuration):
+            continue
+        request = build(state)
+        state.image_payload = None
+        yield index, request
+
+
+def _correction_requests(invalid: dict[int, GraphState], configuration: Configuration, corrections: dict[int, list[str]]) -> Iterator[tuple[int, dict]]:
+    """Build the corrector requests like `_build_requests`, recording the fields each one corrects into `corrections`."""
+    for index, state in invalid.items():
+        if not _encode(state, configuration):
+            continue
+        plan = correction_plan(state, configuration)
+        state.image_payload = None
+        if isinstance(plan, tuple):
+            request, corrections[index] = plan
+            yield index, request
+
+
+def bulk_run_graph(
+    image_paths: list[str],
+    backend: BatchBackend,
+    config: Optional[RunnableConfig] = None,
+    work_dir: Optional[str] = None,
+    poll_interval: float = 30.0,
+) -> list[Optional[dict]]:
+    """Run the graph for many images through a provider batch backend.
+
+    Each stage (extraction, then checker and corrector rounds) goes out as batch jobs covering every image still in that stage, with the same routing as the graph. PDFs and TIFFs are expanded into one image per page like `run_pages`, and the page results combined with `Configuration.page_reducer`.
+
+    Args:
+        image_paths (list[str]): The images, PDFs or TIFFs to process.
+        backend (BatchBackend): The batch backend, e.g. `GeminiBatchBackend()` or `LocalBatchBackend(directory)`.
+        config (Optional[RunnableConfig]): The config shared by every image.
+        work_dir (Optional[str]): Where to write the job files, defaults to `./batch_jobs`.
+        poll_interval (float): Seconds between polls.
+
+    Returns:
+        list[Optional[dict]]: The results in the same order as `image_paths`, None where extraction failed.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    work_path = Path(work_dir or "batch_jobs")
+    work_path.mkdir(parents=True, exist_ok=True)
+
+    def _expand(image_path: str) -> list[GraphState]:
+        # A PDF or TIFF is OCRed as one document when it fits one request, like `run_pages`
+        if not is_multipage(image_path):
+            return [GraphState(image_path=image_path)]
+        try:
+            pages = count_pages(image_path)
+            page_texts = ocr_page_texts(image_path, pages, configuration)
+        except Exception as e:
+            log(f"❌ Could not read the document: {image_path}: {e}", "warning")
+            return []
+        return [GraphState(**page_state(image_path, page, page_texts)) for page in range(pages)]
+
+    # The states of every page of every document, and the indices of each document's states
+    states: dict[int, GraphState] = {}
+    documents: list[list[int]] = []
+    with ThreadPoolExecutor(max_workers=configuration.bulk_ocr_concurrency) as executor:
+        for document_states in executor.map(_expand, image_paths):
+            documents.append(list(range(len(states), len(states) + len(document_states))))
+            states.update(zip(documents[-1], document_states))
+
+    # Document AI has no matching bulk online API, so OCR runs concurrently per image
+    if configuration.use_ocr:
+
+        def _ocr(state: GraphState) -> bool:
+            if state.page_text is not None:
+                return True
+            try:
+                image, image_payload = prepare_image(state.image_path, configuration, state.page)
+                state.ocr_text_extraction_result = cached_run_ocr(configuration, image_payload)
+                if configuration.use_layout:
+                    state.ocr_layout = serialize_layout(state.ocr_text_extraction_result, image=image)
+            except Exception as e:
+                log(f"❌ OCR failed: {state.image_path}: {e}", "warning")
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=configuration.bulk_ocr_concurrency) as executor:
+            ocred = dict(zip(states, executor.map(_ocr, states.values())))
+        # Images that failed OCR stay None in the results
+        states = {index: state for index, state in states.items() if ocred[index]}
+
+    requests = _build_requests(states, lambda state: extraction_request(state, configuration), configuration)
+    for index, result in _run_stage("extraction", requests, backend, configuration, work_path, poll_interval).items():
+        states[index].llm_text_extraction_result = result
+
+    active = {index: state for index, state in states.items() if state.llm_text_extraction_result is not None}
+    while active:
+        # The rule-based checks settle what they can before any checker call
+        to_check, invalid = {}, {}
+        for index, state in active.items():
+            for field, value in local_validator(state, config).items():
+                setattr(state, field, value)
+            route = should_check(state, config)
+            if route == "check":
+                to_check[index] = state
+            elif route == "invalid":
+                invalid[index] = state
+
+        requests = _build_requests(to_check, lambda state: checker_request(state.llm_text_extraction_result, state.image_payload, configuration), configuration)
+        criteria = _run_stage("checker", requests, backend, configuration, work_path, poll_interval)
+        for index, state in to_check.items():
+            state.criteria = criteria.get(index)
+            # Images whose check failed keep their current result
+            if state.criteria is not None and should_continue(state, config) == "invalid":
+                invalid[index] = state
+
+        corrections: dict[int, list[str]] = {}
+        requests = _correction_requests(invalid, configuration, corrections)
+        corrected = _run_stage("corrector", requests, backend, configuration, work_path, poll_interval)
+
+        active = {}
+        for index, result in corrected.items():
+            for field, value in apply_correction(states[index], result, corrections[index]).items():
+                setattr(states[index], field, value)
+            active[index] = states[index]
+
+    results: list[Optional[BaseModel]] = []
+    for image_path, indices in zip(image_paths, documents):
+        page_results = [states[index].llm_text_extraction_result if index in states else None for index in indices]
+        if not page_results or not is_multipage(image_path):
+            results.append(page_results[0] if page_results else None)
+            continue
+        try:
+            results.append(reduce_pages(page_results, configuration))
+        except ValueError as e:
+            log(f"❌ Could not combine the pages: {image_path}: {e}", "warning")
+            results.append(None)
+
+    if configuration.text_conversion:
+        # Every document of the batch in one conversion call
+        present = [index for index, result in enumerate(results) if result is not None]
+        for index, result in zip(present, normalize_results([results[index] for index in present], configuration.text_conversion)):
+            results[index] = result
+    return [result.model_dump() if result is not None else None for result in results]
@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional
+
+from PIL import Image
+from pydantic import BaseModel
+
+from ..ocr import arun_ocr, run_ocr
+from ..specs import json_schema
+from ..telemetry import annotate, span
+from ..utils import ImagePayload, sniff_mime_type
+from .configuration import Configuration
+from .hedge import ahedged_run_llm, hedged_run_llm
+from .packing import apacked_run_llm, packed_run_llm
+from .streaming import PartialResult, arun_llm_streaming, run_llm_streaming
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+    from .profiles import Profile
+
+# Writes between two eviction sweeps, so the table may exceed `max_entries` by fewer rows until the next one
+EVICT_EVERY_WRITES = 256
+
+# Configuration fields that do not change the extraction result and thus stay out of the cache key
+RUNTIME_FIELDS = {"use_result_cache", "cache_path", "cache_ttl_seconds", "cache_max_entries", "use_stage_cache", "stage_cache_max_entries", "max_pages_in_flight", "bulk_ocr_concurrency", "hedge_requests", "hedge_quantile", "hedge_after_seconds", "cascade_tier", "pack_window_seconds"}
+
+
+class CacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SQLiteCache:
+    """A persistent key-value store on SQLite with TTL and size-based LRU eviction.
+
+    Eviction runs on the first write and then every `EVICT_EVERY_WRITES` writes, so a write stays cheap however large the table grows. Each sweep deletes the expired entries and then the least recently used ones over `max_entries`, in one batch each.
+
+    Safe to share across threads, and across processes through SQLite's own locking.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        table: str = "cache",
+        ttl_seconds: Optional[int] = None,
+        max_entries: Optional[int] = None,
+    ):
+        Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats = CacheStats()
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(Path(path).expanduser(), check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed_at ON {table} (accessed_at)")
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_created_at ON {table} (created_at)")
+
+    def get(self, key: str) -> Optional[bytes | str]:
+        """Get the value under `key`, or None on a miss or when expired."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds is not None and now - row[1] > self.ttl_seconds:
+                self._connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                self.stats.evictions += 1
+                row = None
+
+            if row is None:
+                self.stats.misses += 1
+                return None
+
+            self._connection.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+            self.stats.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: bytes | str) -> None:
+        """Store `value` under `key`, evicting expired and least recently used entries every `EVICT_EVERY_WRITES` writes."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._writes += 1
+            if self._writes % EVICT_EVERY_WRITES == 1:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        # Both deletes walk the indexes from the oldest entry, touching only the rows they remove
+        if self.ttl_seconds is not None:
+            cursor = self._connection.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.stats.evictions += cursor.rowcount
+
+        if self.max_entries is not None:
+            excess = self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+            if excess > 0:
+                cursor = self._connection.execute(f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)", (excess,))
+                self.stats.evictions += cursor.rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._connection.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+@lru_cache(maxsize=None)
+def open_cache(path: str, table: str, ttl_seconds: Optional[int], max_entries: Optional[int]) -> SQLiteCache:
+    """Open the cache table once per process."""
+    return SQLiteCache(path, table=table, ttl_seconds=ttl_seconds, max_entries=max_entries)
+
+
+def hash_bytes(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _fingerprint(data: object) -> str:
+    return hash_bytes(json.dumps(data, sort_keys=True, default=str).encode("utf-8"))
+
+
+def result_cache_key(image_content: bytes, configuration: Configuration, profile: Profile) -> str:
+    """Key of a whole graph run: image content, the profile's schemas and prompts, and configuration.
+
+    Args:
+        image_content (bytes): The raw image file.
+        configuration (Configuration): The run configuration.
+        profile (Profile): The profile of the run.
+
+    Returns:
+        str: The cache key.
+    """
+    return _fingerprint(
+        {
+            "image": hash_bytes(image_content),
+            "profile": profile.fingerprint,
+            "configuration": configuration.model_dump(exclude=RUNTIME_FIELDS),
+        }
+    )
+
+
+def get_result_cache(configuration: Configuration) -> Optional[SQLiteCache]:
+    """Get the whole-result cache, or None when disabled."""
+    if not configuration.use_result_cache:
+        return None
+    return open_cache(configuration.cache_path, "results", configuration.cache_ttl_seconds, configuration.cache_max_entries)
+
+
+def get_stage_cache(configuration: Configuration) -> Optional[SQLiteCache]:
+    """Get the per-call OCR and LLM cache, or None when bypassed."""
+    if not configuration.use_stage_cache:
+        return None
+    return open_cache(configuration.cache_path, "stages", configuration.cache_ttl_seconds, configuration.stage_cache_max_entries)
+
+
+@lru_cache(maxsize=None)
+def _schema_fingerprint(schema: type[BaseModel]) -> str:
+    return _fingerprint(json_schema(schema))
+
+
+def llm_cache_key(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: type[BaseModel] = None,
+    temperature: Optional[float] = None,
+) -> str:
+    """Key of a single `run_llm` call, the default temperature leaving the key as it was before calls could set one."""
+    if isinstance(reference_image, Image.Image):
+        reference_image = ImagePayload.from_image(reference_image)
+    if isinstance(reference_image, list):
+        image = [payload.sha256 if payload else None for payload in reference_image]
+    else:
+        image = reference_image.sha256 if reference_image else None
+    key = {
+        "stage": "llm",
+        "model": model,
+        "prompt": prompt,
+        "image": image,
+        "reference_text": reference_text,
+        "schema": _schema_fingerprint(schema),
+    }
+    if temperature is not None:
+        key["temperature"] = temperature
+    return _fingerprint(key)
+
+
+def ocr_cache_key(content: bytes | ImagePayload, backend: str = "documentai") -> str:
+    """Key of a single `run_ocr` call."""
+    if isinstance(content, bytes):
+        content = ImagePayload(data=content, mime_type=sniff_mime_type(content) or "image/png")
+    return _fingerprint({"stage": "ocr", "image": content.sha256, "mime_type": content.mime_type, "backend": backend})
+
+
+def _llm_fields(request: dict) -> dict:
+    """Span fields of a `run_llm` call."""
+    images = request.get("reference_image")
+    texts = request.get("reference_text")
+    text = request["prompt"] + "".join(text or "" for text in (texts if isinstance(texts, list) else [texts]))
+    image_bytes = sum(len(image.data) for image in (images if isinstance(images, list) else [images]) if isinstance(image, ImagePayload))
+    return {"model": request["model"], "payload_bytes": image_bytes + len(text.encode("utf-8")), "schema": request["schema"].__name__}
+
+
+def _ocr_fields(content: bytes | ImagePayload) -> dict:
+    """Span fields of a `run_ocr` call."""
+    return {"payload_bytes": len(content.data if isinstance(content, ImagePayload) else content)}
+
+
+def cached_run_llm(configuration: Configuration, pack: bool = False, on_partial: Optional[Callable[[PartialResult], None]] = None, **request) -> BaseModel:
+    """`run_llm` memoized in the stage cache, and hedged when configured.
+
+    With `pack`, a miss shares one call with the documents in flight with the same model, prompt and schema, see `packed_run_llm`. With `on_partial`, a miss is streamed instead, see `run_llm_streaming`.
+    """
+    if on_partial is not None:
+        run = partial(run_llm_streaming, on_partial=on_partial)
+    else:
+        run = partial(packed_run_llm if pack else hedged_run_llm, configuration)
+    with span("run_llm", "llm", **_llm_fields(request)):
+        cache = get_stage_cache(configuration)
+        if cache is None:
+            return run(**request)
+
+        key = llm_cache_key(**request)
+        if (cached := cache.get(key)) is not None:
+            annotate(cache_hit=True)
+            return request["schema"].model_validate_json(cached)
+
+        annotate(cache_hit=False)
+        result = run(**request)
+        if result is not None:
+            cache.set(key, result.model_dump_json())
+        return result
+
+
+async def acached_run_llm(configuration: Configuration, pack: bool = False, on_partial: Optional[Callable[[PartialResult], None]] = None, **request) -> BaseModel:
+    """Async version of `cached_run_llm`."""
+    if on_partial is not None:
+        run = partial(arun_llm_streaming, on_partial=on_partial)
+    else:
+        run = partial(apacked_run_llm if pack else ahedged_run_llm, configuration)
+    with span("run_llm", "llm", **_llm_fields(request)):
+        cache = get_stage_cache(configuration)
+        if cache is None:
+            return await run(**request)
+
+        key = llm_cache_key(**request)
+        if (cached := await asyncio.to_thread(cache.get, key)) is not None:
+            annotate(cache_hit=True)
+            return request["schema"].model_validate_json(cached)
+
+        annotate(cache_hit=False)
+        result = await run(**request)
+        if result is not None:
+            await asyncio.to_thread(cache.set, key, result.model_dump_json())
+        return result
+
+
+def cached_run_ocr(configuration: Configuration, content: bytes | ImagePayload) -> documentai.Document:
+    """`run_ocr` memoized in the stage cache."""
+    from google.cloud import documentai
+
+    with span("run_ocr", "ocr", backend=configuration.ocr_backend, **_ocr_fields(content)):
+        cache = get_stage_cache(configuration)
+        if cache is None:
+            return run_ocr(content, configuration.ocr_backend)
+
+        key = ocr_cache_key(content, configuration.ocr_backend)
+        if (cached := cache.get(key)) is not None:
+            annotate(cache_hit=True)
+            return documentai.Document.deserialize(cached)
+
+        annotate(cache_hit=False)
+        document = run_ocr(content, configuration.ocr_backend)
+        cache.set(key, documentai.Document.serialize(document))
+        return document
+
+
+async def acached_run_ocr(configuration: Configuration, content: bytes | ImagePayload) -> documentai.Document:
+    """Async version of `cached_run_ocr`."""
+    from google.cloud import documentai
+
+    with span("run_ocr", "ocr", backend=configuration.ocr_backend, **_ocr_fields(content)):
+        cache = get_stage_cache(configuration)
+        if cache is None:
+            return await arun_ocr(content, configuration.ocr_backend)
+
+        key = ocr_cache_key(content, configuration.ocr_backend)
+        if (cached := await asyncio.to_thread(cache.get, key)) is not None:
+            annotate(cache_hit=True)
+            return documentai.Document.deserialize(cached)
+
+        annotate(cache_hit=False)
+        document = await arun_ocr(content, configuration.ocr_backend)
+        await asyncio.to_thread(cache.set, key, documentai.Document.serialize(document))
+        return document
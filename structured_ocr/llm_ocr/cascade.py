@@ -0,0 +1,96 @@
+"""Model cascade: each image is run on the cheapest tier first and escalated only when the result fails the tier's gate.
+
+The gates, in order:
+- schema: the result, corrections merged in, still validates against the profile's target schema.
+- local: the profile's rule-based checks find no hard issue.
+- checker: when the LLM checker had the last word, it found enough criteria met.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Literal, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from .configuration import CascadeTier, Configuration
+from .profiles import configured_profile
+from .validation import criteria_met_percentage
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+
+
+class TierStats(BaseModel):
+    attempted: int = 0
+    resolved: int = 0  # Images whose final result came from this tier
+    escalated: int = 0  # Images whose result failed the gate
+    errors: int = 0  # Images whose run failed, escalated unless on the last tier
+
+    @property
+    def resolve_rate(self) -> float:
+        return self.resolved / self.attempted if self.attempted else 0.0
+
+
+_stats: dict[str, TierStats] = {}
+_stats_lock = threading.Lock()
+
+
+def tier_config(config: Optional[RunnableConfig], index: int) -> RunnableConfig:
+    """The config running the graph on tier `index`."""
+    config = config or {}
+    return {**config, "configurable": {**config.get("configurable", {}), "cascade_tier": index}}
+
+
+def gate_failure(result: dict, tier: CascadeTier, configuration: Configuration) -> Optional[str]:
+    """Check a tier's graph output against its gates.
+
+    Args:
+        result (dict): The final graph state.
+        tier (CascadeTier): The tier that produced it.
+        configuration (Configuration): The top-level configuration.
+
+    Returns:
+        Optional[str]: Why the result fails the gate, None when it passes.
+    """
+    extraction = result.get("llm_text_extraction_result")
+    if extraction is None:
+        return "no result"
+
+    profile = configured_profile(configuration)
+    if "schema" in tier.gates:
+        try:
+            profile.target_schema.model_validate(extraction.model_dump())
+        except ValidationError as e:
+            return f"{e.error_count()} schema errors"
+
+    if "local" in tier.gates and (hard := profile.check(extraction).hard):
+        return f"{sum(map(len, hard.values()))} rule-based issues"
+
+    # The criteria are only current when the checker ran after the last correction
+    if "checker" in tier.gates and result.get("local_validation_route") == "check" and result.get("criteria") is not None:
+        percentage_met = criteria_met_percentage(result["criteria"], configuration.criterion_score_threshold)
+        min_criteria_perc = tier.min_criteria_perc if tier.min_criteria_perc is not None else configuration.criteria_met_perc
+        if percentage_met < min_criteria_perc:
+            return f"{percentage_met:.0f}% of criteria met"
+
+    return None
+
+
+def record_tier(tier: CascadeTier, outcome: Literal["resolved", "escalated", "errors"]) -> None:
+    """Count one image attempted on `tier` and how it ended."""
+    with _stats_lock:
+        stats = _stats.setdefault(tier.label, TierStats())
+        stats.attempted += 1
+        setattr(stats, outcome, getattr(stats, outcome) + 1)
+
+
+def cascade_stats() -> dict[str, TierStats]:
+    """The stats of every tier seen by this process, by tier name."""
+    with _stats_lock:
+        return {label: stats.model_copy() for label, stats in _stats.items()}
+
+
+def reset_cascade_stats() -> None:
+    with _stats_lock:
+        _stats.clear()
@@ -1,28 +1,150 @@
+import json
 import os
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Literal, Optional
 
-from dotenv import load_dotenv
-from langchain_core.runnables import RunnableConfig
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 
-load_dotenv()
+from ..env import getenv, load_env
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+
+
+class CascadeTier(BaseModel):
+    """One tier of a model cascade, escalating to the next tier when its result fails the gate."""
+
+    llm_ocr: str = Field(description="The extraction and correction model of the tier")
+    llm_checker: Optional[str] = Field(default=None, description="The checker model of the tier, None to keep `Configuration.llm_checker`")
+    max_correction: Optional[int] = Field(default=None, description="The corrections allowed within the tier, None to keep `Configuration.max_correction`")
+    gates: list[Literal["schema", "local", "checker"]] = Field(default=["schema", "local", "checker"], description="The checks the result must pass to stop at this tier, ignored on the last tier")
+    min_criteria_perc: Optional[int] = Field(default=None, description="The percentage of criteria the checker must find met, None to keep `Configuration.criteria_met_perc`")
+    name: Optional[str] = Field(default=None, description="The name the tier's stats are kept under, `llm_ocr` by default")
+
+    @property
+    def label(self) -> str:
+        return self.name or self.llm_ocr
+
+    def overrides(self) -> dict[str, Any]:
+        """The `Configuration` fields the tier replaces."""
+        overrides = {"llm_ocr": self.llm_ocr, "llm_checker": self.llm_checker, "max_correction": self.max_correction}
+        return {field: value for field, value in overrides.items() if value is not None}
+
+
+class SpeculativeCandidate(BaseModel):
+    """One extra extraction raced against `llm_ocr`, a model and the settings it is sampled with."""
+
+    model_config = {"extra": "forbid"}
+
+    model: str = Field(description="The extraction model of the candidate")
+    temperature: Optional[float] = Field(default=None, description="The sampling temperature, None for the default of 0", ge=0, le=2)
+
+    @classmethod
+    def parse(cls, spec: str) -> "SpeculativeCandidate":
+        """Parse `model` or `model@temperature=0.7`."""
+        model, _, setting = spec.strip().partition("@")
+        if not setting:
+            return cls(model=model)
+        name, _, value = setting.partition("=")
+        return cls(model=model, **{name.strip(): value.strip()})
+
+    @property
+    def label(self) -> str:
+        return self.model if self.temperature is None else f"{self.model}@temperature={self.temperature:g}"
+
+    def overrides(self) -> dict[str, Any]:
+        """The `run_llm` arguments the candidate replaces."""
+        overrides = {"model": self.model, "temperature": self.temperature}
+        return {field: value for field, value in overrides.items() if value is not None}
 
 
 class Configuration(BaseModel):
-    use_ocr: bool = Field(default=False, description="Whether to use Google Document AI OCR")
-    llm_ocr: str = Field(default=os.getenv("LLM_OCR"), description="The LLM model to use for OCR")
-    llm_checker: str = Field(default=os.getenv("LLM_CHECKER"), description="The LLM model to use for checking the criteria")
+    profile: str = Field(default="scoreboard", description="The document type to extract, a name in `PROFILES` selecting the schema, criteria and prompts")
+    use_ocr: bool = Field(default=False, description="Whether to use OCR")
+    ocr_backend: str = Field(default="documentai", description="The OCR engine, a name in `OCR_BACKENDS`: 'documentai' for Google Document AI or 'tesseract' for local CPU OCR")
+    llm_ocr: str = Field(default_factory=lambda: getenv("LLM_OCR"), description="The LLM model to use for OCR")
+    llm_checker: str = Field(default_factory=lambda: getenv("LLM_CHECKER"), description="The LLM model to use for checking the criteria")
     max_correction: int = Field(default=3, description="The maximum number of corrections to attempt")
     criteria_met_perc: int = Field(default=80, description="The percentage of criteria that must be met to consider the result valid")
     criterion_score_threshold: int = Field(default=7, description="The score threshold for a criterion to be considered valid")
+    max_image_dimension: Optional[int] = Field(default=None, description="Downscale so the longer side is at most this many pixels, None to keep the resolution")
+    auto_crop: bool = Field(default=False, description="Whether to crop to the scoreboard region")
+    deskew: bool = Field(default=False, description="Whether to straighten rotated scans")
+    white_balance: bool = Field(default=False, description="Whether to apply gray-world white balance")
+    normalize_contrast: bool = Field(default=False, description="Whether to equalize contrast with CLAHE")
+    grayscale: bool = Field(default=False, description="Whether to drop colour, which loses the highlight colours")
+    image_format: Literal["original", "png", "jpeg", "webp"] = Field(default="original", description="The upload format, 'original' passes accepted formats through untouched")
+    image_quality: int = Field(default=90, description="The JPEG/WebP quality from 1 to 100", ge=1, le=100)
+    page_dpi: int = Field(default=200, description="The resolution PDF pages are rendered at")
+    page_reducer: str = Field(default="best", description="How per-page results of a PDF or TIFF are combined, a name in `PAGE_REDUCERS`")
+    max_pages_in_flight: int = Field(default=4, description="The maximum number of pages of one document decoded and extracted at once")
+    bulk_ocr_concurrency: int = Field(default=16, description="The maximum number of images OCRed at once by `bulk_run_graph`, which has no batch OCR API to submit to", ge=1)
+    ocr_layout: bool = Field(default=False, description="Whether to pass the OCR result as a row/column layout table with locally detected highlight colours instead of plain text")
+    text_only: Literal["off", "auto", "on"] = Field(default="off", description="Whether to extract from the OCR layout alone without uploading the image, 'auto' when the OCR quality score is at least `text_only_min_quality`")
+    text_only_min_quality: float = Field(default=0.8, description="The Document AI image quality score from 0 to 1 above which 'auto' skips the image", ge=0, le=1)
+    text_conversion: Optional[str] = Field(default=None, description="The OpenCC config applied to every string of the final result, e.g. 's2hk' for Hong Kong traditional Chinese, None to keep the text as extracted")
+    use_local_validation: bool = Field(default=True, description="Whether to run rule-based checks before the LLM checker, sending certainly wrong fields straight to the corrector")
+    skip_checker_when_valid: bool = Field(default=True, description="Whether to skip the LLM checker when the rule-based checks find nothing suspicious")
+    cascade: list[CascadeTier] = Field(default_factory=list, description="Model tiers from cheapest to most capable, each image stops at the first tier whose result passes its gate, empty to use `llm_ocr` alone")
+    cascade_tier: Optional[int] = Field(default=None, description="The cascade tier being run, set by the graph runner")
+    speculative_models: list[SpeculativeCandidate] = Field(default_factory=list, description="Extra candidates the extraction is raced on alongside `llm_ocr`, each a model with optional settings, e.g. `gemini-2.5-flash-lite` or `gemini-2.5-flash@temperature=0.7` to sample `llm_ocr` again differently")
+    speculative_policy: Literal["first_valid", "best_score"] = Field(default="first_valid", description="Keep the first candidate without certain rule-based issues, or score every candidate with the checker and keep the best")
+    hedge_requests: bool = Field(default=False, description="Whether to send a duplicate LLM call when one is slower than the usual tail latency of its model")
+    hedge_quantile: float = Field(default=0.95, description="The latency quantile of a model past which a call is hedged", gt=0, le=1)
+    hedge_after_seconds: Optional[float] = Field(default=None, description="A fixed hedging delay in seconds, None to follow `hedge_quantile` of the observed latencies")
+    packing: bool = Field(default=False, description="Whether the extraction and checker calls of documents in flight together share one LLM call per model, prompt and schema")
+    pack_max_documents: Optional[int] = Field(default=None, description="The most documents in one packed call, None to fit as many as the context and output limits of the model allow", ge=1)
+    pack_window_seconds: float = Field(default=0.05, description="How long the first document of a pack waits for others to join it", ge=0)
+    streaming: bool = Field(default=False, description="Whether the extraction is streamed, aborting a result the profile's partial checks find certainly wrong when a later cascade tier can take over, and starting the checker as soon as the result is complete. Ignored with `packing` or `speculative_models`")
+    use_result_cache: bool = Field(default=True, description="Whether to serve repeated images from the persistent result cache")
+    cache_path: str = Field(default="~/.cache/structured_ocr/cache.sqlite", description="The SQLite file backing the caches")
+    cache_ttl_seconds: Optional[int] = Field(default=7 * 24 * 3600, description="How long cached results stay valid, None to never expire")
+    cache_max_entries: Optional[int] = Field(default=100_000, description="The maximum number of cached results before evicting the least recently used")
+    use_stage_cache: bool = Field(default=True, description="Whether to memoize individual OCR and LLM responses, bypass to force fresh calls")
+    stage_cache_max_entries: Optional[int] = Field(default=1_000_000, description="The maximum number of memoized OCR and LLM responses before evicting the least recently used")
 
     class Config:
         env_prefix = ""
         case_sensitive = False
 
+    @field_validator("speculative_models", mode="before")
+    @classmethod
+    def split_models(cls, v: Any) -> Any:
+        # Environment variables give a comma-separated string
+        if isinstance(v, str):
+            v = [spec for spec in v.split(",") if spec.strip()]
+        if isinstance(v, list):
+            return [SpeculativeCandidate.parse(candidate) if isinstance(candidate, str) else candidate for candidate in v]
+        return v
+
+    @field_validator("cascade", mode="before")
+    @classmethod
+    def parse_cascade(cls, v: Any) -> Any:
+        # Environment variables give a JSON list of tiers
+        if isinstance(v, str):
+            return json.loads(v)
+        return v
+
+    @property
+    def use_layout(self) -> bool:
+        """Whether the OCR result is serialized as a layout table."""
+        return self.use_ocr and (self.ocr_layout or self.text_only != "off")
+
+    @property
+    def preprocessing(self) -> dict[str, Any]:
+        """The `preprocess_image` arguments."""
+        return {
+            "max_dimension": self.max_image_dimension,
+            "crop": self.auto_crop,
+            "straighten": self.deskew,
+            "balance": self.white_balance,
+            "contrast": self.normalize_contrast,
+            "grayscale": self.grayscale,
+        }
+
     @classmethod
-    def from_runnable_config(cls, config: Optional[RunnableConfig] = None) -> "Configuration":
+    def from_runnable_config(cls, config: Optional["RunnableConfig"] = None) -> "Configuration":
         """Create a Configuration instance from a RunnableConfig."""
+        load_env()
         if not config or "configurable" not in config:
             return cls()
 
@@ -43,4 +165,8 @@ class Configuration(BaseModel):
                 values[field_name] = config_value
             # If neither env nor config value exists, the field's default will be used
 
-        return cls(**values)
+        configuration = cls(**values)
+        if configuration.cascade_tier is not None:
+            # The tier's models win over the top-level ones, environment variables included
+            configuration = configuration.model_copy(update=configuration.cascade[configuration.cascade_tier].overrides())
+        return configuration
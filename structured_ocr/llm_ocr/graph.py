@@ -1,111 +1,322 @@
-import os
-from multiprocessing import Pool, cpu_count
-from typing import Optional
+from __future__ import annotations
+
+import asyncio
+import json
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
+from functools import cache, partial
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Iterator, Literal, Optional
 
-from dotenv import load_dotenv
-from google.cloud import documentai
 from langchain_core.runnables import RunnableConfig
-from langgraph.graph import END, START, StateGraph
-from langgraph.pregel import RetryPolicy
 from PIL import Image
-from pydantic import BaseModel, Field
-from rich import print
-from tqdm import tqdm
+from pydantic import BaseModel, Field, SerializeAsAny
 
-from ..ocr import run_ocr
-from ..utils import image_to_base64, image_to_bytes
+from ..ocr import ocr_quality, serialize_layout
+from ..telemetry import annotate, log, span, traced
+from ..utils import ImagePayload, count_pages, encode_array, encode_image, is_multipage, load_page, preprocess_image
+from .cache import acached_run_llm, acached_run_ocr, cached_run_llm, cached_run_ocr, get_result_cache, llm_cache_key, result_cache_key
+from .cascade import gate_failure, record_tier, tier_config
 from .configuration import Configuration
-from .llm import run_llm
-from .prompt import CHECKER_PROMPT, TEXT_EXTRACTION_PROMPT
-from .schema import CRITERIA_TO_RELATED_FIELDS, TARGET_SCHEMA, Criteria
+from .hedge import get_executor
+from .normalize import normalize_result
+from .pages import aocr_page_texts, ocr_page_texts, reduce_pages
+from .profiles import Profile, configured_profile
+from .schema import partial_schema
+from .speculative import aspeculative_extract, speculative_extract
+from .streaming import PartialResult, StreamAborted
+from .validation import criteria_met_percentage, route_local_validation
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+    from langgraph.graph.state import CompiledStateGraph
 
-load_dotenv()
+# The `configurable` key of the checker calls a graph run started ahead, see `_prefetch_scope`
+PREFETCHED_CHECKS = "prefetched_checks"
 
 
 class GraphState(BaseModel):
     model_config = {"arbitrary_types_allowed": True}  # For PIL.Image
     image_path: str
+    page: Optional[int] = Field(default=None)  # Zero-based page of a PDF or TIFF, None for a single image
+    page_text: Optional[str] = Field(default=None)  # OCR text of the page when the whole document went through OCR at once
     image: Optional[Image.Image] = Field(default=None, exclude=True)  # Exclude from serialization
-    image_bytes: Optional[bytes] = Field(default=None, exclude=True)  # Exclude from serialization
-    image_base64: Optional[str] = Field(default=None)
-    ocr_text_extraction_result: Optional[documentai.Document] = Field(default=None, exclude=True)  # Exclude from serialization
-    llm_text_extraction_result: Optional[TARGET_SCHEMA] = Field(default=None)
-    criteria: Optional[Criteria] = Field(default=None)
+    image_payload: Optional[ImagePayload] = Field(default=None, exclude=True)  # Encoded once, reused by every LLM and OCR call
+    ocr_text_extraction_result: Optional[Any] = Field(default=None, exclude=True)  # documentai.Document, typed loosely to keep the SDK out of import
+    ocr_layout: Optional[str] = Field(default=None)  # Row/column table of the OCR tokens, when `Configuration.use_layout`
+    llm_text_extraction_result: Optional[SerializeAsAny[BaseModel]] = Field(default=None)  # The `target_schema` of the profile
+    criteria: Optional[SerializeAsAny[BaseModel]] = Field(default=None)  # The `criteria` of the profile
     correction_attemps: int = Field(default=0)
+    local_validation_route: Optional[Literal["valid", "invalid", "check"]] = Field(default=None)
 
 
-def format_conversion(state: GraphState, config: RunnableConfig) -> dict[str, bytes | str]:
-    """Convert image to bytes and base64."""
+def prepare_image(image_path: str, configuration: Configuration, page: Optional[int] = None) -> tuple[Image.Image, ImagePayload]:
+    """Open, preprocess and encode the image, or a single page of a PDF or TIFF, as configured."""
+    if page is not None:
+        image = load_page(image_path, page, configuration.page_dpi)
+    else:
+        image = Image.open(image_path)
+        if not any(configuration.preprocessing.values()) and configuration.image_format == "original":
+            return image, encode_image(image_path, image)
+
+    array = preprocess_image(image, **configuration.preprocessing)
+    image_format = "png" if configuration.image_format == "original" else configuration.image_format
+    return Image.fromarray(array), encode_array(array, image_format, configuration.image_quality)
+
+
+def format_conversion(state: GraphState, config: RunnableConfig) -> dict[str, Image.Image | ImagePayload]:
+    """Preprocess and encode the image once for the whole graph."""
     configuration = Configuration.from_runnable_config(config)
 
-    image = Image.open(state.image_path)
-    image_base64 = image_to_base64(image)
+    image, image_payload = prepare_image(state.image_path, configuration, state.page)
 
-    result = {
+    log(f"🔄 Format Conversion complete: {state.image_path}")
+    return {
         "image": image,
-        "image_base64": image_base64,
+        "image_payload": image_payload,
     }
 
-    # Only convert to bytes if OCR is enabled
-    if configuration.use_ocr:
-        image_bytes = image_to_bytes(image)
-        result["image_bytes"] = image_bytes
 
-    print(f"🔄 Format Conversion complete: {state.image_path}")
-    return result
+async def aformat_conversion(state: GraphState, config: RunnableConfig) -> dict[str, Image.Image | ImagePayload]:
+    """Async version of `format_conversion`, decoding and encoding off the event loop."""
+    return await asyncio.to_thread(format_conversion, state, config)
 
 
-def ocr_text_extraction(state: GraphState, config: RunnableConfig) -> dict[str, documentai.Document]:
-    """Run OCR on the image."""
+def ocr_text_extraction(state: GraphState, config: RunnableConfig) -> dict[str, documentai.Document | str]:
+    """Run OCR on the image, and lay the tokens out as a table when configured."""
     configuration = Configuration.from_runnable_config(config)
 
-    ocr_text_extraction_result = run_ocr(state.image_bytes)
-    print(f"🔡 OCR complete: {state.image_path}")
-    return {"ocr_text_extraction_result": ocr_text_extraction_result}
+    ocr_text_extraction_result = cached_run_ocr(configuration, state.image_payload)
+    ocr_layout = serialize_layout(ocr_text_extraction_result, image=state.image) if configuration.use_layout else None
+    log(f"🔡 OCR complete: {state.image_path}")
+    return {"ocr_text_extraction_result": ocr_text_extraction_result, "ocr_layout": ocr_layout}
 
 
-def llm_text_extraction(state: GraphState, config: RunnableConfig) -> dict[str, TARGET_SCHEMA]:
-    """Run LLM for text extraction."""
+async def aocr_text_extraction(state: GraphState, config: RunnableConfig) -> dict[str, documentai.Document | str]:
+    """Async version of `ocr_text_extraction`, serializing the layout off the event loop."""
     configuration = Configuration.from_runnable_config(config)
 
+    ocr_text_extraction_result = await acached_run_ocr(configuration, state.image_payload)
+    ocr_layout = await asyncio.to_thread(serialize_layout, ocr_text_extraction_result, image=state.image) if configuration.use_layout else None
+    log(f"🔡 OCR complete: {state.image_path}")
+    return {"ocr_text_extraction_result": ocr_text_extraction_result, "ocr_layout": ocr_layout}
+
+
+def _is_text_only(state: GraphState, configuration: Configuration, profile: Profile) -> bool:
+    """Whether the extraction can go without the image."""
+    if configuration.text_only == "off" or not configuration.use_layout or profile.layout_prompt is None or (state.ocr_layout is None and state.page_text is None):
+        return False
+    if configuration.text_only == "on":
+        return True
+    # Pages OCRed as one document carry no quality score of their own
+    document = state.ocr_text_extraction_result
+    return document is not None and ocr_quality(document) >= configuration.text_only_min_quality
+
+
+def extraction_request(state: GraphState, configuration: Configuration) -> dict:
+    """Build the `run_llm` arguments for text extraction."""
     # Use OCR text if available, otherwise use empty string
     reference_text = ""
-    if state.ocr_text_extraction_result is not None:
+    if state.page_text is not None:
+        reference_text = state.page_text
+    elif state.ocr_layout is not None:
+        reference_text = state.ocr_layout
+    elif state.ocr_text_extraction_result is not None:
         reference_text = state.ocr_text_extraction_result.text
 
-    llm_text_extraction_result = run_llm(
-        model=configuration.llm_ocr,
-        prompt=TEXT_EXTRACTION_PROMPT,
-        reference_image=state.image,
-        reference_text=reference_text,
-        schema=TARGET_SCHEMA,
-    )
-    print(f"🧠 LLM Text Extraction complete: {state.image_path}")
+    profile = configured_profile(configuration)
+    text_only = _is_text_only(state, configuration, profile)
+    if text_only:
+        log(f"📄 Extracting from the OCR layout alone: {state.image_path}")
+    return {
+        "model": configuration.llm_ocr,
+        "prompt": profile.layout_prompt if text_only else profile.extraction_prompt,
+        "reference_image": None if text_only else state.image_payload,
+        "reference_text": reference_text,
+        "schema": profile.target_schema,
+    }
+
+
+def _cancel_check(call: Future | asyncio.Task) -> None:
+    # Nodes without an async version run off the event loop, so a task is cancelled through its loop
+    if isinstance(call, asyncio.Task):
+        call.get_loop().call_soon_threadsafe(call.cancel)
+    else:
+        call.cancel()
+
+
+def _cancel_checks(checks: Optional[dict[str, Future | asyncio.Task]]) -> None:
+    """Cancel the checker calls started ahead and not claimed by the checker node."""
+    while checks:
+        _cancel_check(checks.popitem()[1])
+
+
+@contextmanager
+def _prefetch_scope(config: Optional[RunnableConfig]) -> Iterator[RunnableConfig]:
+    """Give one graph run its own store of checker calls started ahead, cancelling those left unclaimed when the run exits.
+
+    `invoke` only ever stores thread futures and `ainvoke` only tasks of its own event loop.
+    """
+    config = config or {}
+    checks: dict[str, Future | asyncio.Task] = {}
+    try:
+        yield {**config, "configurable": {**config.get("configurable", {}), PREFETCHED_CHECKS: checks}}
+    finally:
+        _cancel_checks(checks)
+
+
+def _prefetched_checks(config: RunnableConfig) -> Optional[dict[str, Future | asyncio.Task]]:
+    """The checker calls started ahead in this graph run, keyed by `llm_cache_key`, None outside `_prefetch_scope`."""
+    return config.get("configurable", {}).get(PREFETCHED_CHECKS)
+
+
+def _prefetch_check(checks: dict[str, Future | asyncio.Task], request: dict, call: Future | asyncio.Task) -> None:
+    key = llm_cache_key(**request)
+    # A retried extraction replaces the call of the previous attempt
+    if (previous := checks.pop(key, None)) is not None:
+        _cancel_check(previous)
+    checks[key] = call
+
+
+def _claim_check(config: RunnableConfig, request: dict) -> Optional[Future | asyncio.Task]:
+    """The checker call started ahead for `request` in this graph run, if any."""
+    checks = _prefetched_checks(config)
+    return checks.pop(llm_cache_key(**request), None) if checks else None
+
+
+def _stream_watcher(state: GraphState, config: RunnableConfig, configuration: Configuration, start_check: Callable[[dict], Future | asyncio.Task]) -> Optional[Callable[[PartialResult], None]]:
+    """Follow a streamed extraction, None when the extraction is not streamed.
+
+    A result the profile's partial checks find certainly wrong is aborted when a later cascade tier can take over, the time of the decision is recorded either way. A complete result the local checks will send to the checker starts the checker call with `start_check` right away, kept in the run's `_prefetched_checks`.
+    """
+    if not configuration.streaming or configuration.packing or configuration.speculative_models:
+        return None
+    checks = _prefetched_checks(config)
+    profile = configured_profile(configuration)
+    abortable = configuration.cascade_tier is not None and configuration.cascade_tier < len(configuration.cascade) - 1
+    decided = False
+
+    def on_partial(partial: PartialResult) -> None:
+        nonlocal decided
+        if partial.done:
+            if checks is None:
+                return
+            if not configuration.use_local_validation or profile.validator is None or route_local_validation(profile.check(partial.value), configuration, profile.criteria) == "check":
+                request = checker_request(partial.value, state.image_payload, configuration)
+                _prefetch_check(checks, request, start_check(request))
+            return
+        if decided or profile.partial_validator is None or (reason := profile.partial_validator(partial)) is None:
+            return
+        decided = True
+        annotate(abort_seconds=partial.elapsed, abort_reason=reason)
+        if abortable:
+            raise StreamAborted(reason)
+
+    return on_partial
+
+
+def llm_text_extraction(state: GraphState, config: RunnableConfig) -> dict[str, BaseModel]:
+    """Run LLM for text extraction, raced across `speculative_models` or streamed when configured."""
+    configuration = Configuration.from_runnable_config(config)
+
+    request = extraction_request(state, configuration)
+    if configuration.speculative_models:
+        llm_text_extraction_result = speculative_extract(configuration, request, partial(checker_request, image_payload=state.image_payload, configuration=configuration), state.image_path)
+    else:
+        # Unhedged, a hedged call would wait on the shared pool from one of its own threads and may starve it under load
+        unhedged = configuration.model_copy(update={"hedge_requests": False})
+        on_partial = _stream_watcher(state, config, configuration, lambda check: get_executor().submit(copy_context().run, cached_run_llm, unhedged, **check))
+        llm_text_extraction_result = cached_run_llm(configuration, pack=configuration.packing, on_partial=on_partial, **request)
+    log(f"🧠 LLM Text Extraction complete: {state.image_path}")
     return {"llm_text_extraction_result": llm_text_extraction_result}
 
 
-def criteria_checker(state: GraphState, config: RunnableConfig) -> dict[str, Criteria]:
+async def allm_text_extraction(state: GraphState, config: RunnableConfig) -> dict[str, BaseModel]:
+    """Async version of `llm_text_extraction`."""
+    configuration = Configuration.from_runnable_config(config)
+
+    request = extraction_request(state, configuration)
+    if configuration.speculative_models:
+        llm_text_extraction_result = await aspeculative_extract(configuration, request, partial(checker_request, image_payload=state.image_payload, configuration=configuration), state.image_path)
+    else:
+        on_partial = _stream_watcher(state, config, configuration, lambda check: asyncio.ensure_future(acached_run_llm(configuration, **check)))
+        llm_text_extraction_result = await acached_run_llm(configuration, pack=configuration.packing, on_partial=on_partial, **request)
+    log(f"🧠 LLM Text Extraction complete: {state.image_path}")
+    return {"llm_text_extraction_result": llm_text_extraction_result}
+
+
+def checker_request(result: BaseModel, image_payload: ImagePayload, configuration: Configuration) -> dict:
+    """Build the `run_llm` arguments for the criteria checker."""
+    profile = configured_profile(configuration)
+    result_string = result.model_dump_json()
+    return {
+        "model": configuration.llm_checker,
+        "prompt": profile.checker_prompt,
+        "reference_image": image_payload,
+        "reference_text": result_string,
+        "schema": profile.criteria,
+    }
+
+
+def criteria_checker(state: GraphState, config: RunnableConfig) -> dict[str, BaseModel]:
     """Check the criteria."""
     configuration = Configuration.from_runnable_config(config)
 
-    print(state.llm_text_extraction_result)
-    result_string = state.llm_text_extraction_result.model_dump_json()
-    criteria = run_llm(
-        model=configuration.llm_checker,
-        prompt=CHECKER_PROMPT,
-        reference_image=state.image,
-        reference_text=result_string,
-        schema=Criteria,
-    )
-    print(criteria)
-    print(f"🔍 Criteria Checker {state.correction_attemps} complete: {state.image_path}")
+    log(state.llm_text_extraction_result, "debug")
+    request = checker_request(state.llm_text_extraction_result, state.image_payload, configuration)
+    if (prefetched := _claim_check(config, request)) is not None:
+        criteria = prefetched.result()
+    else:
+        criteria = cached_run_llm(configuration, pack=configuration.packing, **request)
+    log(criteria, "debug")
+    log(f"🔍 Criteria Checker {state.correction_attemps} complete: {state.image_path}")
     return {"criteria": criteria}
 
 
-def corrector(state: GraphState, config: RunnableConfig) -> dict[str, TARGET_SCHEMA | int]:
-    """Correct the results based on failing criteria."""
+async def acriteria_checker(state: GraphState, config: RunnableConfig) -> dict[str, BaseModel]:
+    """Async version of `criteria_checker`."""
     configuration = Configuration.from_runnable_config(config)
 
+    log(state.llm_text_extraction_result, "debug")
+    request = checker_request(state.llm_text_extraction_result, state.image_payload, configuration)
+    if (prefetched := _claim_check(config, request)) is not None:
+        criteria = await prefetched
+    else:
+        criteria = await acached_run_llm(configuration, pack=configuration.packing, **request)
+    log(criteria, "debug")
+    log(f"🔍 Criteria Checker {state.correction_attemps} complete: {state.image_path}")
+    return {"criteria": criteria}
+
+
+def local_validator(state: GraphState, config: RunnableConfig) -> dict[str, BaseModel | str]:
+    """Run the rule-based checks, scoring obviously wrong fields without an LLM call."""
+    configuration = Configuration.from_runnable_config(config)
+    profile = configured_profile(configuration)
+
+    # Without rules of its own, the profile leaves every result to the LLM checker
+    if not configuration.use_local_validation or profile.validator is None:
+        return {"local_validation_route": "check"}
+
+    validation = profile.check(state.llm_text_extraction_result)
+    route = route_local_validation(validation, configuration, profile.criteria)
+    log(f"🧮 Local Validation {route}: {state.image_path}")
+    if route != "check":
+        # The checker is skipped, so any call started ahead for it is wasted
+        _cancel_checks(_prefetched_checks(config))
+
+    # The local score stands in for the checker, so the corrector knows what to fix
+    if route == "invalid":
+        return {"criteria": validation.criteria(profile.criteria), "local_validation_route": route}
+    return {"local_validation_route": route}
+
+
+def correction_plan(state: GraphState, configuration: Configuration) -> dict | tuple[dict, list[str]]:
+    """Work out what the corrector has to do.
+
+    Returns:
+        dict | tuple[dict, list[str]]: Either the node output when no correction is attempted, or the `run_llm` arguments together with the fields to correct.
+    """
     # Early return if max corrections exceeded
     if state.correction_attemps >= configuration.max_correction:
         return {
@@ -118,48 +329,62 @@ def corrector(state: GraphState, config: RunnableConfig) -> dict[str, TARGET_SCH
     failing_criteria = {criterion: score for criterion, score in criteria_data.items() if criterion != "reasons" and isinstance(score, int) and score < configuration.criterion_score_threshold}
 
     if not failing_criteria:
-        print(f"📝 Corrector {state.correction_attemps + 1} complete (no corrections needed): {state.image_path}")
+        log(f"📝 Corrector {state.correction_attemps + 1} complete (no corrections needed): {state.image_path}")
         return {
             "llm_text_extraction_result": state.llm_text_extraction_result,
             "correction_attemps": configuration.max_correction + 1,  # Skip future attempts
         }
 
     # Get unique fields that need correction
-    fields_to_correct = []
-    for criterion in failing_criteria:
-        if criterion in CRITERIA_TO_RELATED_FIELDS:
-            fields_to_correct.extend(CRITERIA_TO_RELATED_FIELDS[criterion])
-    fields_to_correct = list(dict.fromkeys(fields_to_correct))  # Remove duplicates, preserve order
+    profile = configured_profile(configuration)
+    fields_to_correct = list(profile.correction_fields(list(failing_criteria)))
 
     # Build correction instructions
     field_descriptions = [
-        f"{Criteria.model_fields[criterion].description} was found to be inadequate (score: {score}/{configuration.criterion_score_threshold})"
+        f"{profile.criteria.model_fields[criterion].description} was found to be inadequate (score: {score}/{configuration.criterion_score_threshold})"
         for criterion, score in failing_criteria.items()
-        if criterion in Criteria.model_fields
+        if criterion in profile.criteria.model_fields
     ]
 
     instructions = "\n".join(field_descriptions)
     if state.criteria.reasons:
         instructions += f"\nReasons for correction: {state.criteria.reasons}"
 
-    result_string = state.llm_text_extraction_result.model_dump_json()
+    # Ask only for the failing fields, the rest is context
+    instructions += f"\nReturn the corrected values of: {', '.join(fields_to_correct)}"
+    fields = set(fields_to_correct)
+    reference_text = f"Current values of the fields to correct:\n{state.llm_text_extraction_result.model_dump_json(include=fields)}"
+    if context := state.llm_text_extraction_result.model_dump(exclude=fields):
+        reference_text += f"\n\nOther fields, for context only:\n{json.dumps(context, ensure_ascii=False)}"
+
+    request = {
+        "model": configuration.llm_ocr,
+        "prompt": instructions,
+        "reference_image": state.image_payload,
+        "reference_text": reference_text,
+        "schema": partial_schema(profile.target_schema, tuple(fields_to_correct)),
+    }
+    return request, fields_to_correct
+
 
-    corrected_result = run_llm(
-        model=configuration.llm_ocr,
-        prompt=instructions,
-        reference_image=state.image,
-        reference_text=result_string,
-        schema=TARGET_SCHEMA,
-    )
+def apply_correction(state: GraphState, corrected_result: BaseModel, fields_to_correct: list[str]) -> dict[str, BaseModel | int]:
+    """Merge the partial correction into the current result.
 
+    The merged result is validated against the full schema, whose cross-field rules the partial correction skips. A merge that breaks them counts as a failed attempt and keeps the current result.
+    """
     # Update only the specified fields
-    updated_result = state.llm_text_extraction_result.model_copy()
-    for field in fields_to_correct:
-        if hasattr(corrected_result, field):
-            setattr(updated_result, field, getattr(corrected_result, field))
-
+    current_result = state.llm_text_extraction_result
     correction_attemps = state.correction_attemps + 1
-    print(f"📝 Corrector {correction_attemps} complete: {state.image_path}")
+    try:
+        updated_result = type(current_result).model_validate({**current_result.model_dump(), **corrected_result.model_dump(include=set(fields_to_correct))})
+    except ValueError as e:
+        log(f"❌ Corrector {correction_attemps} result is invalid, keeping the previous result: {state.image_path}: {e}", "warning")
+        return {
+            "llm_text_extraction_result": current_result,
+            "correction_attemps": correction_attemps,
+        }
+
+    log(f"📝 Corrector {correction_attemps} complete: {state.image_path}")
 
     return {
         "llm_text_extraction_result": updated_result,
@@ -167,18 +392,57 @@ def corrector(state: GraphState, config: RunnableConfig) -> dict[str, TARGET_SCH
     }
 
 
+def corrector(state: GraphState, config: RunnableConfig) -> dict[str, BaseModel | int]:
+    """Correct the results based on failing criteria."""
+    configuration = Configuration.from_runnable_config(config)
+
+    plan = correction_plan(state, configuration)
+    if isinstance(plan, dict):
+        return plan
+
+    request, fields_to_correct = plan
+    corrected_result = cached_run_llm(configuration, **request)
+    return apply_correction(state, corrected_result, fields_to_correct)
+
+
+async def acorrector(state: GraphState, config: RunnableConfig) -> dict[str, BaseModel | int]:
+    """Async version of `corrector`."""
+    configuration = Configuration.from_runnable_config(config)
+
+    plan = correction_plan(state, configuration)
+    if isinstance(plan, dict):
+        return plan
+
+    request, fields_to_correct = plan
+    corrected_result = await acached_run_llm(configuration, **request)
+    return apply_correction(state, corrected_result, fields_to_correct)
+
+
 def should_use_ocr(state: GraphState, config: RunnableConfig) -> str:
     """Determine whether to use OCR or skip directly to LLM extraction."""
     configuration = Configuration.from_runnable_config(config)
 
+    if state.page_text is not None:
+        log(f"🔡 Using the document OCR text of page {state.page}: {state.image_path}")
+        return "skip_ocr"
     if configuration.use_ocr:
-        print(f"🔡 Using OCR for text extraction: {state.image_path}")
+        log(f"🔡 Using OCR for text extraction: {state.image_path}")
         return "use_ocr"
     else:
-        print(f"⏭️ Skipping OCR, using LLM directly: {state.image_path}")
+        log(f"⏭️ Skipping OCR, using LLM directly: {state.image_path}")
         return "skip_ocr"
 
 
+def should_check(state: GraphState, config: RunnableConfig) -> str:
+    """Route on the local validation: finish, correct directly, or ask the LLM checker."""
+    configuration = Configuration.from_runnable_config(config)
+
+    # Early return if max corrections exceeded
+    if state.local_validation_route == "invalid" and state.correction_attemps >= configuration.max_correction:
+        return "valid"
+    return state.local_validation_route
+
+
 def should_continue(state: GraphState, config: RunnableConfig) -> str:
     """Check if criteria are met or max corrections exceeded."""
     configuration = Configuration.from_runnable_config(config)
@@ -188,75 +452,314 @@ def should_continue(state: GraphState, config: RunnableConfig) -> str:
         return "valid"
 
     # Calculate percentage of criteria met
-    criteria_fields = {k: v for k, v in state.criteria.model_dump().items() if k != "reasons" and isinstance(v, int)}
-    valid_count = sum(1 for score in criteria_fields.values() if score >= configuration.criterion_score_threshold)
-    percentage_met = (valid_count / len(criteria_fields)) * 100
+    percentage_met = criteria_met_percentage(state.criteria, configuration.criterion_score_threshold)
     is_valid = percentage_met >= configuration.criteria_met_perc
 
-    print(f"✅ Criteria check: {percentage_met:.1f}% met, valid={is_valid}: {state.image_path}")
+    log(f"✅ Criteria check: {percentage_met:.1f}% met, valid={is_valid}: {state.image_path}")
 
     return "valid" if is_valid else "invalid"
 
 
-builder = StateGraph(GraphState, config_schema=Configuration)
-
-builder.add_node("format_conversion", format_conversion)
-builder.add_node("ocr_text_extraction", ocr_text_extraction)
-builder.add_node("llm_text_extraction", llm_text_extraction, retry=RetryPolicy(max_attempts=3))
-builder.add_node("criteria_checker", criteria_checker, retry=RetryPolicy(max_attempts=3))
-builder.add_node("corrector", corrector, retry=RetryPolicy(max_attempts=3))
-
-builder.add_edge(START, "format_conversion")
-builder.add_conditional_edges(
-    "format_conversion",
-    should_use_ocr,
-    {
-        "use_ocr": "ocr_text_extraction",
-        "skip_ocr": "llm_text_extraction",
-    },
-)
-builder.add_edge("ocr_text_extraction", "llm_text_extraction")
-builder.add_edge("llm_text_extraction", "criteria_checker")
-builder.add_conditional_edges(
-    "criteria_checker",
-    should_continue,
-    {
-        "valid": END,
-        "invalid": "corrector",
-    },
-)
-builder.add_edge("corrector", "criteria_checker")
-
-graph = builder.compile()
-
-
-# Save graph visualization directly to file
-# But it is often buggy
-if "graph.png" not in os.listdir():
+def _node_fields(state: GraphState, config: RunnableConfig) -> dict:
+    return {"image_path": state.image_path, "correction_depth": state.correction_attemps}
+
+
+@cache
+def get_graph() -> CompiledStateGraph:
+    """Build and compile the graph on first use, then reuse it."""
+    from langchain_core.runnables import RunnableLambda
+    from langgraph.graph import END, START, StateGraph
+    from langgraph.types import RetryPolicy
+
+    builder = StateGraph(GraphState, config_schema=Configuration)
+
+    def _node(name: str, func, afunc):
+        return RunnableLambda(traced(name, fields=_node_fields)(func), afunc=traced(name, fields=_node_fields)(afunc))
+
+    # Each node carries a sync and an async implementation, so the same graph serves `invoke` and `ainvoke`
+    builder.add_node("format_conversion", _node("format_conversion", format_conversion, aformat_conversion))
+    builder.add_node("ocr_text_extraction", _node("ocr_text_extraction", ocr_text_extraction, aocr_text_extraction))
+    builder.add_node("llm_text_extraction", _node("llm_text_extraction", llm_text_extraction, allm_text_extraction), retry=RetryPolicy(max_attempts=3))
+    builder.add_node("criteria_checker", _node("criteria_checker", criteria_checker, acriteria_checker), retry=RetryPolicy(max_attempts=3))
+    builder.add_node("local_validator", RunnableLambda(traced("local_validator", fields=_node_fields)(local_validator)))
+    builder.add_node("corrector", _node("corrector", corrector, acorrector), retry=RetryPolicy(max_attempts=3))
+
+    builder.add_edge(START, "format_conversion")
+    builder.add_conditional_edges(
+        "format_conversion",
+        should_use_ocr,
+        {
+            "use_ocr": "ocr_text_extraction",
+            "skip_ocr": "llm_text_extraction",
+        },
+    )
+    builder.add_edge("ocr_text_extraction", "llm_text_extraction")
+    builder.add_edge("llm_text_extraction", "local_validator")
+    builder.add_conditional_edges(
+        "local_validator",
+        should_check,
+        {
+            "valid": END,
+            "invalid": "corrector",
+            "check": "criteria_checker",
+        },
+    )
+    builder.add_conditional_edges(
+        "criteria_checker",
+        should_continue,
+        {
+            "valid": END,
+            "invalid": "corrector",
+        },
+    )
+    builder.add_edge("corrector", "local_validator")
+
+    return builder.compile()
+
+
+def save_graph_image(output_file_path: str = "graph.png") -> None:
+    """Render the graph visualization through the mermaid API, which is often buggy."""
     try:
-        graph_image = graph.get_graph().draw_mermaid_png(
-            output_file_path="graph.png",
-        )
+        get_graph().get_graph().draw_mermaid_png(output_file_path=output_file_path)
     except Exception as e:
-        print(f"Error generating graph image: {e}")
-        graph_image = None
+        log(f"Error generating graph image: {e}", "warning")
+
 
+def __getattr__(name: str):
+    # Keep `graph` importable without compiling at import time
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def run_graph(image_path: str) -> dict:
-    """Run the graph."""
-    print(f"🚀 Start processing: {image_path}")
-    result = graph.invoke({"image_path": image_path})
-    print(f"🎉 Process complete: {image_path}")
-    llm_text_extraction_result: TARGET_SCHEMA = result["llm_text_extraction_result"]
-    return llm_text_extraction_result.model_dump()
 
+def invoke_graph(state: dict, config: Optional[RunnableConfig] = None) -> dict:
+    """Invoke the graph, escalating through the `Configuration.cascade` tiers when configured.
 
-def batch_run_graph(image_paths: list[str]) -> list[dict]:
-    """Run the graph for a batch of images using multiprocessing."""
+    Args:
+        state (dict): The input state.
+        config (Optional[RunnableConfig]): The run config.
 
-    # Create a pool of workers
-    with Pool(processes=cpu_count()) as pool:
-        # Map the run_graph function to each image path with progress bar
-        results = list(tqdm(pool.imap(run_graph, image_paths), total=len(image_paths), desc="Processing images"))
+    Returns:
+        dict: The final state of the tier that resolved the image.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    if not configuration.cascade:
+        with _prefetch_scope(config) as run_config:
+            return get_graph().invoke(state, config=run_config)
+
+    for index, tier in enumerate(configuration.cascade):
+        last = index == len(configuration.cascade) - 1
+        with span("tier", "graph", tier=index, model=tier.llm_ocr):
+            try:
+                with _prefetch_scope(tier_config(config, index)) as run_config:
+                    result = get_graph().invoke(state, config=run_config)
+            except Exception as e:
+                record_tier(tier, "errors")
+                if last:
+                    raise
+                log(f"⬆️ Tier {tier.label} failed ({e}), escalating: {state['image_path']}", "warning")
+                continue
+            if not last and (failure := gate_failure(result, tier, configuration)):
+                record_tier(tier, "escalated")
+                log(f"⬆️ Tier {tier.label} failed its gate ({failure}), escalating: {state['image_path']}")
+                continue
+            record_tier(tier, "resolved")
+        annotate(cascade_tier=index)
+        return result
+
+
+async def ainvoke_graph(state: dict, config: Optional[RunnableConfig] = None) -> dict:
+    """Async version of `invoke_graph`."""
+    configuration = Configuration.from_runnable_config(config)
+    if not configuration.cascade:
+        with _prefetch_scope(config) as run_config:
+            return await get_graph().ainvoke(state, config=run_config)
+
+    for index, tier in enumerate(configuration.cascade):
+        last = index == len(configuration.cascade) - 1
+        with span("tier", "graph", tier=index, model=tier.llm_ocr):
+            try:
+                with _prefetch_scope(tier_config(config, index)) as run_config:
+                    result = await get_graph().ainvoke(state, config=run_config)
+            except Exception as e:
+                record_tier(tier, "errors")
+                if last:
+                    raise
+                log(f"⬆️ Tier {tier.label} failed ({e}), escalating: {state['image_path']}", "warning")
+                continue
+            if not last and (failure := gate_failure(result, tier, configuration)):
+                record_tier(tier, "escalated")
+                log(f"⬆️ Tier {tier.label} failed its gate ({failure}), escalating: {state['image_path']}")
+                continue
+            record_tier(tier, "resolved")
+        annotate(cascade_tier=index)
+        return result
+
+
+def page_state(image_path: str, page: int, page_texts: Optional[list[str]]) -> dict:
+    """The input state of one page, with its text when the whole document went through OCR at once."""
+    return {"image_path": image_path, "page": page, "page_text": page_texts[page] if page_texts and page < len(page_texts) else None}
+
+
+def run_pages(image_path: str, config: Optional[RunnableConfig] = None) -> list[Optional[BaseModel]]:
+    """Run the graph on every page of a PDF or TIFF in parallel, decoding at most `max_pages_in_flight` pages at once.
+
+    Args:
+        image_path (str): The PDF or TIFF file.
+        config (Optional[RunnableConfig]): The config shared by every page.
+
+    Returns:
+        list[Optional[BaseModel]]: The result of each page, None where extraction failed.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    pages = count_pages(image_path)
+    page_texts = ocr_page_texts(image_path, pages, configuration)
+
+    def _run(page: int) -> Optional[BaseModel]:
+        with span("page", "graph", page=page):
+            try:
+                return invoke_graph(page_state(image_path, page, page_texts), config)["llm_text_extraction_result"]
+            except Exception as e:
+                log(f"❌ Page {page} failed: {image_path}: {e}", "warning")
+                return None
 
-    return results
+    # Each page runs in a copy of the caller's context, keeping its spans under the document
+    contexts = [copy_context() for _ in range(pages)]
+    with ThreadPoolExecutor(max_workers=configuration.max_pages_in_flight) as executor:
+        return list(executor.map(lambda context, page: context.run(_run, page), contexts, range(pages)))
+
+
+async def arun_pages(image_path: str, config: Optional[RunnableConfig] = None) -> list[Optional[BaseModel]]:
+    """Async version of `run_pages`."""
+    configuration = Configuration.from_runnable_config(config)
+    pages = await asyncio.to_thread(count_pages, image_path)
+    page_texts = await aocr_page_texts(image_path, pages, configuration)
+    semaphore = asyncio.Semaphore(configuration.max_pages_in_flight)
+
+    async def _run(page: int) -> Optional[BaseModel]:
+        async with semaphore:
+            with span("page", "graph", page=page):
+                try:
+                    return (await ainvoke_graph(page_state(image_path, page, page_texts), config))["llm_text_extraction_result"]
+                except Exception as e:
+                    log(f"❌ Page {page} failed: {image_path}: {e}", "warning")
+                    return None
+
+    return await asyncio.gather(*(_run(page) for page in range(pages)))
+
+
+def run_graph(image_path: str, config: Optional[RunnableConfig] = None) -> dict:
+    """Run the graph, served from the result cache when the same image was processed with the same setup.
+
+    PDFs and TIFFs are extracted page by page and the page results combined with `Configuration.page_reducer`.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    profile = configured_profile(configuration)
+    with span("graph", "graph", image_path=image_path):
+        cache = get_result_cache(configuration)
+        if cache is not None:
+            cache_key = result_cache_key(Path(image_path).read_bytes(), configuration, profile)
+            if (cached := cache.get(cache_key)) is not None:
+                annotate(cache_hit=True)
+                log(f"💾 Cache hit: {image_path}")
+                return profile.target_schema.model_validate_json(cached).model_dump()
+
+        log(f"🚀 Start processing: {image_path}")
+        if is_multipage(image_path):
+            llm_text_extraction_result = reduce_pages(run_pages(image_path, config), configuration)
+            annotate(cache_hit=False)
+        else:
+            result = invoke_graph({"image_path": image_path}, config)
+            annotate(cache_hit=False, correction_depth=result.get("correction_attemps", 0))
+            llm_text_extraction_result: BaseModel = result["llm_text_extraction_result"]
+        if configuration.text_conversion:
+            llm_text_extraction_result = normalize_result(llm_text_extraction_result, configuration.text_conversion)
+        log(f"🎉 Process complete: {image_path}")
+
+        if cache is not None:
+            cache.set(cache_key, llm_text_extraction_result.model_dump_json())
+        return llm_text_extraction_result.model_dump()
+
+
+async def arun_graph(image_path: str, config: Optional[RunnableConfig] = None) -> dict:
+    """Async version of `run_graph`."""
+    configuration = Configuration.from_runnable_config(config)
+    profile = configured_profile(configuration)
+    with span("graph", "graph", image_path=image_path):
+        cache = get_result_cache(configuration)
+        if cache is not None:
+            cache_key = result_cache_key(await asyncio.to_thread(Path(image_path).read_bytes), configuration, profile)
+            if (cached := await asyncio.to_thread(cache.get, cache_key)) is not None:
+                annotate(cache_hit=True)
+                log(f"💾 Cache hit: {image_path}")
+                return profile.target_schema.model_validate_json(cached).model_dump()
+
+        log(f"🚀 Start processing: {image_path}")
+        if is_multipage(image_path):
+            llm_text_extraction_result = reduce_pages(await arun_pages(image_path, config), configuration)
+            annotate(cache_hit=False)
+        else:
+            result = await ainvoke_graph({"image_path": image_path}, config)
+            annotate(cache_hit=False, correction_depth=result.get("correction_attemps", 0))
+            llm_text_extraction_result: BaseModel = result["llm_text_extraction_result"]
+        if configuration.text_conversion:
+            llm_text_extraction_result = await asyncio.to_thread(normalize_result, llm_text_extraction_result, configuration.text_conversion)
+        log(f"🎉 Process complete: {image_path}")
+
+        if cache is not None:
+            await asyncio.to_thread(cache.set, cache_key, llm_text_extraction_result.model_dump_json())
+        return llm_text_extraction_result.model_dump()
+
+
+async def abatch_run_graph(
+    image_paths: list[str],
+    max_concurrency: int = 64,
+    config: Optional[RunnableConfig] = None,
+    return_exceptions: bool = False,
+    progress: bool = True,
+) -> list[dict | Exception]:
+    """Run the graph for a batch of images concurrently on one event loop.
+
+    Args:
+        image_paths (list[str]): The images to process.
+        max_concurrency (int): The maximum number of images in flight at once.
+        config (Optional[RunnableConfig]): The config shared by every run.
+        return_exceptions (bool): Whether a failed image returns its error in place of the result, rather than failing the batch.
+        progress (bool): Whether to show a progress bar.
+
+    Returns:
+        list[dict | Exception]: The results in the same order as `image_paths`.
+    """
+    from tqdm import tqdm
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    progress_bar = tqdm(total=len(image_paths), desc="Processing images", disable=not progress)
+
+    async def _run(image_path: str) -> dict:
+        # Time spent waiting for a free slot is recorded as its own span
+        with span("queue", "queue", image_path=image_path):
+            await semaphore.acquire()
+        try:
+            return await arun_graph(image_path, config=config)
+        finally:
+            semaphore.release()
+            progress_bar.update(1)
+
+    try:
+        return await asyncio.gather(*(_run(image_path) for image_path in image_paths), return_exceptions=return_exceptions)
+    finally:
+        progress_bar.close()
+
+
+def batch_run_graph(image_paths: list[str], max_concurrency: int = 64, config: Optional[RunnableConfig] = None) -> list[dict]:
+    """Run the graph for a batch of images, see `abatch_run_graph`.
+
+    Called while an event loop is running, e.g. in a Jupyter cell, the batch runs on its own loop in a worker thread, and the calling loop is blocked until it finishes. Async code should await `abatch_run_graph` instead.
+    """
+    batch = abatch_run_graph(image_paths, max_concurrency=max_concurrency, config=config)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(batch)
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="structured_ocr_batch") as executor:
+        return executor.submit(copy_context().run, asyncio.run, batch).result()
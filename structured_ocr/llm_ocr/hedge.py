@@ -0,0 +1,119 @@
+"""Hedged LLM calls: when a call is slower than the usual tail latency of its model, a duplicate is sent and the first response wins.
+
+Only calls past the p95 are duplicated, so hedging costs about 5% more requests while cutting off the slowest calls. No duplicate is sent while the route is saturated, where it would only add load to a provider that is already behind.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from typing import Optional
+
+from pydantic import BaseModel
+
+from ..ratelimit import get_limiter
+from ..telemetry import annotate, log
+from .configuration import Configuration
+from .llm import arun_llm, run_llm
+
+# Threads running sync calls that may be hedged, a call abandoned by a hedge keeps its thread until it returns
+HEDGE_WORKERS = 256
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """The shared pool running calls that may be raced, created on first use."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="structured_ocr_hedge")
+        return _executor
+
+
+def hedge_delay(configuration: Configuration, model: str) -> Optional[float]:
+    """How long to wait for a call to `model` before hedging it.
+
+    Args:
+        configuration (Configuration): The run configuration.
+        model (str): The model called.
+
+    Returns:
+        Optional[float]: `hedge_after_seconds` when set, otherwise the `hedge_quantile` of the recent latencies of the model, or None when hedging is off or too few calls were seen.
+    """
+    if not configuration.hedge_requests:
+        return None
+    if configuration.hedge_after_seconds is not None:
+        return configuration.hedge_after_seconds
+    return get_limiter(model).latency_quantile(configuration.hedge_quantile)
+
+
+def _should_hedge(model: str, delay: float) -> bool:
+    if get_limiter(model).concurrency.saturated:
+        return False
+    annotate(hedged=True)
+    log(f"🏇 {model} slower than {delay:.1f}s, sending a hedged request", "debug")
+    return True
+
+
+def hedged_run_llm(configuration: Configuration, **request) -> BaseModel:
+    """`run_llm`, duplicated once when it is slower than `hedge_delay`.
+
+    Args:
+        configuration (Configuration): The run configuration.
+        **request: The `run_llm` arguments.
+
+    Returns:
+        BaseModel: The first successful response.
+    """
+    delay = hedge_delay(configuration, request["model"])
+    if delay is None:
+        return run_llm(**request)
+
+    executor = get_executor()
+    primary = executor.submit(copy_context().run, run_llm, **request)
+    done, _ = wait([primary], timeout=delay)
+    if done or not _should_hedge(request["model"], delay):
+        return primary.result()
+
+    # The slower call cannot be interrupted, it finishes in the background and its result is dropped
+    pending: set[Future] = {primary, executor.submit(copy_context().run, run_llm, **request)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = error or future.exception()
+    raise error
+
+
+async def ahedged_run_llm(configuration: Configuration, **request) -> BaseModel:
+    """Async version of `hedged_run_llm`, cancelling the slower call."""
+    delay = hedge_delay(configuration, request["model"])
+    if delay is None:
+        return await arun_llm(**request)
+
+    tasks = [asyncio.ensure_future(arun_llm(**request))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not _should_hedge(request["model"], delay):
+            return await tasks[0]
+
+        tasks.append(asyncio.ensure_future(arun_llm(**request)))
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            # A loser that already failed has its error marked as retrieved
+            if not task.cancel() and not task.cancelled():
+                task.exception()
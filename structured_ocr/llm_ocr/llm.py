@@ -1,110 +1,371 @@
-import os
+from __future__ import annotations
+
+import asyncio
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterator, Optional, TypeVar
 
-from google.genai import Client, types
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
 from PIL import Image
 from pydantic import BaseModel
 
-from ..utils import image_to_base64
+from ..clients import get_gemini_client, get_structured_llm, get_tool_llm
+from ..ratelimit import acall_limited, call_limited, estimate_tokens, report_usage
+from ..specs import gemini_config, model_route
+from ..telemetry import annotate
+from ..utils import ImagePayload
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+T = TypeVar("T")
+
+
+def _as_payload(reference_image: Image.Image | ImagePayload) -> ImagePayload:
+    """Use the pre-encoded payload as is, encode a bare PIL image once."""
+    if isinstance(reference_image, ImagePayload):
+        return reference_image
+    return ImagePayload.from_image(reference_image)
+
+
+def _references(
+    reference_image: Image.Image | ImagePayload | list[Optional[ImagePayload]] = None,
+    reference_text: str | list[Optional[str]] = None,
+) -> list[tuple[Optional[str], Optional[ImagePayload], Optional[str]]]:
+    """The label, image and text of each document of a call.
+
+    A packed call passes lists with one image and text per document, each introduced by an `Image <n>:` label the prompt refers to.
+    """
+    if not isinstance(reference_image, list) and not isinstance(reference_text, list):
+        return [(None, _as_payload(reference_image) if reference_image else None, reference_text)]
+    images = reference_image if isinstance(reference_image, list) else [None] * len(reference_text)
+    texts = reference_text if isinstance(reference_text, list) else [None] * len(images)
+    return [(f"Image {index}:", _as_payload(image) if image else None, text) for index, (image, text) in enumerate(zip(images, texts))]
+
+
+def request_tokens(prompt: str, reference_image=None, reference_text=None) -> int:
+    """Estimate the input tokens of a `run_llm` call, packed ones included."""
+    references = _references(reference_image, reference_text)
+    return estimate_tokens(prompt, *(label for label, _, _ in references), *(text for _, _, text in references), images=sum(image is not None for _, image, _ in references))
+
+
+def _langchain_messages(
+    prompt: str,
+    reference_image: Image.Image | ImagePayload | list[Optional[ImagePayload]] = None,
+    reference_text: str | list[Optional[str]] = None,
+) -> list:
+    """Build the system and human messages for the LangChain route."""
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    messages = [SystemMessage(prompt)]
+
+    content = []
+    for label, image, text in _references(reference_image, reference_text):
+        if label:
+            content.append({"type": "text", "text": label})
+        if image:
+            content.append(
+                {
+                    "type": "image_url",
+                    "image_url": {"url": image.data_url},
+                }
+            )
+        if text:
+            content.append(
+                {
+                    "type": "text",
+                    "text": text,
+                }
+            )
+
+    messages.append(HumanMessage(content))
+    return messages
+
+
+def _langchain_usage(usage: Optional[dict]) -> None:
+    if usage:
+        annotate(input_tokens=usage["input_tokens"], output_tokens=usage["output_tokens"])
+        report_usage(usage["input_tokens"] + usage["output_tokens"])
+
+
+def _langchain_output(output: dict, schema: type[BaseModel]) -> BaseModel:
+    """Record the token usage and validate the parsed tool arguments of a structured LLM with the raw message included."""
+    _langchain_usage(getattr(output["raw"], "usage_metadata", None))
+    if output["parsing_error"] is not None:
+        raise output["parsing_error"]
+    return schema.model_validate(output["parsed"]) if output["parsed"] is not None else None
 
 
 def run_llm_langchain(
     model: str,
     prompt: str,
-    reference_image: Image.Image = None,
+    reference_image: Image.Image | ImagePayload = None,
     reference_text: str = None,
     schema: BaseModel = None,
+    temperature: Optional[float] = None,
 ) -> BaseModel:
     """Run a LLM with a system prompt, reference image, and reference text, and return a structured output.
 
     Args:
         model (str): The model to use.
         prompt (str): The prompt to pass to the LLM.
-        reference_image (Image.Image): The image to pass to the LLM.
-        reference_text (str): The text to pass to the LLM.
+        reference_image (Image.Image | ImagePayload | list[Optional[ImagePayload]]): The image to pass to the LLM, preferably pre-encoded, or one per document of a packed call.
+        reference_text (str | list[Optional[str]]): The text to pass to the LLM, or one per document of a packed call.
         schema (BaseModel): The schema to use for the structured output.
+        temperature (Optional[float]): The sampling temperature, 0 by default.
 
     Returns:
         BaseModel: The structured output of the LLM.
     """
-    llm = ChatOpenAI(
-        model=model,
-        temperature=0,
-        api_key=os.getenv("OPENROUTER_API_KEY"),
-        base_url="https://openrouter.ai/api/v1",
-    )
+    structured_llm = get_structured_llm(model, schema, temperature=temperature)
+    return _langchain_output(structured_llm.invoke(_langchain_messages(prompt, reference_image, reference_text)), schema)
 
-    messages = [SystemMessage(prompt)]
 
-    content = []
-    if reference_image:
-        image_base64 = image_to_base64(reference_image)
-        content.append(
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"},
-            }
-        )
-    if reference_text:
-        content.append(
-            {
-                "type": "text",
-                "text": reference_text,
-            }
-        )
+async def arun_llm_langchain(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+    temperature: Optional[float] = None,
+) -> BaseModel:
+    """Async version of `run_llm_langchain`."""
+    structured_llm = get_structured_llm(model, schema, asynchronous=True, temperature=temperature)
+    # Image encoding is CPU-bound, keep it off the event loop
+    messages = await asyncio.to_thread(_langchain_messages, prompt, reference_image, reference_text)
+    return _langchain_output(await structured_llm.ainvoke(messages), schema)
 
-    messages.append(HumanMessage(content))
 
-    # Upon langchain_openai==0.3.0, the default method changed from “function_calling” to “json_schema”. Pydantic model would cause error and thus it requires to specify to "function_calling". Other BaseChatModel does not support the argument `method` and thus it remains no argument.
-    structured_llm = llm.with_structured_output(schema, method="function_calling")
+def _gemini_request(
+    prompt: str,
+    reference_image: Image.Image | ImagePayload | list[Optional[ImagePayload]] = None,
+    reference_text: str | list[Optional[str]] = None,
+    schema: BaseModel = None,
+    temperature: Optional[float] = None,
+) -> tuple[list, types.GenerateContentConfig]:
+    """Build the contents and generation config for the Gemini route."""
+    from google.genai import types
+
+    contents = [prompt]
+    for label, image, text in _references(reference_image, reference_text):
+        if label:
+            contents.append(label)
+        if image:
+            contents.append(types.Part.from_bytes(data=image.data, mime_type=image.mime_type))
+        if text:
+            contents.append(text)
+
+    # The config, with the JSON schema converted once per schema, is shared by every call
+    return contents, gemini_config(schema, temperature)
+
 
-    return structured_llm.invoke(messages)
+def _gemini_usage(usage: Optional[types.GenerateContentResponseUsageMetadata]) -> None:
+    """Record the token usage, thinking included."""
+    if usage:
+        output_tokens = (usage.candidates_token_count or 0) + (usage.thoughts_token_count or 0)
+        annotate(input_tokens=usage.prompt_token_count, output_tokens=output_tokens)
+        report_usage((usage.prompt_token_count or 0) + output_tokens)
+
+
+def _gemini_output(response, schema: type[BaseModel]) -> BaseModel:
+    """Record the token usage and validate the JSON output into `schema`."""
+    _gemini_usage(response.usage_metadata)
+    return schema.model_validate_json(response.text) if response.text else None
 
 
 def run_llm_gemini(
     model: str,
     prompt: str,
-    reference_image: Image.Image = None,
+    reference_image: Image.Image | ImagePayload = None,
     reference_text: str = None,
     schema: BaseModel = None,
+    temperature: Optional[float] = None,
 ) -> BaseModel:
     """Run a LLM with a system prompt, reference image, and reference text, and return a structured output."""
-    client = Client(
-        api_key=os.getenv("GEMINI_API_KEY"),
-        http_options={"timeout": 600000},  # 10 minutes
-    )
+    contents, config = _gemini_request(prompt, reference_image, reference_text, schema, temperature)
+    response = get_gemini_client().models.generate_content(model=model, contents=contents, config=config)
+    return _gemini_output(response, schema)
+
+
+async def arun_llm_gemini(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+    temperature: Optional[float] = None,
+) -> BaseModel:
+    """Async version of `run_llm_gemini`."""
+    contents, config = await asyncio.to_thread(_gemini_request, prompt, reference_image, reference_text, schema, temperature)
+    response = await get_gemini_client(asynchronous=True).aio.models.generate_content(model=model, contents=contents, config=config)
+    return _gemini_output(response, schema)
+
+
+def stream_llm_langchain(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+) -> Iterator[str]:
+    """Stream the JSON arguments of the structured output tool call as the LLM generates them, recording the token usage at the end."""
+    tool_llm = get_tool_llm(model, schema)
+    usage = None
+    for chunk in tool_llm.stream(_langchain_messages(prompt, reference_image, reference_text), stream_usage=True):
+        for tool_call_chunk in chunk.tool_call_chunks:
+            if tool_call_chunk.get("args"):
+                yield tool_call_chunk["args"]
+        usage = chunk.usage_metadata or usage
+    _langchain_usage(usage)
+
+
+async def astream_llm_langchain(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+) -> AsyncIterator[str]:
+    """Async version of `stream_llm_langchain`."""
+    tool_llm = get_tool_llm(model, schema, asynchronous=True)
+    messages = await asyncio.to_thread(_langchain_messages, prompt, reference_image, reference_text)
+    usage = None
+    async for chunk in tool_llm.astream(messages, stream_usage=True):
+        for tool_call_chunk in chunk.tool_call_chunks:
+            if tool_call_chunk.get("args"):
+                yield tool_call_chunk["args"]
+        usage = chunk.usage_metadata or usage
+    _langchain_usage(usage)
+
+
+def stream_llm_gemini(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+) -> Iterator[str]:
+    """Stream the JSON output as the LLM generates it, recording the token usage of the last chunk."""
+    contents, config = _gemini_request(prompt, reference_image, reference_text, schema)
+    usage = None
+    for chunk in get_gemini_client().models.generate_content_stream(model=model, contents=contents, config=config):
+        if chunk.text:
+            yield chunk.text
+        usage = chunk.usage_metadata or usage
+    _gemini_usage(usage)
+
+
+async def astream_llm_gemini(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+) -> AsyncIterator[str]:
+    """Async version of `stream_llm_gemini`."""
+    contents, config = await asyncio.to_thread(_gemini_request, prompt, reference_image, reference_text, schema)
+    usage = None
+    async for chunk in await get_gemini_client(asynchronous=True).aio.models.generate_content_stream(model=model, contents=contents, config=config):
+        if chunk.text:
+            yield chunk.text
+        usage = chunk.usage_metadata or usage
+    _gemini_usage(usage)
+
+
+# Provider calls per `run_llm` route, each taking the `run_llm` arguments
+LLM_PROVIDERS: dict[str, tuple[Callable[..., BaseModel], Callable[..., Awaitable[BaseModel]]]] = {
+    "langchain": (run_llm_langchain, arun_llm_langchain),
+    "gemini": (run_llm_gemini, arun_llm_gemini),
+}
+
+
+def register_llm_provider(route: str, run: Callable[..., BaseModel], arun: Callable[..., Awaitable[BaseModel]]) -> None:
+    """Send the calls of `route` to `run` and `arun`, e.g. to record or replay the responses of the real provider."""
+    LLM_PROVIDERS[route] = (run, arun)
 
-    contents = [prompt]
-    if reference_image:
-        contents.append(types.Part.from_bytes(data=image_to_base64(reference_image), mime_type="image/jpeg"))
-    if reference_text:
-        contents.append(reference_text)
-
-    response = client.models.generate_content(
-        model=model,
-        contents=contents,
-        config=types.GenerateContentConfig(
-            temperature=0,
-            response_modalities=["TEXT"],
-            thinking_config=types.ThinkingConfig(thinking_budget=1024),
-            response_mime_type="application/json",
-            response_schema=schema,
-        ),
-    )
-
-    return response.parsed
+
+# Streamed provider calls per `stream_llm` route, each taking the `run_llm` arguments and yielding the JSON output in pieces
+LLM_STREAM_PROVIDERS: dict[str, tuple[Callable[..., Iterator[str]], Callable[..., AsyncIterator[str]]]] = {
+    "langchain": (stream_llm_langchain, astream_llm_langchain),
+    "gemini": (stream_llm_gemini, astream_llm_gemini),
+}
+
+
+def register_llm_stream_provider(route: str, stream: Callable[..., Iterator[str]], astream: Callable[..., AsyncIterator[str]]) -> None:
+    """Send the streamed calls of `route` to `stream` and `astream`."""
+    LLM_STREAM_PROVIDERS[route] = (stream, astream)
 
 
 def run_llm(
     model: str,
     prompt: str,
-    reference_image: Image.Image = None,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+    temperature: Optional[float] = None,
+) -> BaseModel:
+    """Route the LLM call to the appropriate function based on the model name, within the rate limits of the model.
+
+    `temperature` is 0 unless given, e.g. by a speculative candidate sampling the same model differently.
+    """
+    tokens = request_tokens(prompt, reference_image, reference_text)
+    run, _ = LLM_PROVIDERS[model_route(model)]
+    return call_limited(model, lambda: run(model, prompt, reference_image, reference_text, schema, temperature), tokens)
+
+
+async def arun_llm(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
     reference_text: str = None,
     schema: BaseModel = None,
+    temperature: Optional[float] = None,
 ) -> BaseModel:
-    """Route the LLM call to the appropriate function based on the model name."""
-    if "/" in model:
-        return run_llm_langchain(model, prompt, reference_image, reference_text, schema)
-    else:
-        return run_llm_gemini(model, prompt, reference_image, reference_text, schema)
+    """Async version of `run_llm`, routed and limited the same way."""
+    tokens = request_tokens(prompt, reference_image, reference_text)
+    _, arun = LLM_PROVIDERS[model_route(model)]
+    return await acall_limited(model, lambda: arun(model, prompt, reference_image, reference_text, schema, temperature), tokens)
+
+
+async def _ajoin(chunks: AsyncIterator[str]) -> str:
+    return "".join([chunk async for chunk in chunks])
+
+
+def stream_llm(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+    consume: Callable[[Iterator[str]], T] = "".join,
+) -> T:
+    """Stream the JSON output of the LLM call into `consume`, routed and limited like `run_llm`.
+
+    The call holds its concurrency slot until `consume` returns. A throttled call is retried with a fresh stream, so `consume` must start over on every call.
+
+    Args:
+        model (str): The model to use.
+        prompt (str): The prompt to pass to the LLM.
+        reference_image (Image.Image | ImagePayload): The image to pass to the LLM.
+        reference_text (str): The text to pass to the LLM.
+        schema (BaseModel): The schema of the structured output.
+        consume (Callable[[Iterator[str]], T]): Reads the pieces of the JSON output, the whole text by default.
+
+    Returns:
+        T: The return value of `consume`.
+    """
+    tokens = request_tokens(prompt, reference_image, reference_text)
+    stream, _ = LLM_STREAM_PROVIDERS[model_route(model)]
+    return call_limited(model, lambda: consume(stream(model, prompt, reference_image, reference_text, schema)), tokens)
+
+
+async def astream_llm(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+    consume: Callable[[AsyncIterator[str]], Awaitable[T]] = None,
+) -> T:
+    """Async version of `stream_llm`, `consume` reads an async iterator."""
+    consume = consume or _ajoin
+    tokens = request_tokens(prompt, reference_image, reference_text)
+    _, astream = LLM_STREAM_PROVIDERS[model_route(model)]
+    return await acall_limited(model, lambda: consume(astream(model, prompt, reference_image, reference_text, schema)), tokens)
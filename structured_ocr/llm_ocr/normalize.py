@@ -0,0 +1,105 @@
+"""Chinese script conversion of extracted text with OpenCC, e.g. simplified to Hong Kong traditional with "s2hk".
+
+Loading the conversion dictionaries takes tens of milliseconds, so each converter is built once per process and shared across threads. `normalize_results` converts every non-ASCII string of many results in one OpenCC call, the strings joined by a separator OpenCC passes through untouched, rather than one call per field.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import TYPE_CHECKING, Any, Iterator, TypeVar
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    import opencc
+
+# ASCII unit separator: OpenCC keeps it as is and never matches a phrase across it, so the joined strings convert like separate ones
+SEPARATOR = "\x1f"
+
+ResultT = TypeVar("ResultT", bound=BaseModel)
+
+_converters: dict[str, opencc.OpenCC] = {}
+_lock = threading.Lock()
+
+
+def get_converter(config: str = "s2hk") -> opencc.OpenCC:
+    """Get the shared converter of an OpenCC config such as "s2hk" or "t2s", loading its dictionaries on first use."""
+    with _lock:
+        converter = _converters.get(config)
+        if converter is None:
+            import opencc
+
+            converter = _converters[config] = opencc.OpenCC(config)
+        return converter
+
+
+def convert_texts(texts: list[str], config: str = "s2hk") -> list[str]:
+    """Convert many strings in one OpenCC call.
+
+    Args:
+        texts (list[str]): The strings to convert.
+        config (str): The OpenCC config.
+
+    Returns:
+        list[str]: The converted strings, in the same order.
+    """
+    if not texts:
+        return []
+    converter = get_converter(config)
+    if any(SEPARATOR in text for text in texts):
+        return [converter.convert(text) for text in texts]
+    return converter.convert(SEPARATOR.join(texts)).split(SEPARATOR)
+
+
+def iter_strings(value: Any) -> Iterator[str]:
+    """The strings of a value, nested models, lists and dict values included, in a fixed order."""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, BaseModel):
+        for field in type(value).model_fields:
+            yield from iter_strings(getattr(value, field))
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_strings(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_strings(item)
+
+
+def replace_strings(value: Any, converted: Iterator[str]) -> Any:
+    """Rebuild a value with its strings, in the order of `iter_strings`, taken from `converted`."""
+    if isinstance(value, str):
+        return next(converted)
+    if isinstance(value, BaseModel):
+        # Copied rather than revalidated, so results merged by the corrector are kept as they are
+        return value.model_copy(update={field: replace_strings(getattr(value, field), converted) for field in type(value).model_fields})
+    if isinstance(value, (list, tuple)):
+        return type(value)(replace_strings(item, converted) for item in value)
+    if isinstance(value, dict):
+        return {key: replace_strings(item, converted) for key, item in value.items()}
+    return value
+
+
+def normalize_results(results: list[ResultT], config: str = "s2hk") -> list[ResultT]:
+    """Convert every string field of many results in one OpenCC call.
+
+    Args:
+        results (list[ResultT]): The results, e.g. every document of a batch.
+        config (str): The OpenCC config.
+
+    Returns:
+        list[ResultT]: The results, copied where a string changed.
+    """
+    texts = [list(iter_strings(result)) for result in results]
+    # OpenCC leaves ASCII as is, so only the other strings are sent and an all-ASCII result is returned untouched
+    converted = iter(convert_texts([text for result_texts in texts for text in result_texts if not text.isascii()], config))
+    normalized = []
+    for result, result_texts in zip(results, texts):
+        new_texts = [text if text.isascii() else next(converted) for text in result_texts]
+        normalized.append(result if new_texts == result_texts else replace_strings(result, iter(new_texts)))
+    return normalized
+
+
+def normalize_result(result: ResultT, config: str = "s2hk") -> ResultT:
+    """Convert every string field of a result, nested models included, in one OpenCC call."""
+    return normalize_results([result], config)[0]
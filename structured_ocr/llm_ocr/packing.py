@@ -0,0 +1,329 @@
+"""Multi-document packing: calls of documents in flight together, with the same model, prompt and schema, share one LLM request.
+
+A scoreboard is small next to the prompt and structured output schema sent with every call, so a pack of K documents pays for them once, and for one round trip instead of K. The first document of a pack waits `pack_window_seconds` for others. Then one request carries every image and reference text, labelled `Image <n>:`, and returns the results in a wrapper schema indexed by image.
+
+The pack size follows the context and output limits of the model, from the estimated tokens of each document and the size of the results seen so far. Documents missing from a response, or every document of a failed packed call, are retried one by one, and the pack size of that model and schema is halved. Every complete pack at the reduced size lets it grow back by one, so transient failures do not turn packing off for good.
+
+Packing only applies to documents in flight together, e.g. in `batch_run_graph`, `stream_run_graph` or the extraction service.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import BaseModel, Field, create_model
+
+from ..ratelimit import estimate_tokens
+from ..specs import json_schema
+from ..telemetry import annotate, log
+from .configuration import Configuration
+from .hedge import ahedged_run_llm, get_executor, hedged_run_llm
+from .llm import request_tokens
+from .prompt import PACK_PROMPT
+
+# Model -> (context window, output limit) in tokens
+MODEL_CONTEXT_LIMITS: dict[str, tuple[int, int]] = {
+    "gemini-2.5-pro": (1_048_576, 65_536),
+    "gemini-2.5-flash": (1_048_576, 65_536),
+    "gemini-2.5-flash-lite": (1_048_576, 65_536),
+    "gpt-4.1": (1_047_576, 32_768),
+    "gpt-4.1-mini": (1_047_576, 32_768),
+    "gpt-4.1-nano": (1_047_576, 32_768),
+}
+
+# Limits assumed for models not listed
+DEFAULT_CONTEXT_LIMITS = (128_000, 8_192)
+
+# The most documents in one call, however small, as accuracy drops with many images per request
+MAX_PACK_DOCUMENTS = 16
+
+# The share of the limits a pack may fill, long outputs slow down and lose accuracy well before the limit
+PACK_HEADROOM = 0.5
+
+# Output tokens assumed per document until results of the schema have been seen
+DEFAULT_OUTPUT_TOKENS = 1_000
+
+_output_tokens: dict[type[BaseModel], float] = {}
+_size_caps: dict[tuple[str, type[BaseModel]], int] = {}
+_state_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def pack_schema(schema: type[BaseModel]) -> type[BaseModel]:
+    """The wrapper schema of a packed call, one `schema` result per image. Cached, so its structured output specs are built once."""
+    entry = create_model(
+        f"{schema.__name__}PackEntry",
+        image_id=(int, Field(description="The number of the image the result is extracted from, as in its `Image <n>:` label")),
+        result=(schema, ...),
+    )
+    return create_model(f"{schema.__name__}Pack", __doc__=f"One {schema.__name__} per image.", results=(list[entry], Field(description="One result per image")))
+
+
+@lru_cache(maxsize=None)
+def _schema_tokens(schema: type[BaseModel]) -> int:
+    return estimate_tokens(json.dumps(json_schema(pack_schema(schema))))
+
+
+def model_limits(model: str) -> tuple[int, int]:
+    """The context window and output limit of a model in tokens, provider prefix ignored."""
+    return MODEL_CONTEXT_LIMITS.get(model.split("/")[-1], DEFAULT_CONTEXT_LIMITS)
+
+
+def pack_size(configuration: Configuration, request: dict) -> int:
+    """The most documents like `request` one call can carry within the limits of its model.
+
+    Args:
+        configuration (Configuration): The run configuration, `pack_max_documents` caps the size.
+        request (dict): The `run_llm` arguments of one document.
+
+    Returns:
+        int: The pack size, 1 when packing would not fit.
+    """
+    schema = request["schema"]
+    context, output = model_limits(request["model"])
+    shared = estimate_tokens(request["prompt"], PACK_PROMPT) + _schema_tokens(schema)
+    per_document = max(1, request_tokens("", request.get("reference_image"), request.get("reference_text")))
+    with _state_lock:
+        output_per_document = _output_tokens.get(schema, DEFAULT_OUTPUT_TOKENS)
+        cap = min(configuration.pack_max_documents or MAX_PACK_DOCUMENTS, _size_caps.get((request["model"], schema), MAX_PACK_DOCUMENTS))
+    by_input = (context * PACK_HEADROOM - shared) // per_document
+    by_output = output * PACK_HEADROOM // output_per_document
+    return max(1, int(min(cap, by_input, by_output)))
+
+
+def _observe(schema: type[BaseModel], results: list[Optional[BaseModel]]) -> None:
+    """Follow the output size of `schema` from its results, decaying from the largest seen towards the recent ones."""
+    sizes = [estimate_tokens(result.model_dump_json()) for result in results if isinstance(result, BaseModel)]
+    if not sizes:
+        return
+    with _state_lock:
+        _output_tokens[schema] = max(max(sizes), 0.8 * _output_tokens.get(schema, DEFAULT_OUTPUT_TOKENS))
+
+
+def _shrink(request: dict, size: int) -> None:
+    """Halve the pack size of a model and schema after a pack came back incomplete."""
+    with _state_lock:
+        _size_caps[(request["model"], request["schema"])] = max(1, size // 2)
+
+
+def _grow(request: dict, size: int) -> None:
+    """Raise the reduced pack size of a model and schema by one after a complete pack of that size, lifting the cap once it is back to `MAX_PACK_DOCUMENTS`."""
+    key = (request["model"], request["schema"])
+    with _state_lock:
+        cap = _size_caps.get(key)
+        if cap is None or size < cap:
+            return
+        if cap + 1 >= MAX_PACK_DOCUMENTS:
+            del _size_caps[key]
+        else:
+            _size_caps[key] = cap + 1
+
+
+class _Pack:
+    """Documents waiting for one call, each with the future of its result."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.items: list[tuple[dict, Future]] = []
+        self.full = threading.Event()
+        self.closed = False
+
+
+_packs: dict[tuple, _Pack] = {}
+_packs_lock = threading.Lock()
+_running: set[asyncio.Task] = set()
+
+
+def _pack_key(configuration: Configuration, request: dict) -> tuple:
+    return configuration.model_dump_json(), request["model"], request["prompt"], request["schema"]
+
+
+def _join(key: tuple, request: dict, size: int) -> tuple[_Pack, Future, bool, bool]:
+    """Add a document to the open pack of `key`.
+
+    Returns:
+        tuple[_Pack, Future, bool, bool]: The pack, the future of the document's result, whether the document opened the pack, and whether it filled it, closing it for the caller to run.
+    """
+    future: Future = Future()
+    with _packs_lock:
+        pack = _packs.get(key)
+        opened = pack is None
+        if opened:
+            pack = _packs[key] = _Pack(size)
+        pack.items.append((request, future))
+        filled = len(pack.items) >= pack.size
+        if filled:
+            pack.closed = True
+            pack.full.set()
+            del _packs[key]
+    return pack, future, opened, filled
+
+
+def _close(key: tuple, pack: _Pack) -> bool:
+    """Close the pack at the end of its window, True when the caller is to run it."""
+    with _packs_lock:
+        if pack.closed:
+            return False
+        pack.closed = True
+        del _packs[key]
+        return True
+
+
+def _packed_request(requests: list[dict]) -> dict:
+    first = requests[0]
+    return {
+        "model": first["model"],
+        "prompt": f"{first['prompt']}\n\n{PACK_PROMPT.format(count=len(requests))}",
+        "reference_image": [request.get("reference_image") for request in requests],
+        "reference_text": [request.get("reference_text") for request in requests],
+        "schema": pack_schema(first["schema"]),
+    }
+
+
+def _split(response: Optional[BaseModel], count: int) -> list[Optional[BaseModel]]:
+    """The result of each image, None for images the response misses."""
+    results: dict[int, BaseModel] = {}
+    for entry in response.results if response is not None else []:
+        if 0 <= entry.image_id < count:
+            results.setdefault(entry.image_id, entry.result)
+    return [results.get(index) for index in range(count)]
+
+
+def _missing(requests: list[dict], results: list[Optional[BaseModel]]) -> list[int]:
+    missing = [index for index, result in enumerate(results) if result is None]
+    if not missing:
+        _grow(requests[0], len(requests))
+    else:
+        _shrink(requests[0], len(requests))
+        log(f"📦 {len(missing)} of {len(requests)} packed documents missing from {requests[0]['model']}, extracting them one by one", "warning")
+    return missing
+
+
+def _settle(pack: _Pack, outcomes: list[BaseModel | Exception]) -> None:
+    _observe(pack.items[0][0]["schema"], outcomes)
+    for (_, future), outcome in zip(pack.items, outcomes):
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+        else:
+            future.set_result(outcome)
+
+
+def _abandon(pack: _Pack, error: BaseException) -> None:
+    """Fail the documents still waiting when running the pack broke down."""
+    for _, future in pack.items:
+        if not future.done():
+            future.set_exception(error)
+
+
+def _call(configuration: Configuration, request: dict) -> BaseModel | Exception:
+    try:
+        return hedged_run_llm(configuration, **request)
+    except Exception as e:
+        return e
+
+
+def _run_pack(configuration: Configuration, pack: _Pack) -> None:
+    requests = [request for request, _ in pack.items]
+    if len(requests) == 1:
+        outcome = _call(configuration, requests[0])
+        if not isinstance(outcome, Exception):
+            _grow(requests[0], 1)
+        return _settle(pack, [outcome])
+
+    log(f"📦 Packing {len(requests)} documents into one {requests[0]['model']} call", "debug")
+    try:
+        try:
+            outcomes: list = _split(hedged_run_llm(configuration, **_packed_request(requests)), len(requests))
+        except Exception as e:
+            log(f"📦 Packed call failed: {e!r}", "warning")
+            outcomes = [None] * len(requests)
+        missing = _missing(requests, outcomes)
+        # Retried unhedged on the shared pool, a hedged call would wait on the pool from one of its own threads
+        unhedged = configuration.model_copy(update={"hedge_requests": False})
+        for index, outcome in zip(missing, get_executor().map(lambda index: _call(unhedged, requests[index]), missing)):
+            outcomes[index] = outcome
+        _settle(pack, outcomes)
+    except BaseException as e:
+        _abandon(pack, e)
+        raise
+
+
+def _start_pack(configuration: Configuration, pack: _Pack) -> None:
+    """Run the pack as its own task, so cancelling the document that started it does not strand the others."""
+    task = asyncio.create_task(_arun_pack(configuration, pack))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+
+
+async def _arun_pack(configuration: Configuration, pack: _Pack) -> None:
+    requests = [request for request, _ in pack.items]
+    if len(requests) == 1:
+        try:
+            outcome = await ahedged_run_llm(configuration, **requests[0])
+        except Exception as e:
+            outcome = e
+        except BaseException as e:
+            _abandon(pack, e)
+            raise
+        else:
+            _grow(requests[0], 1)
+        return _settle(pack, [outcome])
+
+    log(f"📦 Packing {len(requests)} documents into one {requests[0]['model']} call", "debug")
+    try:
+        try:
+            outcomes = _split(await ahedged_run_llm(configuration, **_packed_request(requests)), len(requests))
+        except Exception as e:
+            log(f"📦 Packed call failed: {e!r}", "warning")
+            outcomes = [None] * len(requests)
+        missing = _missing(requests, outcomes)
+        retried = await asyncio.gather(*(ahedged_run_llm(configuration, **requests[index]) for index in missing), return_exceptions=True)
+        for index, outcome in zip(missing, retried):
+            outcomes[index] = outcome
+        _settle(pack, outcomes)
+    except BaseException as e:
+        _abandon(pack, e)
+        raise
+
+
+def packed_run_llm(configuration: Configuration, **request) -> BaseModel:
+    """`hedged_run_llm`, sharing one call with the documents in flight with the same model, prompt and schema.
+
+    Args:
+        configuration (Configuration): The run configuration.
+        **request: The `run_llm` arguments of one document.
+
+    Returns:
+        BaseModel: The result of this document.
+    """
+    key = _pack_key(configuration, request)
+    pack, future, opened, filled = _join(key, request, pack_size(configuration, request))
+    if opened and not filled:
+        pack.full.wait(configuration.pack_window_seconds)
+        filled = _close(key, pack)
+    if filled:
+        _run_pack(configuration, pack)
+    annotate(pack_size=len(pack.items))
+    return future.result()
+
+
+async def apacked_run_llm(configuration: Configuration, **request) -> BaseModel:
+    """Async version of `packed_run_llm`."""
+    key = _pack_key(configuration, request)
+    pack, future, opened, filled = _join(key, request, pack_size(configuration, request))
+    if opened and not filled:
+        try:
+            await asyncio.sleep(configuration.pack_window_seconds)
+        finally:
+            # Closed even when this document is cancelled, the others of the pack still wait on it
+            if _close(key, pack):
+                _start_pack(configuration, pack)
+    elif filled:
+        _start_pack(configuration, pack)
+    annotate(pack_size=len(pack.items))
+    return await asyncio.wrap_future(future)
@@ -0,0 +1,134 @@
+"""Multi-page documents: document-level OCR split into pages, and reducers combining per-page results."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from pydantic import BaseModel
+
+from ..ocr import get_ocr_backend, serialize_layout
+from ..utils import ImagePayload, get_mime_type
+from .cache import acached_run_ocr, cached_run_ocr
+from .configuration import Configuration
+from .profiles import schema_profile
+from .validation import count_issues
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+
+def page_text(document: documentai.Document, page: documentai.Document.Page) -> str:
+    """Cut the text of one page out of the document text."""
+    return "".join(document.text[segment.start_index : segment.end_index] for segment in page.layout.text_anchor.text_segments)
+
+
+def _page_texts(document: documentai.Document, configuration: Configuration) -> list[str]:
+    # Highlights need the page pixels, which are only decoded later per page
+    if configuration.use_layout:
+        return [serialize_layout(document, index) for index in range(len(document.pages))]
+    return [page_text(document, page) for page in document.pages]
+
+
+def _document_payload(image_path: str, pages: int, configuration: Configuration) -> Optional[ImagePayload]:
+    """The native file to OCR in one request, or None when the pages are OCRed one by one."""
+    if not configuration.use_ocr:
+        return None
+    # Longer documents than the backend takes at once are OCRed page by page
+    max_pages = get_ocr_backend(configuration.ocr_backend).max_pages
+    if max_pages is not None and pages > max_pages:
+        return None
+    return ImagePayload(data=Path(image_path).read_bytes(), mime_type=get_mime_type(image_path))
+
+
+def ocr_page_texts(image_path: str, pages: int, configuration: Configuration) -> Optional[list[str]]:
+    """OCR a PDF or TIFF in one request with its native bytes.
+
+    Args:
+        image_path (str): The PDF or TIFF file.
+        pages (int): The page count.
+        configuration (Configuration): The run configuration.
+
+    Returns:
+        Optional[list[str]]: The text, or layout table, of each page, or None when OCR is disabled or the document is too long for one request.
+    """
+    payload = _document_payload(image_path, pages, configuration)
+    if payload is None:
+        return None
+    document = cached_run_ocr(configuration, payload)
+    return _page_texts(document, configuration)
+
+
+async def aocr_page_texts(image_path: str, pages: int, configuration: Configuration) -> Optional[list[str]]:
+    """Async version of `ocr_page_texts`."""
+    payload = await asyncio.to_thread(_document_payload, image_path, pages, configuration)
+    if payload is None:
+        return None
+    document = await acached_run_ocr(configuration, payload)
+    return await asyncio.to_thread(_page_texts, document, configuration)
+
+
+def first_page(results: list[BaseModel]) -> BaseModel:
+    """Keep the first page with a result."""
+    return results[0]
+
+
+def best_page(results: list[BaseModel]) -> BaseModel:
+    """Keep the page the rule-based checks of the results' profile find the fewest issues in, the first one on ties."""
+    profile = schema_profile(type(results[0]))
+    return min(results, key=lambda result: count_issues(result, profile.check))
+
+
+def _merge_values(values: list[Any]) -> Any:
+    present = [value for value in values if value not in (None, "", [])]
+    if not present:
+        return values[0]
+    if isinstance(present[0], BaseModel):
+        return _merge_fields(present)
+    if isinstance(present[0], list):
+        # Concatenate, dropping items repeated on several pages
+        merged, seen = [], set()
+        for value in present:
+            for item in value:
+                key = json.dumps(item.model_dump() if isinstance(item, BaseModel) else item, sort_keys=True, default=str)
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(item)
+        return merged
+    return present[0]
+
+
+def _merge_fields(results: list[BaseModel]) -> BaseModel:
+    schema = type(results[0])
+    return schema.model_validate({field: _merge_values([getattr(result, field) for result in results]) for field in schema.model_fields})
+
+
+def merge_pages(results: list[BaseModel]) -> BaseModel:
+    """Merge field by field: lists are concatenated without repeats, nested models are merged, and other values come from the first page that has them.
+
+    Raises:
+        ValidationError: When the merged result breaks the schema, e.g. too many players across pages.
+    """
+    return _merge_fields(results)
+
+
+PAGE_REDUCERS: dict[str, Callable[[list[BaseModel]], BaseModel]] = {
+    "first": first_page,
+    "best": best_page,
+    "merge": merge_pages,
+}
+
+
+def register_page_reducer(name: str, reducer: Callable[[list[BaseModel]], BaseModel]) -> None:
+    """Make `reducer` selectable with `Configuration.page_reducer`."""
+    PAGE_REDUCERS[name] = reducer
+
+
+def reduce_pages(results: list[Optional[BaseModel]], configuration: Configuration) -> BaseModel:
+    """Combine the per-page results with the configured reducer, skipping pages without a result."""
+    present = [result for result in results if result is not None]
+    if not present:
+        raise ValueError("No page produced a result")
+    return PAGE_REDUCERS[configuration.page_reducer](present)
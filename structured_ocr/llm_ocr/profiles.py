@@ -0,0 +1,146 @@
+"""Extraction profiles: everything that makes the graph extract one document type, selected per run with `Configuration.profile`.
+
+A profile bundles the target schema, the checker's criteria model, which fields each criterion guards, the prompts, and optionally rule-based checks. Its structured output specs are compiled for the routes of the run's models the first time it is used, so a worker serving several document types converts each schema once.
+"""
+
+from __future__ import annotations
+
+import threading
+from functools import cached_property
+from itertools import combinations
+from typing import Callable, Iterable, Optional
+
+from pydantic import BaseModel, Field
+
+from ..specs import ROUTES, compile_specs, json_schema, model_route
+from .configuration import Configuration
+from .prompt import CHECKER_PROMPT, LAYOUT_EXTRACTION_PROMPT, TEXT_EXTRACTION_PROMPT
+from .schema import CRITERIA_TO_RELATED_FIELDS, Criteria, Match, partial_schema
+from .validation import LocalValidation, validate_match, validate_partial_match
+
+# Profiles with at most this many criteria have the correction schema of every combination of failing criteria compiled up front
+MAX_PRECOMPILED_CRITERIA = 6
+
+
+class Profile(BaseModel):
+    """A document type the graph can extract."""
+
+    model_config = {"arbitrary_types_allowed": True, "frozen": True, "ignored_types": (cached_property,)}
+
+    name: str
+    target_schema: type[BaseModel] = Field(description="The extraction result")
+    criteria: type[BaseModel] = Field(description="The LLM checker's scores, integer fields from 0 to 10 and an optional `reasons`")
+    criteria_to_fields: dict[str, list[str]] = Field(description="The `target_schema` fields the corrector may change when a criterion fails")
+    extraction_prompt: str
+    checker_prompt: str
+    layout_prompt: Optional[str] = Field(default=None, description="The prompt extracting from the OCR layout without the image, None to always send the image")
+    validator: Optional[Callable[[BaseModel], LocalValidation]] = Field(default=None, description="Rule-based checks of a result, None to leave every result to the LLM checker")
+    partial_validator: Optional[Callable[[BaseModel], Optional[str]]] = Field(default=None, description="Checks of a `PartialResult` still being streamed, returning why it is certainly wrong, None to never abort a stream")
+
+    def check(self, result: BaseModel) -> LocalValidation:
+        """Run the rule-based checks, finding nothing when the profile has none."""
+        if self.validator is None:
+            return LocalValidation(hard={}, soft={})
+        return self.validator(result)
+
+    def correction_fields(self, failing_criteria: list[str]) -> tuple[str, ...]:
+        """The fields to correct for the failing criteria, without repeats, in criteria order."""
+        fields = [field for criterion in failing_criteria for field in self.criteria_to_fields.get(criterion, [])]
+        return tuple(dict.fromkeys(fields))
+
+    @cached_property
+    def fingerprint(self) -> dict:
+        """What the result cache key depends on."""
+        return {
+            "name": self.name,
+            "schema": json_schema(self.target_schema),
+            "criteria": json_schema(self.criteria),
+            "prompts": [self.extraction_prompt, self.layout_prompt, self.checker_prompt],
+        }
+
+    def compile(self, routes: Iterable[str] = ROUTES) -> None:
+        """Compile the structured output specs of every schema the graph sends for this profile.
+
+        Args:
+            routes (Iterable[str]): The `run_llm` routes to compile for, "langchain" and/or "gemini".
+        """
+        routes = tuple(routes)
+        compile_specs(self.target_schema, routes)
+        compile_specs(self.criteria, routes)
+        criteria = [criterion for criterion in self.criteria.model_fields if criterion in self.criteria_to_fields]
+        if len(criteria) > MAX_PRECOMPILED_CRITERIA:
+            return
+        # Correction schemas are built from the failing criteria, so every combination maps to one class
+        for size in range(1, len(criteria) + 1):
+            for failing in combinations(criteria, size):
+                compile_specs(partial_schema(self.target_schema, self.correction_fields(list(failing))), routes)
+
+
+PROFILES: dict[str, Profile] = {}
+_compiled: set[tuple[str, str]] = set()  # (profile, route)
+_lock = threading.Lock()
+
+
+def register_profile(profile: Profile) -> None:
+    """Make `profile` selectable with `Configuration.profile`."""
+    with _lock:
+        PROFILES[profile.name] = profile
+        _compiled.difference_update({(profile.name, route) for route in ROUTES})
+
+
+def get_profile(name: str, models: Iterable[str] = ()) -> Profile:
+    """Get the profile registered under `name`, compiling its specs for the routes of `models` on first use.
+
+    Args:
+        name (str): The profile name.
+        models (Iterable[str]): The models the profile will be sent to.
+
+    Returns:
+        Profile: The profile.
+
+    Raises:
+        ValueError: When no profile is registered under `name`.
+    """
+    with _lock:
+        if name not in PROFILES:
+            raise ValueError(f"Unknown profile {name!r}, expected one of {sorted(PROFILES)}")
+        profile = PROFILES[name]
+        routes = {model_route(model) for model in models if model} - {route for compiled, route in _compiled if compiled == name}
+        if routes:
+            profile.compile(routes)
+            _compiled.update((name, route) for route in routes)
+        return profile
+
+
+def configured_profile(configuration: Configuration) -> Profile:
+    """The profile of a run, compiled for the routes of every model the run may call."""
+    models = [configuration.llm_ocr, configuration.llm_checker, *(candidate.model for candidate in configuration.speculative_models)]
+    models += [model for tier in configuration.cascade for model in (tier.llm_ocr, tier.llm_checker)]
+    return get_profile(configuration.profile, models)
+
+
+def schema_profile(schema: type[BaseModel]) -> Profile:
+    """The first registered profile extracting `schema`, for code that only sees results.
+
+    Raises:
+        ValueError: When no profile extracts `schema`.
+    """
+    for name, profile in PROFILES.items():
+        if profile.target_schema is schema:
+            return get_profile(name)
+    raise ValueError(f"No profile extracts {schema.__name__}")
+
+
+register_profile(
+    Profile(
+        name="scoreboard",
+        target_schema=Match,
+        criteria=Criteria,
+        criteria_to_fields=CRITERIA_TO_RELATED_FIELDS,
+        extraction_prompt=TEXT_EXTRACTION_PROMPT,
+        checker_prompt=CHECKER_PROMPT,
+        layout_prompt=LAYOUT_EXTRACTION_PROMPT,
+        validator=validate_match,
+        partial_validator=validate_partial_match,
+    )
+)
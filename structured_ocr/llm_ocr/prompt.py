@@ -17,6 +17,24 @@ TEXT_EXTRACTION_PROMPT = """The given image shows a screenshot of a game scorebo
 5. Ensure numeric values are parsed correctly (e.g., decimals to floats)."""
 
 
+LAYOUT_EXTRACTION_PROMPT = """The given text is the OCR layout of a screenshot of a game scoreboard with two teams: Heroes and Villains, without the image. Each line is a row of the screen from top to bottom, with its vertical position in percent and its cells prefixed by a column index, so cells sharing a column index are aligned vertically. A cell marked {yellow}, {green} or {white} has that highlight colour behind it. Using the rows and columns to rebuild the table, extract and organize the content into a structured JSON format following these guidelines:
+
+1. Identify the two teams ('Heroes' and 'Villains') as shown at the top of each column.
+2. Identify the highlighted player ("me") and assign to the 'me' field.
+3. For each player, extract the following fields:
+   - name: string, the player's displayed name.
+   - level: int, the player's level, where MAX is 1000.
+   - kills: int, number of kills.
+   - assists: int, number of assists.
+   - deaths: int, number of deaths.
+   - kd: float, K/D ratio.
+   - score: int, the player's score.
+4. Group players into:
+   - 'me': the player marked {yellow} as in squad, or {white} as solo.
+   - 'squad': list of players marked {green}.
+   - 'enemies': list of players on the opposing side.
+5. Ensure numeric values are parsed correctly (e.g., decimals to floats)."""
+
 CHECKER_PROMPT = """You are a meticulous quality assurance checker evaluating OCR extraction results from a game scoreboard screenshot. Rate each criterion on a scale of 0-10 where:
 - 10: Perfect extraction with no errors
 - 8-9: Minor errors that don't affect core data integrity
@@ -69,3 +87,5 @@ For each criterion below the threshold, provide:
 - Suggestions for improvement
 
 Be exceptionally thorough in your analysis and err on the side of being more critical rather than lenient."""
+
+PACK_PROMPT = """The {count} images below are separate documents, each introduced by its `Image <n>:` label and followed by its own reference text, if any. Apply the instructions above to every image on its own, never mixing content across images, and return one result per image with the number of its label as `image_id`."""
@@ -1,12 +1,16 @@
 import re
+from functools import lru_cache
 from typing import Literal, Optional
 
-import opencc
-from pydantic import BaseModel, Field, field_validator, model_validator
+from pydantic import BaseModel, Field, create_model, field_validator, model_validator
+
+from .normalize import get_converter
 
 
 def s2hk(v: Optional[str]) -> Optional[str]:
-    """Convert text to traditional Chinese (Hong Kong standard) if not None.
+    """Convert text to traditional Chinese (Hong Kong standard) if not None, with the shared converter.
+
+    To convert a whole result, `normalize_result` does every field in one call.
 
     Args:
         v (Optional[str]): Text to convert.
@@ -15,8 +19,7 @@ def s2hk(v: Optional[str]) -> Optional[str]:
         Optional[str]: Converted text or None.
     """
     if v is not None:
-        converter = opencc.OpenCC("s2hk")
-        return converter.convert(v)
+        return get_converter("s2hk").convert(v)
     return v
 
 
@@ -114,9 +117,22 @@ class Criteria(BaseModel):
 CRITERIA_TO_RELATED_FIELDS: dict[str, list[str]] = {
     "team_names": ["side"],
     "highlighted_player": ["me"],
-    "player_data_accuracy": ["me", "teammates", "enemies"],
-    "grouping": ["me", "teammates", "enemies"],
+    "player_data_accuracy": ["me", "squad", "teammates", "enemies"],
+    "grouping": ["me", "squad", "teammates", "enemies"],
 }
 
 # For dynamic usage
 TARGET_SCHEMA = Match
+
+
+@lru_cache(maxsize=None)
+def partial_schema(schema: type[BaseModel], fields: tuple[str, ...]) -> type[BaseModel]:
+    """Build a sub-model of `schema` with only `fields`, so a correction returns just what is being fixed.
+
+    Cached, so each field subset maps to one class and its structured output binding is reused.
+    """
+    return create_model(
+        f"{schema.__name__}Correction",
+        __doc__=f"The corrected fields of {schema.__name__}.",
+        **{field: (schema.model_fields[field].annotation, schema.model_fields[field]) for field in fields},
+    )
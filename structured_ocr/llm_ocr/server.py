@@ -0,0 +1,458 @@
+"""A long-running extraction service, keeping the compiled graph, profiles, clients and caches warm across requests.
+
+`create_app` returns a plain ASGI application, servable by any ASGI server, e.g. with uvicorn (`pip install 'structured-ocr[server]'`):
+
+    python -m structured_ocr.llm_ocr.server [--port 8000] [--max-queue 256] [--max-in-flight 64] [--batch-window-ms 10]
+
+- `POST /extract` takes the raw image, PDF or TIFF as the body and returns the result as JSON. The query parameters in `ServiceSettings.request_fields`, e.g. `?profile=receipt`, override the `Configuration` of that request.
+- `GET /metrics` returns the queue depth, the requests in flight, the coalesced and rejected requests, and the latency percentiles.
+- `GET /health` returns `{"status": "ok"}`.
+
+Concurrent submissions of the same document with the same setup share one execution. Accepted documents wait in a bounded queue and are collected into micro-batches over `batch_window` seconds, each run with `abatch_run_graph`. A full queue is answered with 503 and `Retry-After` rather than growing without bound.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import math
+import shutil
+import tempfile
+import time
+from collections import deque
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+from urllib.parse import parse_qsl
+
+from langchain_core.runnables import RunnableConfig
+from pydantic import BaseModel, Field
+
+from ..telemetry import log
+from ..utils import sniff_mime_type
+from .cache import get_result_cache, get_stage_cache, result_cache_key
+from .configuration import Configuration
+from .graph import abatch_run_graph, get_graph
+from .profiles import configured_profile
+
+# The file extension the graph reads each accepted MIME type from
+EXTENSIONS = {
+    "application/pdf": ".pdf",
+    "image/tiff": ".tiff",
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/bmp": ".bmp",
+    "image/webp": ".webp",
+}
+
+# Most recent latencies kept for the percentiles
+LATENCY_WINDOW = 10_000
+
+ASGIApp = Callable[[dict, Callable[[], Awaitable[dict]], Callable[[dict], Awaitable[None]]], Awaitable[None]]
+
+
+class ServiceOverloaded(Exception):
+    """The queue is full, the request should be retried after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"The extraction queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class InvalidRequest(ValueError):
+    """The document or the configuration overrides of a request cannot be extracted."""
+
+
+class ServiceSettings(BaseModel):
+    max_queue: int = Field(default=256, description="The documents waiting for a slot, beyond which new ones are rejected", ge=1)
+    max_in_flight: int = Field(default=64, description="The documents extracted at once", ge=1)
+    batch_window: float = Field(default=0.01, description="The seconds a micro-batch waits for more documents after its first", ge=0)
+    max_batch_size: int = Field(default=16, description="The most documents in one micro-batch", ge=1)
+    max_body_bytes: int = Field(default=32 * 1024 * 1024, description="The largest accepted upload")
+    request_fields: tuple[str, ...] = Field(default=("profile", "text_conversion"), description="The `Configuration` fields a request may override with query parameters")
+    spool_dir: Optional[str] = Field(default=None, description="The directory uploads are written to for the graph, a temporary one by default")
+
+
+class ServiceMetrics(BaseModel):
+    queue_depth: int = Field(description="Documents waiting for a slot")
+    in_flight: int = Field(description="Documents being extracted")
+    submitted: int = Field(description="Requests received with a valid document")
+    coalesced: int = Field(description="Requests served by the execution of an identical document in flight")
+    rejected: int = Field(description="Requests rejected on a full queue")
+    completed: int
+    failed: int
+    batches: int
+    mean_batch_size: float
+    latency: dict[str, float] = Field(description="Seconds from enqueueing to the result, p50, p95 and p99")
+    queue_wait: dict[str, float] = Field(description="Seconds from enqueueing to the start of the micro-batch, p50, p95 and p99")
+
+
+class _Job:
+    """One execution, shared by every request coalesced into it."""
+
+    def __init__(self, key: str, image_path: Path, content: bytes, configurable: dict[str, Any], future: asyncio.Future):
+        self.key = key
+        self.image_path = image_path
+        self.content: Optional[bytes] = content
+        self.configurable = configurable
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def spool(self) -> None:
+        """Write the upload where the graph reads it, dropping the copy in memory."""
+        self.image_path.write_bytes(self.content)
+        self.content = None
+
+    @property
+    def group(self) -> str:
+        """Jobs of one micro-batch share their configuration."""
+        return json.dumps(self.configurable, sort_keys=True, default=str)
+
+
+def _percentiles(samples: deque[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    return {name: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+
+
+class ExtractionService:
+    """Singleflight, micro-batching and backpressure in front of `abatch_run_graph`, on one event loop.
+
+    Args:
+        config (Optional[RunnableConfig]): The config of every run, requests may override `settings.request_fields`.
+        settings (Optional[ServiceSettings]): The queue, concurrency and batching limits.
+    """
+
+    def __init__(self, config: Optional[RunnableConfig] = None, settings: Optional[ServiceSettings] = None):
+        self.config: RunnableConfig = config or {}
+        self.settings = settings or ServiceSettings()
+        self._in_flight: dict[str, asyncio.Future] = {}
+        self._batches: set[asyncio.Task] = set()
+        self._starting: Optional[asyncio.Future] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._counts = {"submitted": 0, "coalesced": 0, "rejected": 0, "completed": 0, "failed": 0, "batches": 0, "batched": 0, "running": 0}
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._queue_waits: deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    def _run_config(self, configurable: dict[str, Any]) -> RunnableConfig:
+        return {**self.config, "configurable": {**self.config.get("configurable", {}), **configurable}}
+
+    def _warm(self) -> None:
+        # The provider clients are cached per process too, they are created by the first request
+        configuration = Configuration.from_runnable_config(self.config)
+        get_graph()
+        configured_profile(configuration)
+        get_result_cache(configuration)
+        get_stage_cache(configuration)
+
+    async def _start(self) -> None:
+        self._spool = Path(self.settings.spool_dir or tempfile.mkdtemp(prefix="structured_ocr_"))
+        self._spool.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(self._warm)
+        self._queue: asyncio.Queue[_Job] = asyncio.Queue(maxsize=self.settings.max_queue)
+        self._slots = asyncio.Semaphore(self.settings.max_in_flight)
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        log(f"🛎️ Extraction service ready, spooling to {self._spool}")
+
+    async def start(self) -> None:
+        """Warm the graph, the default profile and the caches, and start dispatching. Safe to call more than once."""
+        if self._starting is None:
+            self._starting = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._starting)
+
+    async def stop(self) -> None:
+        """Stop dispatching, let the running micro-batches finish and fail the queued documents."""
+        if self._starting is None:
+            return
+        await asyncio.shield(self._starting)
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+        await asyncio.gather(*self._batches, return_exceptions=True)
+        while not self._queue.empty():
+            self._finish(self._queue.get_nowait(), RuntimeError("The extraction service stopped"))
+        if self.settings.spool_dir is None:
+            shutil.rmtree(self._spool, ignore_errors=True)
+        self._starting = None
+
+    def _prepare(self, content: bytes, mime_type: Optional[str], configurable: dict[str, Any]) -> tuple[str, str]:
+        """The singleflight key and file extension of a request.
+
+        Raises:
+            InvalidRequest: When the document type is not supported or an override is not allowed or invalid.
+        """
+        if not content:
+            raise InvalidRequest("Empty document")
+        mime_type = sniff_mime_type(content) or mime_type
+        if mime_type not in EXTENSIONS:
+            raise InvalidRequest(f"Unsupported document type {mime_type!r}, expected one of {sorted(EXTENSIONS)}")
+        if unknown := set(configurable) - set(self.settings.request_fields):
+            raise InvalidRequest(f"Cannot override {sorted(unknown)}, expected any of {list(self.settings.request_fields)}")
+        try:
+            configuration = Configuration.from_runnable_config(self._run_config(configurable))
+            profile = configured_profile(configuration)
+        except ValueError as e:
+            raise InvalidRequest(str(e)) from e
+        return result_cache_key(content, configuration, profile), EXTENSIONS[mime_type]
+
+    async def submit(self, content: bytes, mime_type: Optional[str] = None, configurable: Optional[dict[str, Any]] = None) -> dict:
+        """Extract one document, joining the execution of an identical one already in flight.
+
+        Args:
+            content (bytes): The raw image, PDF or TIFF.
+            mime_type (Optional[str]): The declared MIME type, used when the content is not recognized.
+            configurable (Optional[dict[str, Any]]): `Configuration` overrides, limited to `settings.request_fields`.
+
+        Returns:
+            dict: The extraction result, the same object for every coalesced request.
+
+        Raises:
+            InvalidRequest: When the document or the overrides are not valid.
+            ServiceOverloaded: When the queue is full.
+        """
+        await self.start()
+        configurable = configurable or {}
+        key, extension = await asyncio.to_thread(self._prepare, content, mime_type, configurable)
+        self._counts["submitted"] += 1
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self._counts["coalesced"] += 1
+        else:
+            # Queued and registered before any await, so the queue bound holds under concurrent uploads and identical requests arriving meanwhile join this execution
+            future = asyncio.get_running_loop().create_future()
+            try:
+                self._queue.put_nowait(_Job(key, self._spool / f"{key}{extension}", content, configurable, future))
+            except asyncio.QueueFull:
+                self._counts["rejected"] += 1
+                raise ServiceOverloaded(self.retry_after()) from None
+            self._in_flight[key] = future
+
+        # Shielded, so a client disconnecting does not cancel the execution other requests wait on
+        return await asyncio.shield(future)
+
+    async def _next_job(self, timeout: float) -> Optional[_Job]:
+        """The next queued job within `timeout` seconds, with a slot taken for it, or None."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        try:
+            await asyncio.wait_for(self._slots.acquire(), max(0.0, deadline - loop.time()))
+        except TimeoutError:
+            return None
+        try:
+            return self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            pass
+        try:
+            return await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time()))
+        except TimeoutError:
+            self._slots.release()
+            return None
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _dispatch(self) -> None:
+        """Collect queued jobs into micro-batches, one slot per job, and start each batch as its own task."""
+        while True:
+            await self._slots.acquire()
+            try:
+                batch = [await self._queue.get()]
+            except BaseException:
+                self._slots.release()
+                raise
+            try:
+                while len(batch) < self.settings.max_batch_size:
+                    job = await self._next_job(self.settings.batch_window) if self.settings.batch_window else None
+                    if job is None:
+                        break
+                    batch.append(job)
+            except asyncio.CancelledError:
+                for job in batch:
+                    self._finish(job, RuntimeError("The extraction service stopped"))
+                    self._slots.release()
+                raise
+
+            for _, group in groupby(sorted(batch, key=lambda job: job.group), key=lambda job: job.group):
+                task = asyncio.create_task(self._run_batch(list(group)))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, jobs: list[_Job]) -> None:
+        started = time.monotonic()
+        self._counts["batches"] += 1
+        self._counts["batched"] += len(jobs)
+        self._counts["running"] += len(jobs)
+        self._queue_waits.extend(started - job.enqueued for job in jobs)
+
+        outcomes: list[dict | BaseException] = [asyncio.CancelledError()] * len(jobs)
+        try:
+            # Spooled once the job has a slot, a job whose upload cannot be written fails alone
+            written = await asyncio.gather(*(asyncio.to_thread(job.spool) for job in jobs), return_exceptions=True)
+            ready = [job for job, error in zip(jobs, written) if error is None]
+            config = self._run_config(jobs[0].configurable)
+            results = iter(await abatch_run_graph([str(job.image_path) for job in ready], max_concurrency=len(ready), config=config, return_exceptions=True, progress=False) if ready else [])
+            outcomes = [next(results) if error is None else error for error in written]
+        finally:
+            for job, outcome in zip(jobs, outcomes):
+                self._counts["running"] -= 1
+                self._finish(job, outcome)
+                self._slots.release()
+
+    def _finish(self, job: _Job, outcome: dict | BaseException) -> None:
+        # The upload is removed before the key is released, so a new identical request writes its own
+        job.image_path.unlink(missing_ok=True)
+        self._in_flight.pop(job.key, None)
+        self._latencies.append(time.monotonic() - job.enqueued)
+        if isinstance(outcome, BaseException):
+            self._counts["failed"] += 1
+            log(f"❌ Extraction failed: {job.key}: {outcome!r}", "warning")
+            job.future.set_exception(outcome)
+            job.future.exception()  # Retrieved, no warning when every waiter has gone
+        else:
+            self._counts["completed"] += 1
+            job.future.set_result(outcome)
+
+    def retry_after(self) -> int:
+        """Whole seconds until the queue should have room, from the median latency."""
+        p50 = _percentiles(self._latencies).get("p50", 1.0)
+        return max(1, math.ceil(p50 * self._queue.qsize() / self.settings.max_in_flight))
+
+    def metrics(self) -> ServiceMetrics:
+        """The queue depth, work in flight, request counters and latency percentiles."""
+        counts = self._counts
+        return ServiceMetrics(
+            queue_depth=self._queue.qsize() if self._dispatcher is not None else 0,
+            in_flight=counts["running"],
+            submitted=counts["submitted"],
+            coalesced=counts["coalesced"],
+            rejected=counts["rejected"],
+            completed=counts["completed"],
+            failed=counts["failed"],
+            batches=counts["batches"],
+            mean_batch_size=counts["batched"] / counts["batches"] if counts["batches"] else 0.0,
+            latency=_percentiles(self._latencies),
+            queue_wait=_percentiles(self._queue_waits),
+        )
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(receive: Callable[[], Awaitable[dict]], limit: int) -> Optional[bytes]:
+    """The request body, None when the client disconnected."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > limit:
+            raise _BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send: Callable[[dict], Awaitable[None]], status: int, body: Any, headers: tuple[tuple[bytes, bytes], ...] = ()) -> None:
+    payload = json.dumps(body, ensure_ascii=False).encode()
+    await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode()), *headers]})
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def _lifespan(service: ExtractionService, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable[None]]) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await service.start()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await service.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def create_app(config: Optional[RunnableConfig] = None, settings: Optional[ServiceSettings] = None) -> ASGIApp:
+    """Create the ASGI application of an `ExtractionService`, available as `app.service`.
+
+    Args:
+        config (Optional[RunnableConfig]): The config of every run.
+        settings (Optional[ServiceSettings]): The queue, concurrency and batching limits.
+
+    Returns:
+        ASGIApp: The application, started on the ASGI lifespan startup or on the first request.
+    """
+    service = ExtractionService(config, settings)
+
+    async def app(scope: dict, receive: Callable[[], Awaitable[dict]], send: Callable[[dict], Awaitable[None]]) -> None:
+        if scope["type"] == "lifespan":
+            return await _lifespan(service, receive, send)
+        if scope["type"] != "http":
+            return
+
+        method, path = scope["method"], scope["path"].rstrip("/")
+        if path == "/health" and method == "GET":
+            return await _respond(send, 200, {"status": "ok"})
+        if path == "/metrics" and method == "GET":
+            await service.start()
+            return await _respond(send, 200, service.metrics().model_dump())
+        if path != "/extract":
+            return await _respond(send, 404, {"error": f"Not found: {path}"})
+        if method != "POST":
+            return await _respond(send, 405, {"error": "Use POST"}, ((b"allow", b"POST"),))
+
+        try:
+            content = await _read_body(receive, service.settings.max_body_bytes)
+        except _BodyTooLarge:
+            return await _respond(send, 413, {"error": f"The document exceeds {service.settings.max_body_bytes} bytes"})
+        if content is None:
+            return
+        headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+        mime_type = headers.get("content-type", "").split(";")[0].strip() or None
+        configurable = dict(parse_qsl(scope.get("query_string", b"").decode()))
+
+        try:
+            result = await service.submit(content, mime_type, configurable)
+        except InvalidRequest as e:
+            return await _respond(send, 400, {"error": str(e)})
+        except ServiceOverloaded as e:
+            return await _respond(send, 503, {"error": str(e)}, ((b"retry-after", str(e.retry_after).encode()),))
+        except Exception as e:
+            return await _respond(send, 500, {"error": repr(e)})
+        await _respond(send, 200, result)
+
+    app.service = service
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-queue", type=int, default=256, help="The documents waiting for a slot, beyond which requests get 503")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="The documents extracted at once")
+    parser.add_argument("--batch-window-ms", type=float, default=10, help="How long a micro-batch waits for more documents after its first")
+    parser.add_argument("--max-batch-size", type=int, default=16, help="The most documents in one micro-batch")
+    parser.add_argument("--config", default="{}", help="Configuration of every run as JSON, e.g. '{\"use_ocr\": true}'")
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise ImportError("The extraction server requires an ASGI server, install it with `pip install 'structured-ocr[server]'`") from e
+
+    settings = ServiceSettings(max_queue=args.max_queue, max_in_flight=args.max_in_flight, batch_window=args.batch_window_ms / 1000, max_batch_size=args.max_batch_size)
+    uvicorn.run(create_app({"configurable": json.loads(args.config)}, settings), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
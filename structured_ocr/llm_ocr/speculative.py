@@ -0,0 +1,145 @@
+"""Speculative extraction: the extraction is sent to several candidates at once and one result is kept, so a single slow or poor call does not hold up the document. A candidate is a model and the settings it is sampled with, so `llm_ocr` can also be raced against itself at another temperature.
+
+- "first_valid" keeps the first candidate without hard rule-based issues and drops the others, or the one with the fewest issues when none is clean.
+- "best_score" scores every candidate with the checker as soon as it is extracted and keeps the highest total. The checker response of the winner is in the stage cache, so the graph's own check of it is not sent again.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextvars import copy_context
+from typing import Any, Callable, Optional
+
+from pydantic import BaseModel
+
+from ..telemetry import annotate, log
+from .cache import acached_run_llm, cached_run_llm
+from .configuration import Configuration, SpeculativeCandidate
+from .hedge import get_executor
+from .profiles import configured_profile
+from .validation import count_issues
+
+
+class Candidate(BaseModel):
+    """An extraction by one of the raced models."""
+
+    index: int  # Position in `candidate_models`, earlier candidates win ties
+    model: str  # The `SpeculativeCandidate.label`
+    result: Any
+    criteria: Optional[BaseModel] = None  # The checker scores, under "best_score"
+
+
+def candidate_models(configuration: Configuration) -> list[SpeculativeCandidate]:
+    """The candidates raced on the extraction, `llm_ocr` first.
+
+    A candidate repeating an earlier one would send the identical request, served by the same stage cache entry, so it is dropped.
+    """
+    candidates: list[SpeculativeCandidate] = []
+    for candidate in [SpeculativeCandidate(model=configuration.llm_ocr), *configuration.speculative_models]:
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+
+def criteria_score(criteria: BaseModel) -> int:
+    """The total of the criterion scores."""
+    return sum(score for criterion, score in criteria.model_dump().items() if criterion != "reasons" and isinstance(score, int))
+
+
+def _is_clean(candidate: Candidate, configuration: Configuration) -> bool:
+    return not configured_profile(configuration).check(candidate.result).hard
+
+
+def _choose(candidates: list[Candidate], errors: list[Exception], configuration: Configuration) -> Candidate:
+    """Pick among the finished candidates once no early winner was found."""
+    if not candidates:
+        raise errors[0]
+    if configuration.speculative_policy == "best_score":
+        return max(candidates, key=lambda candidate: (criteria_score(candidate.criteria), -candidate.index))
+    profile = configured_profile(configuration)
+    return min(candidates, key=lambda candidate: (count_issues(candidate.result, profile.check), candidate.index))
+
+
+def _won(candidate: Candidate, image_path: str) -> BaseModel:
+    annotate(speculative_winner=candidate.model)
+    log(f"🏁 Speculative extraction won by {candidate.model}: {image_path}")
+    return candidate.result
+
+
+def _run_candidate(configuration: Configuration, index: int, candidate: SpeculativeCandidate, request: dict, checker_request: Optional[Callable[[BaseModel], dict]]) -> Candidate:
+    result = cached_run_llm(configuration, **{**request, **candidate.overrides()})
+    if result is None:
+        raise ValueError(f"{candidate.label} returned no parsable result")
+    criteria = cached_run_llm(configuration, **checker_request(result)) if checker_request is not None else None
+    return Candidate(index=index, model=candidate.label, result=result, criteria=criteria)
+
+
+async def _arun_candidate(configuration: Configuration, index: int, candidate: SpeculativeCandidate, request: dict, checker_request: Optional[Callable[[BaseModel], dict]]) -> Candidate:
+    result = await acached_run_llm(configuration, **{**request, **candidate.overrides()})
+    if result is None:
+        raise ValueError(f"{candidate.label} returned no parsable result")
+    criteria = await acached_run_llm(configuration, **checker_request(result)) if checker_request is not None else None
+    return Candidate(index=index, model=candidate.label, result=result, criteria=criteria)
+
+
+def speculative_extract(configuration: Configuration, request: dict, checker_request: Callable[[BaseModel], dict], image_path: str = "") -> BaseModel:
+    """Race the extraction on every candidate of `candidate_models` and keep one result by `speculative_policy`.
+
+    Args:
+        configuration (Configuration): The run configuration.
+        request (dict): The `run_llm` arguments of the extraction, the model and settings are replaced per candidate.
+        checker_request (Callable[[BaseModel], dict]): Builds the `run_llm` arguments checking a candidate, used by "best_score".
+        image_path (str): The image, for logging.
+
+    Returns:
+        BaseModel: The kept extraction result.
+
+    Raises:
+        Exception: The error of the first candidate when every candidate failed.
+    """
+    check = checker_request if configuration.speculative_policy == "best_score" else None
+    # The race already duplicates the call, and an unhedged candidate never waits on the shared pool it runs in
+    configuration = configuration.model_copy(update={"hedge_requests": False})
+    executor = get_executor()
+    pending = {executor.submit(copy_context().run, _run_candidate, configuration, index, candidate, request, check) for index, candidate in enumerate(candidate_models(configuration))}
+    try:
+        candidates, errors = [], []
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                    continue
+                candidate = future.result()
+                if check is None and _is_clean(candidate, configuration):
+                    return _won(candidate, image_path)
+                candidates.append(candidate)
+        return _won(_choose(candidates, errors, configuration), image_path)
+    finally:
+        # Slower candidates finish in the background and are dropped
+        for future in pending:
+            future.cancel()
+
+
+async def aspeculative_extract(configuration: Configuration, request: dict, checker_request: Callable[[BaseModel], dict], image_path: str = "") -> BaseModel:
+    """Async version of `speculative_extract`, cancelling the slower candidates."""
+    check = checker_request if configuration.speculative_policy == "best_score" else None
+    tasks = [asyncio.ensure_future(_arun_candidate(configuration, index, candidate, request, check)) for index, candidate in enumerate(candidate_models(configuration))]
+    try:
+        pending, candidates, errors = set(tasks), [], []
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    errors.append(task.exception())
+                    continue
+                candidate = task.result()
+                if check is None and _is_clean(candidate, configuration):
+                    return _won(candidate, image_path)
+                candidates.append(candidate)
+        return _won(_choose(candidates, errors, configuration), image_path)
+    finally:
+        for task in tasks:
+            if not task.cancel() and not task.cancelled():
+                task.exception()
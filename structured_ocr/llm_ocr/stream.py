@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import glob
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Iterable, Iterator, Optional, TypeVar
+
+from ..utils import MULTIPAGE_MIME_TYPES, get_mime_type
+from .graph import arun_graph
+
+if TYPE_CHECKING:
+    from langchain_core.runnables import RunnableConfig
+
+T = TypeVar("T")
+
+MANIFEST_SUFFIXES = {".txt", ".jsonl"}
+
+
+def is_document_file(file_path: str) -> bool:
+    """Whether a file found in a directory walk is an image, PDF or TIFF, rather than e.g. an HTML page."""
+    mime_type = get_mime_type(file_path)
+    return mime_type is not None and (mime_type.startswith("image/") or mime_type in MULTIPAGE_MIME_TYPES)
+
+
+def iter_image_paths(source: str | Iterable[str]) -> Iterator[str]:
+    """Lazily list the inputs from a directory walk, a glob pattern, a manifest file or any iterable of paths.
+
+    Args:
+        source (str | Iterable[str]): A directory, a glob pattern, a `.txt` (one path per line) or `.jsonl` (`{"image_path": ...}` per line) manifest, or an iterable of paths.
+
+    Yields:
+        str: The image paths.
+    """
+    if not isinstance(source, str):
+        yield from source
+        return
+
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file in sorted(files):
+                if is_document_file(file):
+                    yield os.path.join(root, file)
+    elif os.path.isfile(source) and (suffix := Path(source).suffix.lower()) in MANIFEST_SUFFIXES:
+        with open(source) as manifest:
+            for line in manifest:
+                if line := line.strip():
+                    yield json.loads(line)["image_path"] if suffix == ".jsonl" else line
+    else:
+        yield from glob.iglob(source, recursive=True)
+
+
+def load_checkpoint(checkpoint_path: str) -> set[str]:
+    """Read the inputs already completed by a previous run."""
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path) as checkpoint:
+        return {line.rstrip("\n") for line in checkpoint if line.strip()}
+
+
+async def astream_run_graph(
+    source: str | Iterable[str],
+    sink_path: Optional[str] = None,
+    checkpoint_path: Optional[str] = None,
+    max_concurrency: int = 64,
+    config: Optional[RunnableConfig] = None,
+) -> AsyncIterator[tuple[str, dict | Exception]]:
+    """Run the graph over a stream of inputs, yielding each result as soon as it finishes.
+
+    Inputs are pulled lazily, so at most `max_concurrency` documents are held at once. Each outcome is appended to the JSONL sink as it arrives, and each success to the checkpoint file, so a restart skips completed inputs and retries failed ones.
+
+    Args:
+        source (str | Iterable[str]): The inputs, see `iter_image_paths`.
+        sink_path (Optional[str]): The JSONL file receiving `{"image_path", "result" | "error"}` lines.
+        checkpoint_path (Optional[str]): The file listing completed inputs, defaults to `<sink_path>.checkpoint` when a sink is given.
+        max_concurrency (int): The maximum number of documents in flight.
+        config (Optional[RunnableConfig]): The config shared by every run.
+
+    Yields:
+        tuple[str, dict | Exception]: The image path with its result, or the error that stopped it, in completion order.
+    """
+    if checkpoint_path is None and sink_path is not None:
+        checkpoint_path = f"{sink_path}.checkpoint"
+    completed = load_checkpoint(checkpoint_path) if checkpoint_path else set()
+
+    sink = open(sink_path, "a") if sink_path else None
+    checkpoint = open(checkpoint_path, "a") if checkpoint_path else None
+    image_paths = (image_path for image_path in iter_image_paths(source) if image_path not in completed)
+    in_flight: dict[asyncio.Task, str] = {}
+
+    try:
+        exhausted = False
+        while in_flight or not exhausted:
+            while not exhausted and len(in_flight) < max_concurrency:
+                image_path = next(image_paths, None)
+                if image_path is None:
+                    exhausted = True
+                else:
+                    in_flight[asyncio.create_task(arun_graph(image_path, config=config))] = image_path
+
+            if not in_flight:
+                break
+            done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                image_path = in_flight.pop(task)
+                outcome = task.exception() or task.result()
+                if sink is not None:
+                    record = {"image_path": image_path, "error": repr(outcome)} if isinstance(outcome, Exception) else {"image_path": image_path, "result": outcome}
+                    sink.write(json.dumps(record) + "\n")
+                    sink.flush()
+                if checkpoint is not None and not isinstance(outcome, Exception):
+                    checkpoint.write(image_path + "\n")
+                    checkpoint.flush()
+                yield image_path, outcome
+    finally:
+        for task in in_flight:
+            task.cancel()
+        # Awaited, so a consumer stopping early leaves no pending task behind on the loop
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        if sink is not None:
+            sink.close()
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+def stream_run_graph(
+    source: str | Iterable[str],
+    sink_path: Optional[str] = None,
+    checkpoint_path: Optional[str] = None,
+    max_concurrency: int = 64,
+    config: Optional[RunnableConfig] = None,
+) -> Iterator[tuple[str, dict | Exception]]:
+    """Sync version of `astream_run_graph`, driving it on a private event loop.
+
+    Called while an event loop is running, e.g. in a Jupyter cell, the private loop runs in a worker thread, and the calling loop is blocked between results. Async code should iterate `astream_run_graph` instead.
+    """
+    loop = asyncio.new_event_loop()
+    results = astream_run_graph(source, sink_path, checkpoint_path, max_concurrency, config)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        executor = None
+    else:
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="structured_ocr_stream")
+    context = copy_context()
+
+    def run(awaitable: Awaitable[T]) -> T:
+        if executor is None:
+            return loop.run_until_complete(awaitable)
+        return executor.submit(context.run, loop.run_until_complete, awaitable).result()
+
+    try:
+        while True:
+            try:
+                yield run(anext(results))
+            except StopAsyncIteration:
+                break
+    finally:
+        try:
+            run(results.aclose())
+        finally:
+            loop.close()
+            if executor is not None:
+                executor.shutdown()
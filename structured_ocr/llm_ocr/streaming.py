@@ -0,0 +1,303 @@
+"""Streaming structured output: the result of an LLM call is assembled field by field while the model is still generating it.
+
+The JSON output is parsed incrementally. Each top-level field is validated as soon as it closes, e.g. `side` and `me` of a `Match` first, and each item of a list field as soon as it closes, e.g. every `Player` of `squad`. After each one, `on_partial` gets the result so far, built with `model_construct`. It may raise `StreamAborted` to drop a clearly invalid stream without paying for the rest of it. Once the whole object has closed, the result is validated in full and passed with `done` set, before the provider has ended the stream.
+
+The span of the call records `first_field_seconds`, the time to the first validated field, `complete_seconds`, the time to the whole object, and, for a stream dropped by `on_partial` or on an invalid field, `abort_seconds`, `abort_reason` and `aborted`.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from contextlib import aclosing, closing
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Iterator, Optional, get_args, get_origin
+
+from PIL import Image
+from pydantic import BaseModel, SerializeAsAny, TypeAdapter, ValidationError
+
+from ..telemetry import annotate, log
+from ..utils import ImagePayload
+from .llm import astream_llm, stream_llm
+
+# Levels of the output reported as they close: the top-level fields and the items of top-level lists
+PARTIAL_DEPTH = 2
+
+_WHITESPACE = " \t\n\r"
+
+
+class StreamAborted(ValueError):
+    """The stream was dropped by `on_partial` before the output was complete. A `ValueError`, so the graph's node retries leave it alone."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class PartialResult(BaseModel):
+    """A structured output still being generated."""
+
+    value: SerializeAsAny[BaseModel]  # `model_construct` of the fields so far, list fields holding the items closed so far; the validated result once `done`
+    completed: frozenset[str] = frozenset()  # Top-level fields that have closed
+    path: tuple[str | int, ...] = ()  # The field, or list item, that just closed, empty once `done`
+    elapsed: float = 0.0  # Seconds since the call started
+    done: bool = False
+
+
+class _Frame:
+    """An object or array being parsed: where it starts, and the key or index of the value being read."""
+
+    __slots__ = ("kind", "start", "key", "index", "expects_key")
+
+    def __init__(self, kind: str, start: int):
+        self.kind = kind
+        self.start = start
+        self.key: Optional[str] = None
+        self.index = 0
+        self.expects_key = kind == "{"
+
+    @property
+    def position(self) -> str | int:
+        return self.key if self.kind == "{" else self.index
+
+
+class PartialJSONParser:
+    """Incremental JSON parser reporting values as soon as they close.
+
+    Every chunk is scanned once, so a stream costs one pass over its text however it is split. Only the values down to `depth` levels are decoded. Text before the root object, such as a Markdown fence, is skipped.
+
+    Args:
+        depth (int): The deepest level reported, 1 for the top-level fields.
+    """
+
+    def __init__(self, depth: int = PARTIAL_DEPTH):
+        self.depth = depth
+        self.text = ""
+        self.done = False
+        self._start = 0
+        self._end: Optional[int] = None
+        self._stack: list[_Frame] = []
+        self._in_string = False
+        self._escaped = False
+        self._token_start: Optional[int] = None  # The start of the string or bare literal being read
+
+    @property
+    def document(self) -> str:
+        """The text of the root value, once it has closed."""
+        return self.text[self._start : self._end] if self._end is not None else ""
+
+    def feed(self, chunk: str) -> list[tuple[tuple[str | int, ...], Any]]:
+        """Parse the next piece of the text.
+
+        Args:
+            chunk (str): The text following what was fed so far.
+
+        Returns:
+            list[tuple[tuple[str | int, ...], Any]]: The path and decoded value of each value that closed, in order. The root is reported with an empty path.
+        """
+        closed = []
+        offset = len(self.text)
+        self.text += chunk
+        for position in range(offset, len(self.text)):
+            if self.done:
+                break
+            self._scan(position, closed)
+        return closed
+
+    def _scan(self, position: int, closed: list) -> None:
+        char = self.text[position]
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                frame = self._stack[-1]
+                if frame.expects_key:
+                    # Keys are only needed for the paths of reported values
+                    frame.key = json.loads(self.text[self._token_start : position + 1]) if len(self._stack) <= self.depth else None
+                    frame.expects_key = False
+                else:
+                    self._close(self._token_start, position + 1, closed)
+                self._token_start = None
+            return
+
+        if self._token_start is not None:
+            if char not in _WHITESPACE and char not in ",}]":
+                return
+            # A bare literal, a number, true, false or null, ends at the next delimiter
+            self._close(self._token_start, position, closed)
+            self._token_start = None
+
+        if char in _WHITESPACE or char == ":":
+            return
+        if not self._stack and char not in "{[":
+            return
+        if char in "{[":
+            if not self._stack:
+                self._start = position
+            self._stack.append(_Frame(char, position))
+        elif char in "}]":
+            frame = self._stack.pop()
+            self._close(frame.start, position + 1, closed)
+        elif char == ",":
+            frame = self._stack[-1]
+            if frame.kind == "{":
+                frame.expects_key = True
+            else:
+                frame.index += 1
+        else:
+            self._in_string = char == '"'
+            self._token_start = position
+
+    def _close(self, start: int, end: int, closed: list) -> None:
+        if not self._stack:
+            self.done = True
+            self._end = end
+            closed.append(((), None))
+            return
+        path = tuple(frame.position for frame in self._stack)
+        if len(path) <= self.depth:
+            closed.append((path, json.loads(self.text[start:end])))
+
+
+@lru_cache(maxsize=None)
+def _field_adapter(schema: type[BaseModel], field: str) -> TypeAdapter:
+    return TypeAdapter(schema.model_fields[field].annotation)
+
+
+@lru_cache(maxsize=None)
+def _item_adapter(schema: type[BaseModel], field: str) -> Optional[TypeAdapter]:
+    """The adapter of the items of a list field, None for other fields."""
+    annotation = schema.model_fields[field].annotation
+    if get_origin(annotation) is not list:
+        return None
+    return TypeAdapter(get_args(annotation)[0])
+
+
+class _Assembly:
+    """The result of one streamed call, built from the values the parser reports."""
+
+    def __init__(self, schema: type[BaseModel], on_partial: Optional[Callable[[PartialResult], None]]):
+        self.schema = schema
+        self.on_partial = on_partial
+        self.parser = PartialJSONParser()
+        self.fields: dict[str, Any] = {}
+        self.completed: set[str] = set()
+        self.result: Optional[BaseModel] = None
+        self.start = time.monotonic()
+        self._first = True
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def feed(self, chunk: str) -> None:
+        if self.parser.done:
+            return
+        for path, value in self.parser.feed(chunk):
+            if not path:
+                self.result = self.schema.model_validate_json(self.parser.document)
+                annotate(complete_seconds=self.elapsed())
+                self._emit(PartialResult(value=self.result, completed=frozenset(self.completed), elapsed=self.elapsed(), done=True))
+            elif self._add(path, value):
+                self._emit(PartialResult(value=self.schema.model_construct(**self.fields), completed=frozenset(self.completed), path=path, elapsed=self.elapsed()))
+
+    def _add(self, path: tuple[str | int, ...], value: Any) -> bool:
+        """Validate a value that closed into the fields, False for values not reported on their own."""
+        field = path[0]
+        if field not in self.schema.model_fields:
+            return False
+        if len(path) == 1:
+            # List items are validated as they close
+            if field not in self.fields or _item_adapter(self.schema, field) is None:
+                self.fields[field] = _field_adapter(self.schema, field).validate_python(value)
+            self.completed.add(field)
+        elif (adapter := _item_adapter(self.schema, field)) is not None:
+            self.fields.setdefault(field, []).append(adapter.validate_python(value))
+        else:
+            return False
+        if self._first:
+            self._first = False
+            annotate(first_field_seconds=self.elapsed())
+        return True
+
+    def _emit(self, partial: PartialResult) -> None:
+        if self.on_partial is not None:
+            self.on_partial(partial)
+
+    def finish(self) -> Optional[BaseModel]:
+        """The validated result, None for an empty response like `run_llm`."""
+        if self.result is None and self.parser.text.strip():
+            # Truncated output fails validation like the unstreamed call would
+            return self.schema.model_validate_json(self.parser.text)
+        return self.result
+
+    def abort(self, error: Exception) -> None:
+        reason = error.reason if isinstance(error, StreamAborted) else f"{error.error_count()} invalid values"
+        annotate(abort_seconds=self.elapsed(), abort_reason=reason, aborted=True)
+        log(f"✋ Stream aborted after {self.elapsed():.2f}s: {reason}", "debug")
+
+
+def run_llm_streaming(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+    on_partial: Optional[Callable[[PartialResult], None]] = None,
+) -> BaseModel:
+    """`run_llm`, streamed, with the result so far passed to `on_partial` after every field or list item.
+
+    Args:
+        model (str): The model to use.
+        prompt (str): The prompt to pass to the LLM.
+        reference_image (Image.Image | ImagePayload): The image to pass to the LLM.
+        reference_text (str): The text to pass to the LLM.
+        schema (BaseModel): The schema to use for the structured output.
+        on_partial (Optional[Callable[[PartialResult], None]]): Called with every partial result, and with the validated one. Raise `StreamAborted` to drop the stream.
+
+    Returns:
+        BaseModel: The structured output of the LLM.
+
+    Raises:
+        StreamAborted: When `on_partial` dropped the stream.
+        ValidationError: As soon as a field is invalid.
+    """
+
+    def _consume(chunks: Iterator[str]) -> Optional[BaseModel]:
+        assembly = _Assembly(schema, on_partial)
+        try:
+            with closing(chunks):
+                for chunk in chunks:
+                    assembly.feed(chunk)
+        except (StreamAborted, ValidationError) as e:
+            assembly.abort(e)
+            raise
+        return assembly.finish()
+
+    return stream_llm(model, prompt, reference_image, reference_text, schema, consume=_consume)
+
+
+async def arun_llm_streaming(
+    model: str,
+    prompt: str,
+    reference_image: Image.Image | ImagePayload = None,
+    reference_text: str = None,
+    schema: BaseModel = None,
+    on_partial: Optional[Callable[[PartialResult], None]] = None,
+) -> BaseModel:
+    """Async version of `run_llm_streaming`, `on_partial` is called on the event loop."""
+
+    async def _consume(chunks: AsyncIterator[str]) -> Optional[BaseModel]:
+        assembly = _Assembly(schema, on_partial)
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    assembly.feed(chunk)
+        except (StreamAborted, ValidationError) as e:
+            assembly.abort(e)
+            raise
+        return assembly.finish()
+
+    return await astream_llm(model, prompt, reference_image, reference_text, schema, consume=_consume)
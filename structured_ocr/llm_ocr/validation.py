@@ -0,0 +1,155 @@
+from typing import TYPE_CHECKING, Callable, Literal, Optional
+
+from pydantic import BaseModel, ValidationError
+
+from .configuration import Configuration
+from .schema import Criteria, Match, Player
+
+if TYPE_CHECKING:
+    from .streaming import PartialResult
+
+# Tolerance between the shown K/D and kills/deaths, the scoreboard rounds to 2 decimals
+KD_TOLERANCE = 0.05
+# Players per side in a full lobby
+SIDE_SIZE = 4
+# Score deducted from a criterion per hard and soft issue
+HARD_PENALTY = 4
+SOFT_PENALTY = 2
+
+
+class LocalValidation(BaseModel):
+    """Issues found by the rule-based checks, grouped by `Criteria` field."""
+
+    hard: dict[str, list[str]]
+    soft: dict[str, list[str]]
+
+    def criteria(self, criteria: type[BaseModel] = Criteria) -> BaseModel:
+        """Score the issues like the LLM checker would, on the criteria model of the profile."""
+        scores = {}
+        for criterion in criteria.model_fields:
+            if criterion == "reasons":
+                continue
+            penalty = HARD_PENALTY * len(self.hard.get(criterion, [])) + SOFT_PENALTY * len(self.soft.get(criterion, []))
+            scores[criterion] = max(0, 10 - penalty)
+
+        issues = [issue for group in (self.hard, self.soft) for criterion_issues in group.values() for issue in criterion_issues]
+        return criteria(**scores, reasons="; ".join(issues) or None)
+
+
+def _player_issues(player: Player, label: str) -> list[str]:
+    issues = []
+    # Results merged by the corrector bypass validation, so re-check the field bounds
+    try:
+        Player.model_validate(player.model_dump())
+    except ValidationError as e:
+        issues.extend(f"{label}: {error['loc'][0]} {error['msg']}" for error in e.errors())
+
+    expected_kd = player.kills / player.deaths if player.deaths else float(player.kills)
+    if abs(player.kd - expected_kd) > KD_TOLERANCE:
+        issues.append(f"{label}: K/D {player.kd} does not match kills/deaths {player.kills}/{player.deaths}")
+    return issues
+
+
+def validate_match(result: Match) -> LocalValidation:
+    """Check arithmetic consistency, value bounds, duplicates and side sizes of a `Match`.
+
+    Args:
+        result (Match): The extraction result.
+
+    Returns:
+        LocalValidation: The hard issues, which are certainly wrong, and the soft ones, which are only suspicious.
+    """
+    hard: dict[str, list[str]] = {}
+    soft: dict[str, list[str]] = {}
+
+    groups = {"me": [result.me], "squad": result.squad, "teammates": result.teammates, "enemies": result.enemies}
+
+    for group, players in groups.items():
+        for index, player in enumerate(players):
+            hard.setdefault("player_data_accuracy", []).extend(_player_issues(player, f"{group}[{index}] {player.name}"))
+
+    # The same name in two places means a player was grouped twice
+    seen: dict[str, str] = {}
+    for group, players in groups.items():
+        for player in players:
+            if player.name in seen:
+                hard.setdefault("grouping", []).append(f"{player.name} appears in both {seen[player.name]} and {group}")
+            seen.setdefault(player.name, group)
+
+    my_side = 1 + len(result.squad) + len(result.teammates)
+    if my_side > SIDE_SIZE:
+        hard.setdefault("grouping", []).append(f"{my_side} players on my side, at most {SIDE_SIZE}")
+    if len(result.enemies) > SIDE_SIZE:
+        hard.setdefault("grouping", []).append(f"{len(result.enemies)} enemies, at most {SIDE_SIZE}")
+    # Lobbies are usually full, a short side hints at a missed row
+    if my_side < SIDE_SIZE or len(result.enemies) < SIDE_SIZE:
+        soft.setdefault("grouping", []).append(f"{my_side} players on my side against {len(result.enemies)} enemies, expected {SIDE_SIZE} each")
+
+    return LocalValidation(
+        hard={criterion: issues for criterion, issues in hard.items() if issues},
+        soft={criterion: issues for criterion, issues in soft.items() if issues},
+    )
+
+
+def validate_partial_match(partial: "PartialResult") -> Optional[str]:
+    """Check a `Match` still being streamed for what no correction would fix: more players on a side than a lobby holds, or a player listed twice.
+
+    Issues of single players, such as a K/D off its kills and deaths, are left to the corrector.
+
+    Args:
+        partial (PartialResult): The result so far.
+
+    Returns:
+        Optional[str]: Why the result is certainly wrong, None while it may still be right.
+    """
+    if partial.done:
+        return None
+    # Fields not streamed yet are missing from the partial result
+    me = getattr(partial.value, "me", None)
+    squad, teammates, enemies = (getattr(partial.value, group, []) for group in ("squad", "teammates", "enemies"))
+
+    my_side = (me is not None) + len(squad) + len(teammates)
+    if my_side > SIDE_SIZE:
+        return f"{my_side} players on my side, at most {SIDE_SIZE}"
+    if len(enemies) > SIDE_SIZE:
+        return f"{len(enemies)} enemies, at most {SIDE_SIZE}"
+
+    seen = set()
+    for player in [me, *squad, *teammates, *enemies]:
+        if player is None:
+            continue
+        if player.name in seen:
+            return f"{player.name} appears twice"
+        seen.add(player.name)
+    return None
+
+
+def criteria_met_percentage(criteria: BaseModel, threshold: int) -> float:
+    """The percentage of criteria scored at least `threshold`."""
+    scores = [score for criterion, score in criteria.model_dump().items() if criterion != "reasons" and isinstance(score, int)]
+    return sum(score >= threshold for score in scores) / len(scores) * 100
+
+
+def count_issues(result: BaseModel, validator: Callable[[BaseModel], LocalValidation] = validate_match) -> tuple[int, int]:
+    """Count the hard and soft issues `validator` finds in a result, for ranking candidates from fewest to most."""
+    validation = validator(result)
+    return sum(map(len, validation.hard.values())), sum(map(len, validation.soft.values()))
+
+
+def route_local_validation(validation: LocalValidation, configuration: Configuration, criteria: type[BaseModel] = Criteria) -> Literal["valid", "invalid", "check"]:
+    """Route on the local checks.
+
+    Args:
+        validation (LocalValidation): The issues found.
+        configuration (Configuration): The run configuration.
+        criteria (type[BaseModel]): The criteria model of the profile.
+
+    Returns:
+        Literal["valid", "invalid", "check"]: "invalid" when a criterion is certainly below threshold, "valid" when nothing looks off and the checker may be skipped, otherwise "check".
+    """
+    scores = [score for criterion, score in validation.criteria(criteria).model_dump().items() if criterion != "reasons"]
+    if any(score < configuration.criterion_score_threshold for score in scores) and validation.hard:
+        return "invalid"
+    if not validation.hard and not validation.soft and configuration.skip_checker_when_valid:
+        return "valid"
+    return "check"
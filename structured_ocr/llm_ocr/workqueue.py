@@ -0,0 +1,825 @@
+"""Distributed work queue: producers enqueue documents into a durable queue, and worker processes on any number of nodes lease, extract and acknowledge them.
+
+A worker leases a few jobs at a time and runs each with `arun_graph`, keeping up to `concurrency` in flight. While a job runs, its lease is extended every third of `lease_seconds`. A finished job is acknowledged with its result. A failed job goes back to the queue after an exponential backoff until it has used `max_attempts`, then to the dead letters. A job whose lease ran out, e.g. because its worker crashed, is handed to the next worker, and counts as one more attempt. Each worker publishes its throughput to the queue, so `queue_stats` covers every node.
+
+Backends:
+- `SQLiteQueue`, the default, one SQLite file shared by the worker processes of one machine, or of several over a network file system with working locks
+- `RedisQueue`, a Redis server shared by every node, needs `redis` (`pip install 'structured-ocr[redis]'`)
+
+Usage:
+    python -m structured_ocr.llm_ocr.workqueue enqueue path/to/images --queue jobs.sqlite --config '{"use_ocr": true}'
+    python -m structured_ocr.llm_ocr.workqueue work --queue jobs.sqlite --processes 4 --concurrency 8 [--drain]
+    python -m structured_ocr.llm_ocr.workqueue stats --queue jobs.sqlite
+    python -m structured_ocr.llm_ocr.workqueue dead --queue jobs.sqlite [--requeue]
+    python -m structured_ocr.llm_ocr.workqueue results --queue jobs.sqlite --output results.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager, contextmanager, suppress
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Iterable, Iterator, Literal, Optional
+from urllib.parse import unquote, urlparse
+
+from pydantic import BaseModel, Field
+
+from ..telemetry import log
+from .graph import arun_graph
+
+if TYPE_CHECKING:
+    from rich.table import Table
+
+JobStatus = Literal["pending", "leased", "done", "dead"]
+
+# Runs of a job, the first included, before it goes to the dead letters
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+class Job(BaseModel):
+    """One document to extract, with its run configuration and delivery state."""
+
+    id: str
+    image_path: str = Field(description="A path readable by the workers, or a file:// or http(s):// URI")
+    config: dict[str, Any] = Field(default_factory=dict, description="The `configurable` of the run")
+    status: JobStatus = "pending"
+    attempts: int = Field(default=0, description="The leases taken so far, the current one included")
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+    enqueued_at: float
+    available_at: float = Field(description="Epoch seconds from which the job may be leased, later than `enqueued_at` while a retry backs off")
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = Field(default=None, description="The error of the last failed attempt")
+    result: Optional[dict[str, Any]] = None
+
+
+class WorkerStats(BaseModel):
+    """The throughput of one worker process, published to the queue as it runs."""
+
+    worker_id: str
+    started_at: float
+    updated_at: float
+    leased: int = 0
+    succeeded: int = 0
+    failed: int = 0  # Attempts that raised, retried or dead-lettered
+    retried: int = 0
+    dead_lettered: int = 0
+    lost_leases: int = 0  # Jobs finished after another worker had taken them over, their outcome dropped
+    queue_errors: int = 0  # Queue calls that raised, e.g. on a locked SQLite file, an outcome not stored is taken over once its lease runs out
+    busy_seconds: float = 0.0  # Summed over the jobs in flight
+
+    @property
+    def docs_per_second(self) -> float:
+        elapsed = self.updated_at - self.started_at
+        return self.succeeded / elapsed if elapsed > 0 else 0.0
+
+
+class QueueStats(BaseModel):
+    counts: dict[JobStatus, int]
+    workers: list[WorkerStats]
+
+
+class QueueBackend(ABC):
+    """A durable job queue shared by producers and workers. Every method is safe to call from several threads and processes."""
+
+    def enqueue(self, image_paths: Iterable[str], config: Optional[dict[str, Any]] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> list[str]:
+        """Add one job per image.
+
+        Args:
+            image_paths (Iterable[str]): The images, paths readable by the workers or file:// and http(s):// URIs.
+            config (Optional[dict[str, Any]]): The `configurable` of every run.
+            max_attempts (int): The runs of a job before it goes to the dead letters.
+
+        Returns:
+            list[str]: The job ids, in order.
+        """
+        now = time.time()
+        jobs = [Job(id=uuid.uuid4().hex, image_path=image_path, config=config or {}, max_attempts=max_attempts, enqueued_at=now, available_at=now) for image_path in image_paths]
+        self.put(jobs)
+        return [job.id for job in jobs]
+
+    @abstractmethod
+    def put(self, jobs: list[Job]) -> None:
+        """Store new pending jobs."""
+
+    @abstractmethod
+    def lease(self, worker_id: str, count: int, lease_seconds: float) -> list[Job]:
+        """Take up to `count` available jobs for `lease_seconds`, first expiring the leases that ran out."""
+
+    @abstractmethod
+    def extend(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Renew the lease of a running job, False when the worker no longer holds it."""
+
+    @abstractmethod
+    def ack(self, job_id: str, worker_id: str, result: dict[str, Any]) -> bool:
+        """Store the result of a finished job, False when the worker no longer holds it."""
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str, retry_after: float = 0.0) -> Optional[JobStatus]:
+        """Record a failed attempt, "pending" when the job is retried after `retry_after` seconds, "dead" when it is out of attempts, None when the worker no longer holds it."""
+
+    @abstractmethod
+    def release(self, job_id: str, worker_id: str) -> bool:
+        """Return a job unfinished, e.g. on shutdown, without using up an attempt."""
+
+    @abstractmethod
+    def jobs(self, status: Optional[JobStatus] = None, limit: Optional[int] = None) -> list[Job]:
+        """The jobs with `status`, or all of them, oldest first."""
+
+    @abstractmethod
+    def counts(self) -> dict[JobStatus, int]:
+        """The number of jobs per status."""
+
+    @abstractmethod
+    def requeue_dead(self, job_ids: Optional[Iterable[str]] = None) -> int:
+        """Move dead jobs, all of them by default, back to pending with their attempts reset. Returns how many moved."""
+
+    @abstractmethod
+    def report(self, stats: WorkerStats) -> None:
+        """Publish the stats of a worker."""
+
+    @abstractmethod
+    def workers(self) -> list[WorkerStats]:
+        """The last stats published by every worker."""
+
+    def is_drained(self) -> bool:
+        """Whether no job is pending or running, retries backing off included."""
+        counts = self.counts()
+        return counts["pending"] == 0 and counts["leased"] == 0
+
+    def close(self) -> None:
+        """Release the connection."""
+
+
+_COLUMNS = tuple(Job.model_fields)
+_JSON_COLUMNS = {"config", "result"}
+
+
+class SQLiteQueue(QueueBackend):
+    """A queue in one SQLite file, shared by worker processes through SQLite's own locking.
+
+    Args:
+        path (str): The SQLite file.
+        name (str): The table of the jobs, so one file can hold several queues.
+    """
+
+    def __init__(self, path: str, name: str = "jobs"):
+        Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.table = name
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(Path(path).expanduser(), check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} (id TEXT PRIMARY KEY, image_path TEXT NOT NULL, config TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL, max_attempts INTEGER NOT NULL, "
+            "enqueued_at REAL NOT NULL, available_at REAL NOT NULL, lease_owner TEXT, lease_expires_at REAL, finished_at REAL, error TEXT, result TEXT)"
+        )
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS {name}_available ON {name} (status, available_at)")
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS {name}_workers (worker_id TEXT PRIMARY KEY, stats TEXT NOT NULL)")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the write lock of the file, so leases of concurrent workers never overlap."""
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+            self._connection.execute("COMMIT")
+
+    @staticmethod
+    def _job(row: tuple) -> Job:
+        return Job(**{column: json.loads(value) if column in _JSON_COLUMNS and value is not None else value for column, value in zip(_COLUMNS, row)})
+
+    def put(self, jobs: list[Job]) -> None:
+        rows = [tuple(json.dumps(value) if column in _JSON_COLUMNS and value is not None else value for column, value in job.model_dump().items()) for job in jobs]
+        with self._transaction() as connection:
+            connection.executemany(f"INSERT INTO {self.table} ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})", rows)
+
+    def lease(self, worker_id: str, count: int, lease_seconds: float) -> list[Job]:
+        now = time.time()
+        with self._transaction() as connection:
+            # Jobs of crashed or stalled workers that are out of attempts are not handed out again
+            connection.execute(
+                f"UPDATE {self.table} SET status = 'dead', error = 'lease expired', lease_owner = NULL, finished_at = ? WHERE status = 'leased' AND lease_expires_at < ? AND attempts >= max_attempts",
+                (now, now),
+            )
+            ids = [
+                row[0]
+                for row in connection.execute(
+                    f"SELECT id FROM {self.table} WHERE (status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires_at < ?) ORDER BY available_at LIMIT ?",
+                    (now, now, count),
+                )
+            ]
+            if not ids:
+                return []
+            placeholders = ", ".join("?" * len(ids))
+            connection.execute(
+                f"UPDATE {self.table} SET status = 'leased', lease_owner = ?, lease_expires_at = ?, attempts = attempts + 1 WHERE id IN ({placeholders})",
+                (worker_id, now + lease_seconds, *ids),
+            )
+            rows = connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM {self.table} WHERE id IN ({placeholders}) ORDER BY available_at", ids).fetchall()
+        return [self._job(row) for row in rows]
+
+    def extend(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        with self._lock:
+            cursor = self._connection.execute(
+                f"UPDATE {self.table} SET lease_expires_at = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (time.time() + lease_seconds, job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def ack(self, job_id: str, worker_id: str, result: dict[str, Any]) -> bool:
+        with self._lock:
+            cursor = self._connection.execute(
+                f"UPDATE {self.table} SET status = 'done', result = ?, error = NULL, lease_owner = NULL, lease_expires_at = NULL, finished_at = ? WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (json.dumps(result), time.time(), job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry_after: float = 0.0) -> Optional[JobStatus]:
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(f"SELECT attempts, max_attempts FROM {self.table} WHERE id = ? AND status = 'leased' AND lease_owner = ?", (job_id, worker_id)).fetchone()
+            if row is None:
+                return None
+            status: JobStatus = "dead" if row[0] >= row[1] else "pending"
+            connection.execute(
+                f"UPDATE {self.table} SET status = ?, error = ?, lease_owner = NULL, lease_expires_at = NULL, available_at = ?, finished_at = ? WHERE id = ?",
+                (status, error, now + retry_after, now if status == "dead" else None, job_id),
+            )
+        return status
+
+    def release(self, job_id: str, worker_id: str) -> bool:
+        with self._lock:
+            cursor = self._connection.execute(
+                f"UPDATE {self.table} SET status = 'pending', attempts = attempts - 1, lease_owner = NULL, lease_expires_at = NULL WHERE id = ? AND status = 'leased' AND lease_owner = ?",
+                (job_id, worker_id),
+            )
+        return cursor.rowcount == 1
+
+    def jobs(self, status: Optional[JobStatus] = None, limit: Optional[int] = None) -> list[Job]:
+        where, parameters = ("WHERE status = ?", [status]) if status else ("", [])
+        with self._lock:
+            rows = self._connection.execute(f"SELECT {', '.join(_COLUMNS)} FROM {self.table} {where} ORDER BY enqueued_at LIMIT ?", (*parameters, -1 if limit is None else limit)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def counts(self) -> dict[JobStatus, int]:
+        with self._lock:
+            rows = self._connection.execute(f"SELECT status, COUNT(*) FROM {self.table} GROUP BY status").fetchall()
+        return {"pending": 0, "leased": 0, "done": 0, "dead": 0, **dict(rows)}
+
+    def requeue_dead(self, job_ids: Optional[Iterable[str]] = None) -> int:
+        now = time.time()
+        with self._transaction() as connection:
+            if job_ids is None:
+                cursor = connection.execute(f"UPDATE {self.table} SET status = 'pending', attempts = 0, available_at = ?, finished_at = NULL WHERE status = 'dead'", (now,))
+                return cursor.rowcount
+            cursor = connection.executemany(
+                f"UPDATE {self.table} SET status = 'pending', attempts = 0, available_at = ?, finished_at = NULL WHERE id = ? AND status = 'dead'",
+                [(now, job_id) for job_id in job_ids],
+            )
+            return cursor.rowcount
+
+    def report(self, stats: WorkerStats) -> None:
+        with self._lock:
+            self._connection.execute(f"INSERT OR REPLACE INTO {self.table}_workers (worker_id, stats) VALUES (?, ?)", (stats.worker_id, stats.model_dump_json()))
+
+    def workers(self) -> list[WorkerStats]:
+        with self._lock:
+            rows = self._connection.execute(f"SELECT stats FROM {self.table}_workers ORDER BY worker_id").fetchall()
+        return [WorkerStats.model_validate_json(row[0]) for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+# Each script runs atomically on the Redis server. KEYS are the status sets, ARGV[1] the job hash key, ARGV[2] the job id, ARGV[3] the worker
+_OWNED = "if redis.call('HGET', ARGV[1], 'status') ~= 'leased' or redis.call('HGET', ARGV[1], 'lease_owner') ~= ARGV[3] then return '' end\n"
+
+_LEASE_SCRIPT = """
+-- KEYS: pending, leased, dead. ARGV: now, count, lease expiry, worker, job key prefix
+for _, id in ipairs(redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', '(' .. ARGV[1])) do
+    local job = ARGV[5] .. id
+    redis.call('ZREM', KEYS[2], id)
+    if tonumber(redis.call('HGET', job, 'attempts')) >= tonumber(redis.call('HGET', job, 'max_attempts')) then
+        redis.call('HSET', job, 'status', 'dead', 'error', 'lease expired', 'lease_owner', '', 'finished_at', ARGV[1])
+        redis.call('ZADD', KEYS[3], ARGV[1], id)
+    else
+        redis.call('ZADD', KEYS[1], ARGV[1], id)
+    end
+end
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, id in ipairs(ids) do
+    local job = ARGV[5] .. id
+    redis.call('ZREM', KEYS[1], id)
+    redis.call('ZADD', KEYS[2], ARGV[3], id)
+    redis.call('HINCRBY', job, 'attempts', 1)
+    redis.call('HSET', job, 'status', 'leased', 'lease_owner', ARGV[4], 'lease_expires_at', ARGV[3])
+end
+return ids
+"""
+
+_EXTEND_SCRIPT = (
+    _OWNED
+    + """
+-- KEYS: leased. ARGV[4]: lease expiry
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[2])
+redis.call('HSET', ARGV[1], 'lease_expires_at', ARGV[4])
+return 'leased'
+"""
+)
+
+_ACK_SCRIPT = (
+    _OWNED
+    + """
+-- KEYS: leased, done. ARGV[4]: now, ARGV[5]: result
+redis.call('ZREM', KEYS[1], ARGV[2])
+redis.call('HSET', ARGV[1], 'status', 'done', 'result', ARGV[5], 'error', '', 'lease_owner', '', 'lease_expires_at', '', 'finished_at', ARGV[4])
+redis.call('ZADD', KEYS[2], ARGV[4], ARGV[2])
+return 'done'
+"""
+)
+
+_FAIL_SCRIPT = (
+    _OWNED
+    + """
+-- KEYS: pending, leased, dead. ARGV[4]: now, ARGV[5]: error, ARGV[6]: available at
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('HSET', ARGV[1], 'error', ARGV[5], 'lease_owner', '', 'lease_expires_at', '')
+if tonumber(redis.call('HGET', ARGV[1], 'attempts')) >= tonumber(redis.call('HGET', ARGV[1], 'max_attempts')) then
+    redis.call('HSET', ARGV[1], 'status', 'dead', 'finished_at', ARGV[4])
+    redis.call('ZADD', KEYS[3], ARGV[4], ARGV[2])
+    return 'dead'
+end
+redis.call('HSET', ARGV[1], 'status', 'pending', 'available_at', ARGV[6])
+redis.call('ZADD', KEYS[1], ARGV[6], ARGV[2])
+return 'pending'
+"""
+)
+
+_RELEASE_SCRIPT = (
+    _OWNED
+    + """
+-- KEYS: pending, leased. ARGV[4]: now
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('HINCRBY', ARGV[1], 'attempts', -1)
+redis.call('HSET', ARGV[1], 'status', 'pending', 'lease_owner', '', 'lease_expires_at', '')
+redis.call('ZADD', KEYS[1], ARGV[4], ARGV[2])
+return 'pending'
+"""
+)
+
+_REQUEUE_SCRIPT = """
+-- KEYS: pending, dead. ARGV: job key, job id, now
+if redis.call('ZREM', KEYS[2], ARGV[2]) == 0 then return 0 end
+redis.call('HSET', ARGV[1], 'status', 'pending', 'attempts', 0, 'available_at', ARGV[3], 'finished_at', '')
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[2])
+return 1
+"""
+
+
+class RedisQueue(QueueBackend):
+    """A queue on a Redis server, shared by workers on every node.
+
+    Each job is a hash, and each status a sorted set of job ids: pending ones by the time they become available, leased ones by the expiry of their lease, done and dead ones by the time they finished. Every state change is one Lua script, so it is atomic across workers.
+
+    Args:
+        url (str): The server, e.g. `redis://host:6379/0`.
+        name (str): The key prefix, so one server can hold several queues.
+    """
+
+    def __init__(self, url: str, name: str = "jobs"):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError("The Redis work queue requires redis, install it with `pip install 'structured-ocr[redis]'`") from e
+
+        self.name = name
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+        self._keys = {status: f"{name}:{status}" for status in ("pending", "leased", "done", "dead")}
+        self._scripts = {
+            script: self._client.register_script(source)
+            for script, source in {"lease": _LEASE_SCRIPT, "extend": _EXTEND_SCRIPT, "ack": _ACK_SCRIPT, "fail": _FAIL_SCRIPT, "release": _RELEASE_SCRIPT, "requeue": _REQUEUE_SCRIPT}.items()
+        }
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.name}:job:{job_id}"
+
+    @staticmethod
+    def _job(fields: dict[str, str]) -> Job:
+        # Unset fields are stored as empty strings
+        values = {field: value for field, value in fields.items() if value != ""}
+        for column in _JSON_COLUMNS & values.keys():
+            values[column] = json.loads(values[column])
+        return Job(**values)
+
+    def put(self, jobs: list[Job]) -> None:
+        pipeline = self._client.pipeline()
+        for job in jobs:
+            fields = {column: json.dumps(value) if column in _JSON_COLUMNS else value for column, value in job.model_dump().items()}
+            pipeline.hset(self._job_key(job.id), mapping={column: "" if value is None else value for column, value in fields.items()})
+            pipeline.zadd(self._keys["pending"], {job.id: job.available_at})
+        pipeline.execute()
+
+    def lease(self, worker_id: str, count: int, lease_seconds: float) -> list[Job]:
+        now = time.time()
+        keys = [self._keys["pending"], self._keys["leased"], self._keys["dead"]]
+        ids = self._scripts["lease"](keys=keys, args=[now, count, now + lease_seconds, worker_id, f"{self.name}:job:"])
+        return self._load(ids)
+
+    def _load(self, job_ids: list[str]) -> list[Job]:
+        pipeline = self._client.pipeline()
+        for job_id in job_ids:
+            pipeline.hgetall(self._job_key(job_id))
+        return [self._job(fields) for fields in pipeline.execute() if fields]
+
+    def _call(self, script: str, statuses: list[str], job_id: str, worker_id: str, *args) -> Optional[str]:
+        return self._scripts[script](keys=[self._keys[status] for status in statuses], args=[self._job_key(job_id), job_id, worker_id, *args]) or None
+
+    def extend(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        return self._call("extend", ["leased"], job_id, worker_id, time.time() + lease_seconds) is not None
+
+    def ack(self, job_id: str, worker_id: str, result: dict[str, Any]) -> bool:
+        return self._call("ack", ["leased", "done"], job_id, worker_id, time.time(), json.dumps(result)) is not None
+
+    def fail(self, job_id: str, worker_id: str, error: str, retry_after: float = 0.0) -> Optional[JobStatus]:
+        now = time.time()
+        return self._call("fail", ["pending", "leased", "dead"], job_id, worker_id, now, error, now + retry_after)
+
+    def release(self, job_id: str, worker_id: str) -> bool:
+        return self._call("release", ["pending", "leased"], job_id, worker_id, time.time()) is not None
+
+    def jobs(self, status: Optional[JobStatus] = None, limit: Optional[int] = None) -> list[Job]:
+        statuses = [status] if status else list(self._keys)
+        job_ids = [job_id for status in statuses for job_id in self._client.zrange(self._keys[status], 0, -1)]
+        jobs = sorted(self._load(job_ids), key=lambda job: job.enqueued_at)
+        return jobs[:limit] if limit is not None else jobs
+
+    def counts(self) -> dict[JobStatus, int]:
+        pipeline = self._client.pipeline()
+        for key in self._keys.values():
+            pipeline.zcard(key)
+        return dict(zip(self._keys, pipeline.execute()))
+
+    def requeue_dead(self, job_ids: Optional[Iterable[str]] = None) -> int:
+        now = time.time()
+        job_ids = self._client.zrange(self._keys["dead"], 0, -1) if job_ids is None else job_ids
+        keys = [self._keys["pending"], self._keys["dead"]]
+        return sum(self._scripts["requeue"](keys=keys, args=[self._job_key(job_id), job_id, now]) for job_id in job_ids)
+
+    def report(self, stats: WorkerStats) -> None:
+        self._client.hset(f"{self.name}:workers", stats.worker_id, stats.model_dump_json())
+
+    def workers(self) -> list[WorkerStats]:
+        return [WorkerStats.model_validate_json(stats) for _, stats in sorted(self._client.hgetall(f"{self.name}:workers").items())]
+
+    def close(self) -> None:
+        self._client.close()
+
+
+def _sqlite_queue(url: str, name: str) -> SQLiteQueue:
+    return SQLiteQueue(url.removeprefix("sqlite://"), name)
+
+
+# Queue factories per URL scheme, each taking the URL and the queue name
+QUEUE_BACKENDS: dict[str, Callable[[str, str], QueueBackend]] = {
+    "sqlite": _sqlite_queue,
+    "redis": RedisQueue,
+    "rediss": RedisQueue,
+}
+
+
+def register_queue_backend(scheme: str, factory: Callable[[str, str], QueueBackend]) -> None:
+    """Open queue URLs of `scheme` with `factory`."""
+    QUEUE_BACKENDS[scheme] = factory
+
+
+def open_queue(url: str, name: str = "jobs") -> QueueBackend:
+    """Open the queue at `url`: a `redis://` server, a `sqlite:///` file, or a plain path to a SQLite file.
+
+    Raises:
+        ValueError: When no backend is registered for the URL scheme.
+    """
+    scheme = url.split("://", 1)[0] if "://" in url else "sqlite"
+    if scheme not in QUEUE_BACKENDS:
+        raise ValueError(f"Unknown queue backend {scheme!r}, expected one of {sorted(QUEUE_BACKENDS)}")
+    return QUEUE_BACKENDS[scheme](url, name)
+
+
+class WorkerSettings(BaseModel):
+    worker_id: Optional[str] = Field(default=None, description="The name the worker leases and reports under, `<host>:<pid>` by default")
+    concurrency: int = Field(default=8, description="The jobs in flight at once", ge=1)
+    lease_seconds: float = Field(default=300, description="How long a job stays leased without a heartbeat, past which another worker takes it over", gt=0)
+    poll_seconds: float = Field(default=1.0, description="How long to wait before leasing again when the queue had nothing available", gt=0)
+    retry_base_seconds: float = Field(default=5.0, description="The backoff before the first retry of a failed job, doubled per attempt", ge=0)
+    retry_max_seconds: float = Field(default=300.0, description="The longest backoff between retries", ge=0)
+    report_seconds: float = Field(default=10.0, description="How often the worker publishes its stats", gt=0)
+    max_jobs: Optional[int] = Field(default=None, description="Stop after leasing this many jobs, None to run until stopped")
+    drain: bool = Field(default=False, description="Stop once no job is pending or running, rather than waiting for more")
+
+
+@asynccontextmanager
+async def _local_file(image_path: str) -> AsyncIterator[str]:
+    """The image of a job as a local file, an http(s) URI downloaded to a temporary one."""
+    if image_path.startswith("file://"):
+        yield unquote(urlparse(image_path).path)
+        return
+    if not image_path.startswith(("http://", "https://")):
+        yield image_path
+        return
+
+    import httpx
+
+    async with httpx.AsyncClient(follow_redirects=True, timeout=60) as client:
+        response = await client.get(image_path)
+        response.raise_for_status()
+    with tempfile.TemporaryDirectory() as directory:
+        # The suffix tells the graph a PDF or TIFF from an image
+        local_path = os.path.join(directory, f"image{Path(urlparse(image_path).path).suffix}")
+        await asyncio.to_thread(Path(local_path).write_bytes, response.content)
+        yield local_path
+
+
+async def _heartbeat(queue: QueueBackend, job: Job, settings: WorkerSettings, worker_id: str) -> None:
+    """Extend the lease of a running job until cancelled."""
+    while True:
+        await asyncio.sleep(settings.lease_seconds / 3)
+        try:
+            extended = await asyncio.to_thread(queue.extend, job.id, worker_id, settings.lease_seconds)
+        except Exception as e:
+            # Retried on the next beat, two more fit in before the lease runs out
+            log(f"⚠️ Could not extend the lease of job {job.id} ({e!r}): {job.image_path}", "warning")
+            continue
+        if not extended:
+            log(f"⏳ Lost the lease of job {job.id}: {job.image_path}", "warning")
+            return
+
+
+async def _record_failure(queue: QueueBackend, job: Job, settings: WorkerSettings, stats: WorkerStats, error: Exception) -> None:
+    stats.failed += 1
+    retry_after = min(settings.retry_max_seconds, settings.retry_base_seconds * 2 ** (job.attempts - 1))
+    status = await asyncio.to_thread(queue.fail, job.id, stats.worker_id, repr(error), retry_after)
+    if status == "dead":
+        stats.dead_lettered += 1
+        log(f"💀 Job {job.id} failed {job.attempts} times, dead-lettered ({error!r}): {job.image_path}", "warning")
+    elif status == "pending":
+        stats.retried += 1
+        log(f"🔁 Job {job.id} failed attempt {job.attempts} ({error!r}), retrying in {retry_after:.1f}s: {job.image_path}", "warning")
+    else:
+        stats.lost_leases += 1
+
+
+async def _run_job(queue: QueueBackend, job: Job, settings: WorkerSettings, stats: WorkerStats) -> None:
+    """Extract one leased job, then acknowledge it or record the failure.
+
+    An error of the queue itself, e.g. SQLite's "database is locked", is logged rather than raised, so it does not stop the worker. The job stays leased until its lease runs out, and is then taken over like the job of a crashed worker.
+    """
+    heartbeat = asyncio.create_task(_heartbeat(queue, job, settings, stats.worker_id))
+    start = time.monotonic()
+    try:
+        try:
+            async with _local_file(job.image_path) as image_path:
+                result = await arun_graph(image_path, config={"configurable": job.config})
+        except Exception as e:
+            await _record_failure(queue, job, settings, stats, e)
+            return
+        if await asyncio.to_thread(queue.ack, job.id, stats.worker_id, result):
+            stats.succeeded += 1
+        else:
+            stats.lost_leases += 1
+            log(f"⏳ Job {job.id} finished after its lease was taken over, result dropped: {job.image_path}", "warning")
+    except Exception as e:
+        stats.queue_errors += 1
+        log(f"⚠️ Could not store the outcome of job {job.id}, it is retried once its lease runs out ({e!r}): {job.image_path}", "error")
+    finally:
+        heartbeat.cancel()
+        stats.busy_seconds += time.monotonic() - start
+
+
+def _queue_error(stats: WorkerStats, action: str, error: Exception) -> None:
+    """Log and count an error of the queue itself, which the worker outlives."""
+    stats.queue_errors += 1
+    log(f"⚠️ Worker {stats.worker_id} could not {action} ({error!r})", "error")
+
+
+async def _idle(stop: asyncio.Event, seconds: float) -> None:
+    """Wait `seconds`, or until the worker is stopped."""
+    with suppress(asyncio.TimeoutError):
+        await asyncio.wait_for(stop.wait(), seconds)
+
+
+async def _is_drained(queue: QueueBackend, stats: WorkerStats) -> bool:
+    """Whether the queue is drained, False when it could not be asked."""
+    try:
+        return await asyncio.to_thread(queue.is_drained)
+    except Exception as e:
+        _queue_error(stats, "check whether the queue is drained", e)
+        return False
+
+
+async def arun_worker(queue: QueueBackend | str, settings: Optional[WorkerSettings] = None, name: str = "jobs") -> WorkerStats:
+    """Lease and extract jobs until stopped, or until `max_jobs` or `drain` says so.
+
+    SIGTERM stops leasing and lets the jobs in flight finish. Cancelling the worker, e.g. with Ctrl-C, releases the jobs in flight to other workers without using up an attempt.
+
+    Errors of the queue itself, e.g. SQLite's "database is locked", are logged and counted in `queue_errors`, and the worker polls again rather than stopping.
+
+    Args:
+        queue (QueueBackend | str): The queue, or its URL, see `open_queue`.
+        settings (Optional[WorkerSettings]): The concurrency, lease, retry and stop settings.
+        name (str): The queue name, when `queue` is a URL.
+
+    Returns:
+        WorkerStats: The stats of the worker, as last published.
+    """
+    settings = settings or WorkerSettings()
+    queue = open_queue(queue, name) if isinstance(queue, str) else queue
+    now = time.time()
+    stats = WorkerStats(worker_id=settings.worker_id or f"{socket.gethostname()}:{os.getpid()}", started_at=now, updated_at=now)
+    stop = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, RuntimeError, ValueError):
+        pass  # Not on the main thread, or not supported by the platform
+
+    in_flight: dict[asyncio.Task, Job] = {}
+    reported = time.monotonic()
+    log(f"👷 Worker {stats.worker_id} started")
+    try:
+        while True:
+            room = settings.concurrency - len(in_flight)
+            if settings.max_jobs is not None:
+                room = min(room, settings.max_jobs - stats.leased)
+            if room > 0 and not stop.is_set():
+                try:
+                    jobs = await asyncio.to_thread(queue.lease, stats.worker_id, room, settings.lease_seconds)
+                except Exception as e:
+                    _queue_error(stats, "lease jobs", e)
+                    jobs = []
+                    if not in_flight:
+                        await _idle(stop, settings.poll_seconds)
+                        continue
+                stats.leased += len(jobs)
+                for job in jobs:
+                    in_flight[asyncio.create_task(_run_job(queue, job, settings, stats))] = job
+
+            if in_flight:
+                done, _ = await asyncio.wait(in_flight, timeout=settings.poll_seconds, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    del in_flight[task]
+                    task.result()
+            elif stop.is_set() or (settings.max_jobs is not None and stats.leased >= settings.max_jobs) or (settings.drain and await _is_drained(queue, stats)):
+                break
+            else:
+                await _idle(stop, settings.poll_seconds)
+
+            if time.monotonic() - reported >= settings.report_seconds:
+                stats.updated_at = time.time()
+                try:
+                    await asyncio.to_thread(queue.report, stats)
+                except Exception as e:
+                    _queue_error(stats, "report the stats", e)
+                reported = time.monotonic()
+    finally:
+        released = [job for task, job in in_flight.items() if not task.done()]
+        for task in in_flight:
+            task.cancel()
+        await asyncio.gather(*in_flight, return_exceptions=True)
+        for job in released:
+            try:
+                await asyncio.to_thread(queue.release, job.id, stats.worker_id)
+            except Exception as e:
+                _queue_error(stats, f"release job {job.id}", e)
+        stats.updated_at = time.time()
+        try:
+            await asyncio.to_thread(queue.report, stats)
+        except Exception as e:
+            _queue_error(stats, "report the stats", e)
+        log(f"👷 Worker {stats.worker_id} stopped: {stats.succeeded} done, {stats.retried} retried, {stats.dead_lettered} dead-lettered")
+    return stats
+
+
+def run_worker(queue: QueueBackend | str, settings: Optional[WorkerSettings] = None, name: str = "jobs") -> WorkerStats:
+    """Run `arun_worker` on its own event loop, e.g. as the target of a worker process."""
+    return asyncio.run(arun_worker(queue, settings, name))
+
+
+def _work(url: str, settings: WorkerSettings, name: str) -> None:
+    """The target of a worker process of the CLI. On Ctrl-C, each process releases its jobs and exits quietly."""
+    with suppress(KeyboardInterrupt):
+        run_worker(url, settings, name)
+
+
+def queue_stats(queue: QueueBackend) -> QueueStats:
+    """The job counts of the queue and the stats of every worker that reported to it."""
+    return QueueStats(counts=queue.counts(), workers=queue.workers())
+
+
+def stats_table(stats: QueueStats) -> Table:
+    from rich.table import Table
+
+    table = Table(title=f"Queue: {', '.join(f'{count} {status}' for status, count in stats.counts.items())}")
+    for column in ("worker", "succeeded", "failed", "retried", "dead-lettered", "lost leases", "queue errors", "docs/sec", "busy s", "last report"):
+        table.add_column(column, justify="left" if column == "worker" else "right")
+    for worker in stats.workers:
+        table.add_row(
+            worker.worker_id,
+            str(worker.succeeded),
+            str(worker.failed),
+            str(worker.retried),
+            str(worker.dead_lettered),
+            str(worker.lost_leases),
+            str(worker.queue_errors),
+            f"{worker.docs_per_second:.2f}",
+            f"{worker.busy_seconds:.1f}",
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(worker.updated_at)),
+        )
+    return table
+
+
+def main() -> None:
+    from multiprocessing import get_context
+
+    from rich import print
+
+    from .stream import iter_image_paths
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue = commands.add_parser("enqueue", help="Add a job per image")
+    enqueue.add_argument("source", help="A directory, glob pattern or manifest of images, see `iter_image_paths`")
+    enqueue.add_argument("--config", default="{}", help="Configuration of every run as JSON, e.g. '{\"use_ocr\": true}'")
+    enqueue.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS, help="Runs of a job before it is dead-lettered")
+    work = commands.add_parser("work", help="Run worker processes")
+    work.add_argument("--processes", type=int, default=1, help="Worker processes on this node")
+    work.add_argument("--concurrency", type=int, default=8, help="Jobs in flight per process")
+    work.add_argument("--lease-seconds", type=float, default=300, help="How long a job stays leased without a heartbeat")
+    work.add_argument("--max-jobs", type=int, help="Stop each process after this many jobs")
+    work.add_argument("--drain", action="store_true", help="Stop once no job is pending or running")
+    commands.add_parser("stats", help="Show the job counts and the throughput of every worker")
+    dead = commands.add_parser("dead", help="List the dead-lettered jobs")
+    dead.add_argument("--requeue", action="store_true", help="Move them back to pending with their attempts reset")
+    results = commands.add_parser("results", help="Write the results of the finished jobs as JSONL")
+    results.add_argument("--output", help="The JSONL file, stdout by default")
+    for command in commands.choices.values():
+        command.add_argument("--queue", required=True, help="A SQLite file, sqlite:///path or redis://host:port/db")
+        command.add_argument("--name", default="jobs", help="The queue name within the backend")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        settings = WorkerSettings(concurrency=args.concurrency, lease_seconds=args.lease_seconds, max_jobs=args.max_jobs, drain=args.drain)
+        # Spawned rather than forked, so no process inherits the clients and locks of another
+        processes = [get_context("spawn").Process(target=_work, args=(args.queue, settings, args.name)) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # The processes got the interrupt too, and are releasing their jobs
+            for process in processes:
+                process.join()
+        return
+
+    queue = open_queue(args.queue, args.name)
+    try:
+        if args.command == "enqueue":
+            job_ids = queue.enqueue(iter_image_paths(args.source), json.loads(args.config), args.max_attempts)
+            print(f"Enqueued {len(job_ids)} jobs")
+        elif args.command == "stats":
+            print(stats_table(queue_stats(queue)))
+        elif args.command == "dead":
+            for job in queue.jobs("dead"):
+                print(f"{job.id} {job.image_path} after {job.attempts} attempts: {job.error}")
+            if args.requeue:
+                print(f"Requeued {queue.requeue_dead()} jobs")
+        elif args.command == "results":
+            lines = [json.dumps({"id": job.id, "image_path": job.image_path, "result": job.result}, ensure_ascii=False) for job in queue.jobs("done")]
+            if args.output:
+                Path(args.output).write_text("".join(f"{line}\n" for line in lines), encoding="utf-8")
+                print(f"Wrote {len(lines)} results to {args.output}")
+            else:
+                sys.stdout.writelines(f"{line}\n" for line in lines)
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,20 @@
-from .ocr import run_ocr
+from .backends import OCR_BACKENDS, OCRBackend, get_ocr_backend, register_ocr_backend
+from .layout import detect_highlight, layout_rows, ocr_quality, page_tokens, serialize_layout
+from .ocr import DocumentAIBackend, arun_ocr, run_ocr
+from .tesseract import TesseractBackend
 
 __all__ = [
     "run_ocr",
+    "arun_ocr",
+    "OCRBackend",
+    "DocumentAIBackend",
+    "TesseractBackend",
+    "OCR_BACKENDS",
+    "register_ocr_backend",
+    "get_ocr_backend",
+    "serialize_layout",
+    "layout_rows",
+    "page_tokens",
+    "detect_highlight",
+    "ocr_quality",
 ]
@@ -0,0 +1,64 @@
+"""Pluggable OCR engines behind `run_ocr`.
+
+Every backend returns a `documentai.Document`, with the text and the pages, blocks, lines and tokens anchored into it with their boxes, so the layout serializer, the page splitter and the stage cache work the same whichever engine produced it.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Callable, Optional
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+
+class OCRBackend(ABC):
+    """An OCR engine turning an image, PDF or TIFF into a `documentai.Document`."""
+
+    # Pages one call can take, longer documents are OCRed page by page, None for no limit
+    max_pages: Optional[int] = None
+
+    @abstractmethod
+    def process(self, content: bytes, mime_type: str) -> documentai.Document:
+        """OCR the document.
+
+        Args:
+            content (bytes): The raw image, PDF or TIFF.
+            mime_type (str): The MIME type of `content`.
+
+        Returns:
+            documentai.Document: The text, and the pages with their blocks, lines and tokens.
+        """
+
+    async def aprocess(self, content: bytes, mime_type: str) -> documentai.Document:
+        """Async version of `process`, run in a thread unless the backend has a native async client."""
+        return await asyncio.to_thread(self.process, content, mime_type)
+
+
+OCR_BACKENDS: dict[str, Callable[[], OCRBackend]] = {}
+_instances: dict[str, OCRBackend] = {}
+_instances_lock = threading.Lock()
+
+
+def register_ocr_backend(name: str, backend: Callable[[], OCRBackend]) -> None:
+    """Make `backend`, a backend class or factory, selectable with `Configuration.ocr_backend`, it is created without arguments on first use."""
+    with _instances_lock:
+        OCR_BACKENDS[name] = backend
+        _instances.pop(name, None)
+
+
+def get_ocr_backend(name: str) -> OCRBackend:
+    """Get the process-wide instance of the backend registered under `name`.
+
+    Raises:
+        ValueError: When no backend is registered under `name`.
+    """
+    with _instances_lock:
+        backend = _instances.get(name)
+        if backend is None:
+            if name not in OCR_BACKENDS:
+                raise ValueError(f"Unknown OCR backend {name!r}, expected one of {sorted(OCR_BACKENDS)}")
+            backend = _instances[name] = OCR_BACKENDS[name]()
+        return backend
@@ -0,0 +1,201 @@
+"""Serialize Document AI tokens into a compact row/column table, with highlight colours read locally from the pixels.
+
+A scoreboard is a grid, so sending the tokens as rows of column-indexed cells keeps the layout the plain OCR text loses, at a fraction of the tokens of an image:
+
+    Layout rows, top to bottom, as `y% | column:text ...`, a `{colour}` suffix marks a highlighted cell
+    8 | 0:Heroes 4:Villains
+    15 | 0:me{yellow} 1:1000 2:12 ...
+"""
+
+from __future__ import annotations
+
+import statistics
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+from PIL import Image
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+# Tokens whose vertical centres are within this share of the token height are on the same row
+ROW_TOLERANCE = 0.5
+# Tokens closer than this share of the token height belong to the same cell
+CELL_GAP = 1.0
+# Cell centres further apart than this share of the token height start a new column
+COLUMN_GAP = 1.5
+# Hue ranges on PIL's 0-255 scale, and the share of a cell's pixels that must carry the colour
+HIGHLIGHT_HUES = {"yellow": (28, 50), "green": (50, 120)}
+HIGHLIGHT_SHARE = 0.4
+# Minimum saturation and value of a highlight colour, and the maximum saturation and minimum value of white
+MIN_SATURATION = 100
+MIN_VALUE = 100
+WHITE_SATURATION = 40
+WHITE_VALUE = 220
+
+
+class LayoutCell(BaseModel):
+    """Text and its box in page pixels."""
+
+    text: str
+    x0: float
+    y0: float
+    x1: float
+    y1: float
+    column: int = 0
+    highlight: Optional[str] = None
+
+    @property
+    def height(self) -> float:
+        return self.y1 - self.y0
+
+    @property
+    def x_center(self) -> float:
+        return (self.x0 + self.x1) / 2
+
+    @property
+    def y_center(self) -> float:
+        return (self.y0 + self.y1) / 2
+
+    def merge(self, other: "LayoutCell") -> "LayoutCell":
+        return LayoutCell(text=f"{self.text} {other.text}", x0=min(self.x0, other.x0), y0=min(self.y0, other.y0), x1=max(self.x1, other.x1), y1=max(self.y1, other.y1))
+
+
+def _anchor_text(document: documentai.Document, layout: documentai.Document.Page.Layout) -> str:
+    return "".join(document.text[segment.start_index : segment.end_index] for segment in layout.text_anchor.text_segments).strip()
+
+
+def _page_size(document_page: documentai.Document.Page) -> tuple[float, float]:
+    # Normalized vertices are scaled back to pixels so both axes share a unit, on a nominal 1000px page when the size is unknown
+    return document_page.dimension.width or 1000.0, document_page.dimension.height or 1000.0
+
+
+def page_tokens(document: documentai.Document, page: int = 0) -> list[LayoutCell]:
+    """Read the tokens of a page with their boxes in page pixels.
+
+    Args:
+        document (documentai.Document): The OCR result.
+        page (int): The zero-based page index.
+
+    Returns:
+        list[LayoutCell]: One cell per non-empty token.
+    """
+    document_page = document.pages[page]
+    width, height = _page_size(document_page)
+
+    tokens = []
+    for token in document_page.tokens:
+        text = _anchor_text(document, token.layout)
+        poly = token.layout.bounding_poly
+        if poly.normalized_vertices:
+            points = [(vertex.x * width, vertex.y * height) for vertex in poly.normalized_vertices]
+        else:
+            points = [(vertex.x, vertex.y) for vertex in poly.vertices]
+        if not text or not points:
+            continue
+        xs, ys = zip(*points)
+        tokens.append(LayoutCell(text=text, x0=min(xs), y0=min(ys), x1=max(xs), y1=max(ys)))
+    return tokens
+
+
+def layout_rows(tokens: list[LayoutCell]) -> list[list[LayoutCell]]:
+    """Group tokens into rows by their vertical centre, merge neighbouring tokens into cells, and index the cells by column.
+
+    Args:
+        tokens (list[LayoutCell]): The page tokens.
+
+    Returns:
+        list[list[LayoutCell]]: The rows top to bottom, each with its cells left to right.
+    """
+    if not tokens:
+        return []
+    token_height = statistics.median(token.height for token in tokens) or 1.0
+
+    rows: list[list[LayoutCell]] = []
+    for token in sorted(tokens, key=lambda token: token.y_center):
+        if rows and abs(token.y_center - statistics.fmean(cell.y_center for cell in rows[-1])) <= ROW_TOLERANCE * token_height:
+            rows[-1].append(token)
+        else:
+            rows.append([token])
+
+    cells_by_row = []
+    for row in rows:
+        cells: list[LayoutCell] = []
+        for token in sorted(row, key=lambda token: token.x0):
+            if cells and token.x0 - cells[-1].x1 < CELL_GAP * token_height:
+                cells[-1] = cells[-1].merge(token)
+            else:
+                cells.append(token)
+        cells_by_row.append(cells)
+
+    # Columns are runs of cell centres without a wide gap, shared by every row
+    centers = sorted(cell.x_center for cells in cells_by_row for cell in cells)
+    boundaries = [right for left, right in zip(centers, centers[1:]) if right - left > COLUMN_GAP * token_height]
+    for cells in cells_by_row:
+        for cell in cells:
+            cell.column = sum(cell.x_center >= boundary for boundary in boundaries)
+    return cells_by_row
+
+
+def detect_highlight(hsv: np.ndarray, cell: LayoutCell) -> Optional[str]:
+    """Classify the background of a cell as yellow, green or white from its pixels.
+
+    Args:
+        hsv (np.ndarray): The page in HSV, as from `Image.convert("HSV")`.
+        cell (LayoutCell): The cell, in the pixels of the same page.
+
+    Returns:
+        Optional[str]: The highlight colour, or None when the cell is not highlighted.
+    """
+    pad = cell.height / 4
+    top, bottom = max(0, int(cell.y0 - pad)), min(hsv.shape[0], int(cell.y1 + pad) + 1)
+    left, right = max(0, int(cell.x0 - pad)), min(hsv.shape[1], int(cell.x1 + pad) + 1)
+    region = hsv[top:bottom, left:right].reshape(-1, 3)
+    if not len(region):
+        return None
+
+    hue, saturation, value = region[:, 0], region[:, 1], region[:, 2]
+    colourful = (saturation >= MIN_SATURATION) & (value >= MIN_VALUE)
+    for colour, (low, high) in HIGHLIGHT_HUES.items():
+        if np.mean(colourful & (hue >= low) & (hue < high)) >= HIGHLIGHT_SHARE:
+            return colour
+    if np.mean((saturation < WHITE_SATURATION) & (value >= WHITE_VALUE)) >= HIGHLIGHT_SHARE:
+        return "white"
+    return None
+
+
+def serialize_layout(document: documentai.Document, page: int = 0, image: Optional[Image.Image] = None) -> str:
+    """Serialize a page of the OCR result as a compact row/column table.
+
+    Args:
+        document (documentai.Document): The OCR result.
+        page (int): The zero-based page index.
+        image (Optional[Image.Image]): The image the OCR ran on, to mark highlighted cells, None to leave them out.
+
+    Returns:
+        str: One line per row with the vertical position in percent of the page and the column-indexed cells.
+    """
+    rows = layout_rows(page_tokens(document, page))
+
+    if image is not None:
+        hsv = np.asarray(image.convert("RGB").convert("HSV"))
+        # Map page pixels onto the image, in case the OCR saw it at another resolution
+        width, height = _page_size(document.pages[page])
+        scale_x, scale_y = image.width / width, image.height / height
+        for cells in rows:
+            for cell in cells:
+                scaled = LayoutCell(text=cell.text, x0=cell.x0 * scale_x, y0=cell.y0 * scale_y, x1=cell.x1 * scale_x, y1=cell.y1 * scale_y)
+                cell.highlight = detect_highlight(hsv, scaled)
+
+    _, page_height = _page_size(document.pages[page])
+    lines = ["Layout rows, top to bottom, as `y% | column:text ...`, a `{colour}` suffix marks a highlighted cell"]
+    for cells in rows:
+        y = round(statistics.fmean(cell.y_center for cell in cells) / page_height * 100)
+        lines.append(f"{y} | " + " ".join(f"{cell.column}:{cell.text}" + (f"{{{cell.highlight}}}" if cell.highlight else "") for cell in cells))
+    return "\n".join(lines)
+
+
+def ocr_quality(document: documentai.Document, page: int = 0) -> float:
+    """The Document AI image quality score of a page, 0 when it was not computed."""
+    return document.pages[page].image_quality_scores.quality_score if page < len(document.pages) else 0.0
@@ -1,28 +1,95 @@
-import os
-from typing import Optional
+from __future__ import annotations
 
-from google.api_core.client_options import ClientOptions
-from google.cloud import documentai
+from typing import TYPE_CHECKING, Optional
 
+from ..clients import get_documentai_client, processor_name
+from ..env import getenv
+from ..ratelimit import acall_limited, call_limited
+from ..telemetry import annotate
+from ..utils import ImagePayload, sniff_mime_type
+from .backends import OCRBackend, get_ocr_backend, register_ocr_backend
 
-def run_ocr(content: bytes) -> documentai.Document:
-    """Run OCR on a document using Google Document AI with optional preprocess.
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+# Rate limiter route of Document AI calls
+OCR_ROUTE = "documentai"
+# Document AI processes at most this many pages in one online request
+ONLINE_PAGE_LIMIT = 15
+
+
+class DocumentAIBackend(OCRBackend):
+    """Google Document AI online processing, within the shared rate limits of `OCR_ROUTE`."""
+
+    max_pages = ONLINE_PAGE_LIMIT
+
+    def process(self, content: bytes, mime_type: str) -> documentai.Document:
+        request = {"content": content, "mime_type": mime_type, "process_options": _process_options(), **_processor_settings()}
+        return call_limited(OCR_ROUTE, lambda: _process_document(**request))
+
+    async def aprocess(self, content: bytes, mime_type: str) -> documentai.Document:
+        request = {"content": content, "mime_type": mime_type, "process_options": _process_options(), **_processor_settings()}
+        return await acall_limited(OCR_ROUTE, lambda: _aprocess_document(**request))
+
+
+register_ocr_backend("documentai", DocumentAIBackend)
+
+
+def run_ocr(content: bytes | ImagePayload, backend: str = "documentai") -> documentai.Document:
+    """Run OCR on a document with the selected backend, Google Document AI by default.
 
     Args:
-        content (bytes): Content of the document
+        content (bytes | ImagePayload): Content of the document, raw bytes of an image, PDF or TIFF, or an encoded payload carrying its MIME type
+        backend (str): The OCR backend, a name in `OCR_BACKENDS`
 
     Returns:
         documentai.Document: The processed document with OCR results
     """
-    project_id = os.getenv("PROJECT_ID")
-    location = os.getenv("LOCATION")  # Format is "us" or "eu"
-    processor_id = os.getenv("OCR_PROCESSOR_ID")  # Create processor before running sample
-    processor_version = os.getenv("OCR_PROCESSOR_VERSION")  # Refer to https://cloud.google.com/document-ai/docs/manage-processor-versions for more information
-    mime_type = "image/png"
+    document = get_ocr_backend(backend).process(**_raw_document(content))
+    annotate(pages=len(document.pages))
+
+    return document
+
+
+async def arun_ocr(content: bytes | ImagePayload, backend: str = "documentai") -> documentai.Document:
+    """Async version of `run_ocr`.
+
+    Args:
+        content (bytes | ImagePayload): Content of the document, raw bytes of an image, PDF or TIFF, or an encoded payload carrying its MIME type
+        backend (str): The OCR backend, a name in `OCR_BACKENDS`
+
+    Returns:
+        documentai.Document: The processed document with OCR results
+    """
+    document = await get_ocr_backend(backend).aprocess(**_raw_document(content))
+    annotate(pages=len(document.pages))
+
+    return document
+
+
+def _raw_document(content: bytes | ImagePayload) -> dict[str, bytes | str]:
+    """Resolve the content and MIME type to send."""
+    if isinstance(content, ImagePayload):
+        return {"content": content.data, "mime_type": content.mime_type}
+    return {"content": content, "mime_type": sniff_mime_type(content) or "image/png"}
+
+
+def _processor_settings() -> dict[str, str]:
+    """Read the Document AI processor settings from the environment."""
+    return {
+        "project_id": getenv("PROJECT_ID"),
+        "location": getenv("LOCATION"),  # Format is "us" or "eu"
+        "processor_id": getenv("OCR_PROCESSOR_ID"),  # Create processor before running sample
+        "processor_version": getenv("OCR_PROCESSOR_VERSION"),  # Refer to https://cloud.google.com/document-ai/docs/manage-processor-versions for more information
+    }
+
+
+def _process_options() -> documentai.ProcessOptions:
+    """Additional configurations for Document OCR Processor."""
+    from google.cloud import documentai
 
-    # Optional: Additional configurations for Document OCR Processor.
     # For more information: https://cloud.google.com/document-ai/docs/enterprise-document-ocr
-    process_options = documentai.ProcessOptions(
+    return documentai.ProcessOptions(
         ocr_config=documentai.OcrConfig(
             enable_native_pdf_parsing=True,
             enable_image_quality_scores=True,
@@ -36,19 +103,6 @@ def run_ocr(content: bytes) -> documentai.Document:
         )
     )
 
-    # Online processing request to Document AI
-    document = _process_document(
-        project_id=project_id,
-        location=location,
-        processor_id=processor_id,
-        processor_version=processor_version,
-        content=content,
-        mime_type=mime_type,
-        process_options=process_options,
-    )
-
-    return document
-
 
 def _process_document(
     project_id: str,
@@ -73,17 +127,13 @@ def _process_document(
     Returns:
         documentai.Document: The processed document
     """
-    # You must set the `api_endpoint` if you use a location other than "us".
-    client = documentai.DocumentProcessorServiceClient(
-        client_options=ClientOptions(
-            api_endpoint=f"{location}-documentai.googleapis.com",
-        )
-    )
+    # Shared client, the gRPC channel is kept alive across pages
+    from google.cloud import documentai
+
+    client = get_documentai_client(location)
 
-    # The full resource name of the processor version, e.g.:
-    # `projects/{project_id}/locations/{location}/processors/{processor_id}/processorVersions/{processor_version_id}`
     # You must create a processor before running.
-    name = client.processor_version_path(project_id, location, processor_id, processor_version)
+    name = processor_name(project_id, location, processor_id, processor_version)
 
     request = documentai.ProcessRequest(
         name=name,
@@ -94,3 +144,30 @@ def _process_document(
     result = client.process_document(request=request)
 
     return result.document
+
+
+async def _aprocess_document(
+    project_id: str,
+    location: str,
+    processor_id: str,
+    processor_version: str,
+    content: bytes,
+    mime_type: str,
+    process_options: Optional[documentai.ProcessOptions] = None,
+) -> documentai.Document:
+    """Async version of `_process_document`."""
+    from google.cloud import documentai
+
+    client = get_documentai_client(location, asynchronous=True)
+
+    name = processor_name(project_id, location, processor_id, processor_version)
+
+    request = documentai.ProcessRequest(
+        name=name,
+        raw_document=documentai.RawDocument(content=content, mime_type=mime_type),
+        process_options=process_options,
+    )
+
+    result = await client.process_document(request=request)
+
+    return result.document
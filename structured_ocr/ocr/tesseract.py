@@ -0,0 +1,172 @@
+"""Local CPU OCR with Tesseract, without network round trips or quota.
+
+Needs the `tesseract` binary and `pytesseract` (`pip install 'structured-ocr[tesseract]'`). PDF pages are rendered by the calling thread under `PDFIUM_LOCK`, and each page is OCRed by a Tesseract subprocess, bounded to one per CPU by a shared pool. A page is rendered only once a pool slot is about to free up, so a long document holds about one rendered page per worker.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import statistics
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import groupby
+from typing import TYPE_CHECKING, Optional
+
+from PIL import Image
+
+from ..env import getenv
+from ..utils import iter_pages
+from .backends import OCRBackend, register_ocr_backend
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+# Sparse text, a scoreboard is a grid of short cells rather than paragraphs
+DEFAULT_TESSERACT_CONFIG = "--psm 11"
+
+
+def _pytesseract():
+    try:
+        import pytesseract
+    except ImportError as e:
+        raise ImportError("The tesseract OCR backend requires pytesseract and the tesseract binary, install it with `pip install 'structured-ocr[tesseract]'`") from e
+    return pytesseract
+
+
+def _layout(start: int, end: int, box: tuple[int, int, int, int], size: tuple[int, int], confidence: float = 1.0) -> documentai.Document.Page.Layout:
+    """A layout anchored to `text[start:end]` with its box normalized to the page."""
+    from google.cloud import documentai
+
+    left, top, right, bottom = box
+    width, height = size
+    corners = [(left, top), (right, top), (right, bottom), (left, bottom)]
+    return documentai.Document.Page.Layout(
+        text_anchor=documentai.Document.TextAnchor(text_segments=[documentai.Document.TextAnchor.TextSegment(start_index=start, end_index=end)]),
+        bounding_poly=documentai.BoundingPoly(
+            vertices=[documentai.Vertex(x=x, y=y) for x, y in corners],
+            normalized_vertices=[documentai.NormalizedVertex(x=x / width, y=y / height) for x, y in corners],
+        ),
+        confidence=confidence,
+    )
+
+
+def _union(boxes: list[tuple[int, int, int, int]]) -> tuple[int, int, int, int]:
+    lefts, tops, rights, bottoms = zip(*boxes)
+    return min(lefts), min(tops), max(rights), max(bottoms)
+
+
+def data_to_page(data: dict[str, list], size: tuple[int, int], page_number: int, text: list[str]) -> documentai.Document.Page:
+    """Build a Document AI page from the `image_to_data` output of Tesseract.
+
+    Args:
+        data (dict[str, list]): The word table from `pytesseract.image_to_data(..., output_type=Output.DICT)`.
+        size (tuple[int, int]): The page width and height in pixels.
+        page_number (int): The one-based page number.
+        text (list[str]): The document text so far, the page text is appended to it.
+
+    Returns:
+        documentai.Document.Page: The page with its blocks, lines and tokens anchored into the document text.
+    """
+    from google.cloud import documentai
+
+    offset = sum(map(len, text))
+    page_start = offset
+    words = [
+        {
+            "text": word.strip(),
+            "line": (data["block_num"][index], data["par_num"][index], data["line_num"][index]),
+            "box": (data["left"][index], data["top"][index], data["left"][index] + data["width"][index], data["top"][index] + data["height"][index]),
+            "confidence": float(data["conf"][index]) / 100,
+        }
+        for index, word in enumerate(data["text"])
+        if word.strip() and float(data["conf"][index]) >= 0
+    ]
+
+    tokens, lines, blocks = [], [], []
+    for _, block_words in groupby(words, key=lambda word: word["line"][0]):
+        block_start, block_boxes = offset, []
+        for _, line_words in groupby(block_words, key=lambda word: word["line"]):
+            line_words = list(line_words)
+            line_start = offset
+            for position, word in enumerate(line_words):
+                separator = "\n" if position == len(line_words) - 1 else " "
+                text.append(word["text"] + separator)
+                tokens.append(documentai.Document.Page.Token(layout=_layout(offset, offset + len(word["text"]) + 1, word["box"], size, word["confidence"])))
+                offset += len(word["text"]) + 1
+            line_box = _union([word["box"] for word in line_words])
+            lines.append(documentai.Document.Page.Line(layout=_layout(line_start, offset, line_box, size)))
+            block_boxes.append(line_box)
+        blocks.append(documentai.Document.Page.Block(layout=_layout(block_start, offset, _union(block_boxes), size)))
+
+    width, height = size
+    return documentai.Document.Page(
+        page_number=page_number,
+        dimension=documentai.Document.Page.Dimension(width=width, height=height, unit="pixels"),
+        layout=_layout(page_start, offset, (0, 0, width, height), size),
+        blocks=blocks,
+        lines=lines,
+        tokens=tokens,
+        # The mean word confidence stands in for the image quality score, which gates text-only extraction
+        image_quality_scores=documentai.Document.Page.ImageQualityScores(quality_score=statistics.fmean(word["confidence"] for word in words) if words else 0.0),
+    )
+
+
+class TesseractBackend(OCRBackend):
+    """Tesseract on the local CPU, returning the same document structure as Document AI.
+
+    Args:
+        lang (Optional[str]): The Tesseract languages, e.g. "eng+chi_tra", defaults to `TESSERACT_LANG` or "eng".
+        config (Optional[str]): Extra Tesseract arguments, defaults to `TESSERACT_CONFIG` or `DEFAULT_TESSERACT_CONFIG`.
+        dpi (int): The PDF rendering resolution.
+        max_workers (Optional[int]): The pages OCRed at once, one per CPU by default.
+    """
+
+    def __init__(self, lang: Optional[str] = None, config: Optional[str] = None, dpi: int = 200, max_workers: Optional[int] = None):
+        self.lang = lang or getenv("TESSERACT_LANG", "eng")
+        self.config = config or getenv("TESSERACT_CONFIG", DEFAULT_TESSERACT_CONFIG)
+        self.dpi = dpi
+        self.max_workers = max_workers or os.cpu_count()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="structured_ocr_tesseract")
+
+    def _ocr_page(self, image: Image.Image) -> dict[str, list]:
+        pytesseract = _pytesseract()
+        return pytesseract.image_to_data(image, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT)
+
+    def _ocr_pages(self, content: bytes) -> list[tuple[tuple[int, int], dict[str, list]]]:
+        """Render the pages on the calling thread, one at a time per process as PDFium requires, and OCR them on the pool as they come.
+
+        At most `max_workers` rendered pages are in flight, the next page is rendered once the oldest one is OCRed.
+        """
+        pages_data: list[tuple[tuple[int, int], dict[str, list]]] = []
+        in_flight: deque[tuple[tuple[int, int], Future]] = deque()
+        try:
+            for image in iter_pages(content, self.dpi):
+                if len(in_flight) >= self.max_workers:
+                    size, future = in_flight.popleft()
+                    pages_data.append((size, future.result()))
+                in_flight.append((image.size, self._executor.submit(self._ocr_page, image)))
+            while in_flight:
+                size, future = in_flight.popleft()
+                pages_data.append((size, future.result()))
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+        return pages_data
+
+    @staticmethod
+    def _document(pages_data: list[tuple[tuple[int, int], dict[str, list]]], mime_type: str) -> documentai.Document:
+        from google.cloud import documentai
+
+        text: list[str] = []
+        pages = [data_to_page(data, size, number, text) for number, (size, data) in enumerate(pages_data, start=1)]
+        return documentai.Document(text="".join(text), mime_type=mime_type, pages=pages)
+
+    def process(self, content: bytes, mime_type: str) -> documentai.Document:
+        return self._document(self._ocr_pages(content), mime_type)
+
+    async def aprocess(self, content: bytes, mime_type: str) -> documentai.Document:
+        return await asyncio.to_thread(self.process, content, mime_type)
+
+
+register_ocr_backend("tesseract", TesseractBackend)
@@ -0,0 +1,415 @@
+"""Per-route rate limiting and adaptive concurrency for provider calls.
+
+Every model, and Document AI, is a route with its own limiter shared by all threads and coroutines of the process:
+- Token buckets hold the sustained rate just under the configured requests/min and tokens/min quota.
+- The concurrency limit follows AIMD: it grows by one per window of successes and halves on a 429 or 5xx.
+- Throttled calls are retried with jittered exponential backoff, honouring `Retry-After`, which also pauses the whole route.
+
+Quotas are set with `configure_route`, or the `RATE_LIMITS` environment variable as JSON, e.g. `{"gemini-2.5-flash": {"requests_per_minute": 1000, "tokens_per_minute": 1000000}}`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from pydantic import BaseModel, Field
+
+from .env import getenv
+from .telemetry import annotate, log
+
+T = TypeVar("T")
+
+# Statuses that mean the provider is overloaded rather than the request being wrong
+THROTTLE_STATUSES = {408, 429, 500, 502, 503, 504}
+# Rough input tokens of one image, for the tokens/min budget before the real usage is known
+IMAGE_TOKENS = 1_000
+# Weight of the latest call in the latency average, which sets how long a congestion event lasts
+LATENCY_SMOOTHING = 0.2
+# Recent successful call latencies kept per route, and how many are needed before their quantiles are trusted
+LATENCY_WINDOW = 200
+MIN_LATENCY_SAMPLES = 20
+
+
+class RouteLimits(BaseModel):
+    requests_per_minute: Optional[float] = Field(default=None, description="The request quota, unlimited when None")
+    tokens_per_minute: Optional[float] = Field(default=None, description="The token quota, unlimited when None")
+    headroom: float = Field(default=0.95, description="The share of the quota to use, to stay just under it")
+    burst_seconds: float = Field(default=10.0, description="The quota that may be spent at once, in seconds of sustained rate")
+    max_concurrency: int = Field(default=64, description="The upper bound and starting point of the adaptive concurrency limit")
+    min_concurrency: int = Field(default=1, description="The lower bound of the adaptive concurrency limit")
+    max_retries: int = Field(default=5, description="The retries of a throttled call before giving up")
+    base_delay: float = Field(default=1.0, description="The first backoff delay in seconds, doubled per retry")
+    max_delay: float = Field(default=60.0, description="The longest backoff delay in seconds")
+
+
+class ThrottleStats(BaseModel):
+    requests: int = 0
+    throttled: int = 0
+    retries: int = 0
+    throttle_wait_seconds: float = 0.0
+    concurrency_limit: float = 0.0
+
+
+class TokenBucket:
+    """A reservation-based token bucket, safe across threads and event loops.
+
+    Callers reserve first and then sleep for the returned delay themselves, so the bucket never blocks and works for sync and async code alike.
+    """
+
+    def __init__(self, rate_per_minute: float, burst_seconds: float = 10.0):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(1.0, self.rate * burst_seconds)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """Take `amount` tokens, going into debt if needed.
+
+        Returns:
+            float: The seconds to wait before the reservation is covered.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            self._tokens -= amount
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def adjust(self, amount: float) -> None:
+        """Charge, or refund when negative, the difference between an estimate and the real usage."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """A semaphore whose limit follows additive-increase/multiplicative-decrease, shared by threads and coroutines.
+
+    Freed slots are handed to waiters in FIFO order, whether they block a thread or await on an event loop.
+    """
+
+    def __init__(self, max_concurrency: int, min_concurrency: int = 1):
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self._in_flight = 0
+        self._waiters: deque[Callable[[], None]] = deque()
+        self.latency = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.RLock()
+
+    def _has_slot(self) -> bool:
+        return self._in_flight < max(self.min_concurrency, math.floor(self.limit))
+
+    @property
+    def saturated(self) -> bool:
+        """Whether every slot is taken, so a new call would queue."""
+        with self._lock:
+            return not self._has_slot()
+
+    def _wake(self) -> None:
+        # Called under the lock, the slot is taken on behalf of the waiter
+        while self._waiters and self._has_slot():
+            self._in_flight += 1
+            try:
+                self._waiters.popleft()()
+            except RuntimeError:  # The waiter's event loop is closed
+                self._in_flight -= 1
+
+    def acquire(self) -> None:
+        with self._lock:
+            if self._has_slot() and not self._waiters:
+                self._in_flight += 1
+                return
+            event = threading.Event()
+            self._waiters.append(event.set)
+        event.wait()
+
+    async def aacquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def _resolve() -> None:
+            if future.cancelled():
+                self.release()
+            else:
+                future.set_result(None)
+
+        def waiter() -> None:
+            loop.call_soon_threadsafe(_resolve)
+
+        with self._lock:
+            if self._has_slot() and not self._waiters:
+                self._in_flight += 1
+                return
+            self._waiters.append(waiter)
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                elif future.done() and not future.cancelled():
+                    self.release()
+            raise
+
+    def release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._wake()
+
+    def on_success(self, latency: float) -> None:
+        """Additive increase, about one slot per full window of successes."""
+        with self._lock:
+            self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.latency = latency if not self.latency else (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * latency
+            self._wake()
+
+    def on_throttle(self) -> None:
+        """Multiplicative decrease, once per congestion event, i.e. per round trip like TCP."""
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.latency:
+                self.limit = max(self.min_concurrency, self.limit / 2)
+                self._last_decrease = now
+
+
+class RouteLimiter:
+    """The buckets, concurrency limit and backoff of one route."""
+
+    def __init__(self, route: str, limits: RouteLimits):
+        self.route = route
+        self.limits = limits
+        self.requests = TokenBucket(limits.requests_per_minute * limits.headroom, limits.burst_seconds) if limits.requests_per_minute else None
+        self.tokens = TokenBucket(limits.tokens_per_minute * limits.headroom, limits.burst_seconds) if limits.tokens_per_minute else None
+        self.concurrency = AdaptiveConcurrency(limits.max_concurrency, limits.min_concurrency)
+        self.stats = ThrottleStats(concurrency_limit=self.concurrency.limit)
+        self._paused_until = 0.0
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float) -> float:
+        """Reserve one request and `tokens` tokens, returning the seconds to wait."""
+        delay = max(0.0, self._paused_until - time.monotonic())
+        if self.requests is not None:
+            delay = max(delay, self.requests.reserve(1))
+        if self.tokens is not None and tokens:
+            delay = max(delay, self.tokens.reserve(tokens))
+        return delay
+
+    def backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """The jittered exponential delay before retry `attempt`, at least `Retry-After`, which also pauses the route."""
+        delay = random.uniform(0, min(self.limits.max_delay, self.limits.base_delay * 2**attempt))
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, self.limits.base_delay)
+            with self._lock:
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        return delay
+
+    def observe(self, latency: float) -> None:
+        """Record the latency of a successful call."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def latency_quantile(self, quantile: float) -> Optional[float]:
+        """The `quantile` of recent successful call latencies in seconds, or None until `MIN_LATENCY_SAMPLES` calls succeeded."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < MIN_LATENCY_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, math.ceil(quantile * len(latencies)) - 1)]
+
+    def record(self, throttled: bool = False, retried: bool = False, waited: float = 0.0) -> None:
+        with self._lock:
+            self.stats.requests += not retried
+            self.stats.throttled += throttled
+            self.stats.retries += retried
+            self.stats.throttle_wait_seconds += waited
+            self.stats.concurrency_limit = self.concurrency.limit
+
+
+class _Usage:
+    """The token estimate of the call in progress, settled against the real usage."""
+
+    def __init__(self, limiter: RouteLimiter, estimate: float):
+        self.limiter = limiter
+        self.estimate = estimate
+
+
+_route_limits: dict[str, RouteLimits] = {}
+_limiters: dict[str, RouteLimiter] = {}
+_limiters_lock = threading.Lock()
+_current_usage: ContextVar[Optional[_Usage]] = ContextVar("structured_ocr_usage", default=None)
+
+
+def _env_limits() -> dict[str, RouteLimits]:
+    return {route: RouteLimits(**limits) for route, limits in json.loads(getenv("RATE_LIMITS") or "{}").items()}
+
+
+def configure_route(route: str, **limits) -> None:
+    """Set the quota of a route, e.g. `configure_route("gemini-2.5-flash", requests_per_minute=1000, tokens_per_minute=1_000_000)`.
+
+    Args:
+        route (str): The model name, or "documentai".
+        **limits: `RouteLimits` fields.
+    """
+    with _limiters_lock:
+        _route_limits[route] = RouteLimits(**limits)
+        _limiters.pop(route, None)
+
+
+def get_limiter(route: str) -> RouteLimiter:
+    """Get the process-wide limiter of `route`."""
+    with _limiters_lock:
+        limiter = _limiters.get(route)
+        if limiter is None:
+            if not _route_limits:
+                _route_limits.update(_env_limits())
+            limiter = _limiters[route] = RouteLimiter(route, _route_limits.get(route, RouteLimits()))
+        return limiter
+
+
+def reset_limiters() -> None:
+    """Drop every limiter and its state, keeping the configured quotas."""
+    with _limiters_lock:
+        _limiters.clear()
+
+
+def estimate_tokens(*texts: Optional[str], images: int = 0) -> int:
+    """Estimate the input tokens of a call at about 4 characters per token plus `IMAGE_TOKENS` per image."""
+    return sum(len(text) for text in texts if text) // 4 + images * IMAGE_TOKENS
+
+
+def report_usage(tokens: int) -> None:
+    """Settle the tokens/min reservation of the current call with the real usage, a no-op outside of one."""
+    usage = _current_usage.get()
+    if usage is not None and usage.limiter.tokens is not None:
+        usage.limiter.tokens.adjust(tokens - usage.estimate)
+        usage.estimate = tokens
+
+
+def _status(error: Exception) -> Optional[int]:
+    # openai and httpx use `status_code`, google-genai and google-api-core use `code`
+    for attribute in ("status_code", "code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Read the `Retry-After` delay in seconds from the error's HTTP response, if any."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+    if (milliseconds := headers.get("retry-after-ms")) is not None:
+        try:
+            return float(milliseconds) / 1000
+        except ValueError:
+            pass
+    if (value := headers.get("retry-after")) is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def is_throttled(error: Exception) -> bool:
+    """Whether the error is a rate limit or a transient server error worth retrying."""
+    return _status(error) in THROTTLE_STATUSES
+
+
+def call_limited(route: str, func: Callable[[], T], tokens: int = 0) -> T:
+    """Call `func` within the limits of `route`, retrying it while throttled.
+
+    Args:
+        route (str): The model name, or "documentai".
+        func (Callable[[], T]): The provider call.
+        tokens (int): The estimated tokens of the call, settled later by `report_usage`.
+
+    Returns:
+        T: The result of `func`.
+    """
+    limiter = get_limiter(route)
+    waited, backoff = 0.0, 0.0
+    for attempt in range(limiter.limits.max_retries + 1):
+        start = time.monotonic()
+        time.sleep(backoff + limiter.reserve(tokens))
+        limiter.concurrency.acquire()
+        wait = time.monotonic() - start
+        waited += wait
+
+        throttled = False
+        token = _current_usage.set(_Usage(limiter, tokens))
+        try:
+            started = time.monotonic()
+            return _succeed(limiter, func(), started)
+        except Exception as e:
+            throttled = is_throttled(e)
+            if not throttled or attempt == limiter.limits.max_retries:
+                raise
+            backoff = _throttle(limiter, route, attempt, e)
+        finally:
+            _current_usage.reset(token)
+            limiter.concurrency.release()
+            limiter.record(throttled=throttled, retried=attempt > 0, waited=wait)
+            annotate(throttle_wait=waited, throttle_retries=attempt)
+
+
+async def acall_limited(route: str, func: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+    """Async version of `call_limited`, `func` returns a fresh awaitable per attempt."""
+    limiter = get_limiter(route)
+    waited, backoff = 0.0, 0.0
+    for attempt in range(limiter.limits.max_retries + 1):
+        start = time.monotonic()
+        if delay := backoff + limiter.reserve(tokens):
+            await asyncio.sleep(delay)
+        await limiter.concurrency.aacquire()
+        wait = time.monotonic() - start
+        waited += wait
+
+        throttled = False
+        token = _current_usage.set(_Usage(limiter, tokens))
+        try:
+            started = time.monotonic()
+            return _succeed(limiter, await func(), started)
+        except Exception as e:
+            throttled = is_throttled(e)
+            if not throttled or attempt == limiter.limits.max_retries:
+                raise
+            backoff = _throttle(limiter, route, attempt, e)
+        finally:
+            _current_usage.reset(token)
+            limiter.concurrency.release()
+            limiter.record(throttled=throttled, retried=attempt > 0, waited=wait)
+            annotate(throttle_wait=waited, throttle_retries=attempt)
+
+
+def _succeed(limiter: RouteLimiter, result: T, started: float) -> T:
+    latency = time.monotonic() - started
+    limiter.concurrency.on_success(latency)
+    limiter.observe(latency)
+    return result
+
+
+def _throttle(limiter: RouteLimiter, route: str, attempt: int, error: Exception) -> float:
+    """Shrink the concurrency limit and work out the backoff before the next attempt."""
+    limiter.concurrency.on_throttle()
+    backoff = limiter.backoff(attempt, retry_after(error))
+    log(f"🚦 {route} throttled ({_status(error)}), retrying in {backoff:.1f}s", "warning")
+    return backoff
@@ -0,0 +1,58 @@
+"""Provider-specific structured output specs, converted from the Pydantic schema once per schema class and reused by every call.
+
+Each route otherwise walks the whole schema, nested models included, on every request: the LangChain route into an OpenAI tool, the Gemini route into its response schema, the caches into a fingerprint.
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Iterable, Optional
+
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+ROUTES = ("langchain", "gemini")
+
+
+def model_route(model: str) -> str:
+    """The route `run_llm` sends `model` through, OpenRouter models are named with their provider prefix."""
+    return "langchain" if "/" in model else "gemini"
+
+
+@lru_cache(maxsize=None)
+def json_schema(schema: type[BaseModel]) -> dict[str, Any]:
+    """The JSON schema of `schema`, as sent to Gemini and fingerprinted by the caches."""
+    return schema.model_json_schema()
+
+
+@lru_cache(maxsize=None)
+def openai_tool(schema: type[BaseModel]) -> dict[str, Any]:
+    """The OpenAI function-calling tool of `schema`, as bound by the LangChain route."""
+    from langchain_core.utils.function_calling import convert_to_openai_tool
+
+    return convert_to_openai_tool(schema)
+
+
+@lru_cache(maxsize=None)
+def gemini_config(schema: Optional[type[BaseModel]], temperature: Optional[float] = None) -> types.GenerateContentConfig:
+    """The Gemini generation config returning JSON of `schema`, shared by every call since the SDK only reads it. `temperature` is 0 unless given."""
+    from google.genai import types
+
+    return types.GenerateContentConfig(
+        temperature=0 if temperature is None else temperature,
+        response_modalities=["TEXT"],
+        thinking_config=types.ThinkingConfig(thinking_budget=1024),
+        response_mime_type="application/json",
+        response_json_schema=json_schema(schema) if schema is not None else None,
+    )
+
+
+def compile_specs(schema: type[BaseModel], routes: Iterable[str] = ROUTES) -> None:
+    """Convert `schema` for the given routes ahead of the first call, importing only their SDKs."""
+    json_schema(schema)
+    if "langchain" in routes:
+        openai_tool(schema)
+    if "gemini" in routes:
+        gemini_config(schema)
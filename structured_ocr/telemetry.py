@@ -0,0 +1,355 @@
+"""Structured instrumentation of graph runs, nodes and provider calls.
+
+Every graph run, node, `run_llm` and `run_ocr` call is recorded as a `Span` and handed to the registered sinks. Nothing is recorded while no sink is registered, so the hot path only pays for a list check.
+
+The emoji progress lines go through `log`, which is silenced below `STRUCTURED_OCR_LOG_LEVEL` (debug, info, warning, error or off).
+"""
+
+from __future__ import annotations
+
+import inspect
+import json
+import statistics
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from pydantic import BaseModel, Field, PrivateAttr
+from rich import print
+from rich.table import Table
+
+from .env import getenv
+
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "off": 100}
+
+# USD per 1M input and output tokens, keyed by model name without the provider prefix, update as pricing changes
+MODEL_PRICES: dict[str, tuple[float, float]] = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+
+class Span(BaseModel):
+    """One timed unit of work: a graph run, a node, a provider call or a wait."""
+
+    name: str
+    kind: str = Field(description="graph, node, llm, ocr or queue")
+    trace_id: str
+    parent: Optional[str] = None
+    image_path: Optional[str] = None
+    start_time: float = Field(description="Epoch seconds")
+    duration: float = 0.0
+    attempt: int = Field(default=1, description="1 on the first run, incremented by every `RetryPolicy` retry of a node")
+    correction_depth: Optional[int] = None
+    model: Optional[str] = None
+    input_tokens: Optional[int] = None
+    output_tokens: Optional[int] = None
+    cost: Optional[float] = Field(default=None, description="Estimated USD from `MODEL_PRICES`")
+    payload_bytes: Optional[int] = None
+    cache_hit: Optional[bool] = None
+    throttle_wait: Optional[float] = Field(default=None, description="Seconds spent waiting on the rate limiter and backing off")
+    throttle_retries: Optional[int] = Field(default=None, description="Retries after a 429 or 5xx response")
+    error: Optional[str] = None
+    attributes: dict[str, Any] = Field(default_factory=dict)
+
+    _attempts: dict[tuple[str, Optional[int]], int] = PrivateAttr(default_factory=dict)
+    _parent: Optional[Span] = PrivateAttr(default=None)
+
+    @property
+    def key(self) -> str:
+        """Group name, provider calls are grouped under the node that made them."""
+        if self.kind in ("llm", "ocr") and self.parent:
+            return f"{self.parent}.{self.name}"
+        return self.name
+
+
+class Sink(ABC):
+    """Receives every finished span."""
+
+    @abstractmethod
+    def emit(self, span: Span) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class HistogramSink(Sink):
+    """Keep durations and counters per span key in memory, for percentiles and totals.
+
+    Args:
+        max_samples (int): The most recent durations kept per key.
+    """
+
+    def __init__(self, max_samples: int = 10_000):
+        self.max_samples = max_samples
+        self._durations: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self._counters: dict[str, dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        with self._lock:
+            self._durations[span.key].append(span.duration)
+            counters = self._counters[span.key]
+            counters["count"] += 1
+            counters["errors"] += span.error is not None
+            counters["retries"] += span.attempt > 1
+            counters["cache_hits"] += bool(span.cache_hit)
+            counters["input_tokens"] += span.input_tokens or 0
+            counters["output_tokens"] += span.output_tokens or 0
+            counters["payload_bytes"] += span.payload_bytes or 0
+            counters["cost"] += span.cost or 0.0
+            counters["throttle_wait"] += span.throttle_wait or 0.0
+            counters["throttle_retries"] += span.throttle_retries or 0
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        """Summarize every key.
+
+        Returns:
+            dict[str, dict[str, float]]: The counters with mean, p50, p90, p99 and max durations in seconds, per span key.
+        """
+        with self._lock:
+            summary = {}
+            for key, durations in self._durations.items():
+                ordered = sorted(durations)
+                percentile = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]  # noqa: E731
+                summary[key] = {
+                    **self._counters[key],
+                    "mean": statistics.fmean(ordered),
+                    "p50": percentile(0.5),
+                    "p90": percentile(0.9),
+                    "p99": percentile(0.99),
+                    "max": ordered[-1],
+                }
+            return summary
+
+    def table(self) -> Table:
+        """Render the summary for the terminal."""
+        table = Table(title="Telemetry")
+        columns = ("span", "count", "errors", "retries", "cache hits", "p50 ms", "p90 ms", "p99 ms", "tokens in/out", "KB sent", "cost $", "throttled s")
+        for column in columns:
+            table.add_column(column, justify="left" if column == "span" else "right")
+        for key, stats in sorted(self.summary().items()):
+            table.add_row(
+                key,
+                f"{stats['count']:.0f}",
+                f"{stats['errors']:.0f}",
+                f"{stats['retries']:.0f}",
+                f"{stats['cache_hits']:.0f}",
+                f"{stats['p50'] * 1000:.1f}",
+                f"{stats['p90'] * 1000:.1f}",
+                f"{stats['p99'] * 1000:.1f}",
+                f"{stats['input_tokens']:.0f}/{stats['output_tokens']:.0f}",
+                f"{stats['payload_bytes'] / 1024:.1f}",
+                f"{stats['cost']:.4f}",
+                f"{stats['throttle_wait']:.1f}",
+            )
+        return table
+
+    def clear(self) -> None:
+        with self._lock:
+            self._durations.clear()
+            self._counters.clear()
+
+
+class JSONLSink(Sink):
+    """Append every span as one JSON line."""
+
+    def __init__(self, path: str):
+        Path(path).expanduser().parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(Path(path).expanduser(), "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def emit(self, span: Span) -> None:
+        line = span.model_dump_json(exclude_none=True)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class OpenTelemetrySink(Sink):
+    """Export every span through the OpenTelemetry tracer provider configured by the application.
+
+    Spans are exported when they finish, so nesting is carried by the `structured_ocr.trace_id` and `structured_ocr.parent` attributes rather than by OpenTelemetry parent links.
+
+    Args:
+        tracer_name (str): The instrumentation scope name.
+    """
+
+    def __init__(self, tracer_name: str = "structured_ocr"):
+        from opentelemetry import trace
+
+        self._trace = trace
+        self._tracer = trace.get_tracer(tracer_name)
+
+    def emit(self, span: Span) -> None:
+        fields = span.model_dump(exclude={"name", "start_time", "duration", "attributes"}, exclude_none=True)
+        attributes = {f"structured_ocr.{field}": value for field, value in fields.items()}
+        attributes.update({f"structured_ocr.{field}": value if isinstance(value, (str, bool, int, float)) else json.dumps(value, default=str) for field, value in span.attributes.items()})
+
+        start_time = int(span.start_time * 1e9)
+        otel_span = self._tracer.start_span(span.name, start_time=start_time, attributes=attributes)
+        if span.error is not None:
+            otel_span.set_status(self._trace.Status(self._trace.StatusCode.ERROR, span.error))
+        otel_span.end(end_time=start_time + int(span.duration * 1e9))
+
+
+_sinks: tuple[Sink, ...] = ()
+_sinks_lock = threading.Lock()
+_current_span: ContextVar[Optional[Span]] = ContextVar("structured_ocr_span", default=None)
+_log_level: Optional[int] = None
+
+
+def add_sink(sink: Sink) -> Sink:
+    """Start sending spans to `sink`, returned for chaining."""
+    global _sinks
+    with _sinks_lock:
+        _sinks = (*_sinks, sink)
+    return sink
+
+
+def remove_sink(sink: Sink) -> None:
+    """Stop sending spans to `sink` and close it."""
+    global _sinks
+    with _sinks_lock:
+        _sinks = tuple(registered for registered in _sinks if registered is not sink)
+    sink.close()
+
+
+def estimate_cost(model: Optional[str], input_tokens: Optional[int], output_tokens: Optional[int]) -> Optional[float]:
+    """Estimate the USD cost of a call from `MODEL_PRICES`, or None for unpriced models."""
+    if model is None or (prices := MODEL_PRICES.get(model.split("/")[-1])) is None:
+        return None
+    input_price, output_price = prices
+    return ((input_tokens or 0) * input_price + (output_tokens or 0) * output_price) / 1_000_000
+
+
+@contextmanager
+def span(name: str, kind: str, **fields) -> Iterator[Optional[Span]]:
+    """Time the enclosed block as a span, nested under the current one.
+
+    Args:
+        name (str): The span name, e.g. the node name.
+        kind (str): graph, node, llm, ocr or queue.
+        **fields: Initial `Span` fields, unknown ones go to `attributes`.
+
+    Yields:
+        Optional[Span]: The live span, or None when no sink is registered.
+    """
+    if not _sinks:
+        yield None
+        return
+
+    parent = _current_span.get()
+    if parent is not None:
+        fields.setdefault("image_path", parent.image_path)
+        fields.setdefault("correction_depth", parent.correction_depth)
+    attributes = {field: fields.pop(field) for field in list(fields) if field not in Span.model_fields}
+    record = Span(
+        name=name,
+        kind=kind,
+        trace_id=parent.trace_id if parent is not None else uuid.uuid4().hex,
+        parent=parent.name if parent is not None else None,
+        start_time=time.time(),
+        attributes=attributes,
+        **fields,
+    )
+    record._parent = parent
+
+    # Nodes re-run by `RetryPolicy` are counted on the enclosing graph span, a revisit by the correction loop comes with a deeper correction
+    if kind == "node":
+        graph = parent
+        while graph is not None and graph.kind != "graph":
+            graph = graph._parent
+        if graph is not None:
+            visit = (name, record.correction_depth)
+            record.attempt = graph._attempts[visit] = graph._attempts.get(visit, 0) + 1
+
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = repr(e)
+        raise
+    finally:
+        record.duration = time.perf_counter() - start
+        _current_span.reset(token)
+        if record.cost is None and record.kind == "llm":
+            record.cost = estimate_cost(record.model, record.input_tokens, record.output_tokens)
+        for sink in _sinks:
+            sink.emit(record)
+
+
+def annotate(**fields) -> None:
+    """Set fields on the current span, a no-op outside of one. Unknown fields go to `attributes`."""
+    record = _current_span.get()
+    if record is None:
+        return
+    for field, value in fields.items():
+        if field in Span.model_fields:
+            setattr(record, field, value)
+        else:
+            record.attributes[field] = value
+
+
+def traced(name: str, kind: str = "node", fields: Optional[Callable[..., dict]] = None) -> Callable:
+    """Decorate a sync or async function to run inside a span.
+
+    Args:
+        name (str): The span name.
+        kind (str): The span kind.
+        fields (Optional[Callable[..., dict]]): Called with the function arguments to fill the span fields.
+    """
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind, **(fields(*args, **kwargs) if fields and _sinks else {})):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, kind, **(fields(*args, **kwargs) if fields and _sinks else {})):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def set_log_level(level: str) -> None:
+    """Show `log` messages at `level` and above, "off" silences them."""
+    global _log_level
+    _log_level = LOG_LEVELS[level.lower()]
+
+
+def log(message: Any, level: str = "info") -> None:
+    """Print a progress message unless below the log level.
+
+    Args:
+        message (Any): Anything `rich.print` renders.
+        level (str): debug, info, warning or error.
+    """
+    if _log_level is None:
+        set_log_level(getenv("STRUCTURED_OCR_LOG_LEVEL", "info"))
+    if LOG_LEVELS[level] >= _log_level:
+        print(message)
@@ -1,12 +1,34 @@
+from __future__ import annotations
+
 import base64
+import hashlib
 import io
+import threading
+from functools import cached_property
 from pathlib import Path
+from typing import TYPE_CHECKING, Iterator, Optional
 
-import cv2
 import numpy as np
-from google.cloud import documentai
-from IPython.display import display
-from PIL import Image
+from PIL import Image, ImageSequence
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from google.cloud import documentai
+
+# Formats accepted as-is by both Gemini/OpenRouter and Google Document AI
+PASSTHROUGH_MIME_TYPES = {"image/png", "image/jpeg", "image/webp"}
+# Formats that may hold several pages
+MULTIPAGE_MIME_TYPES = {"application/pdf", "image/tiff"}
+# Leading bytes of the formats accepted as raw content
+MAGIC_NUMBERS = {
+    b"%PDF": "application/pdf",
+    b"II*\x00": "image/tiff",
+    b"MM\x00*": "image/tiff",
+    b"\x89PNG": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+    b"GIF8": "image/gif",
+    b"BM": "image/bmp",
+}
 
 
 def image_to_bytes(image: Image.Image) -> bytes:
@@ -57,8 +79,316 @@ def get_mime_type(file_path: str) -> str:
     return mime_types.get(extension)
 
 
+def sniff_mime_type(content: bytes) -> Optional[str]:
+    """Get the MIME type from the leading bytes of the content, for raw bytes without a file name."""
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, mime_type in MAGIC_NUMBERS.items():
+        if content.startswith(magic):
+            return mime_type
+    return None
+
+
+class ImagePayload(BaseModel):
+    """An encoded image, computed once and reused by every LLM and OCR call."""
+
+    data: bytes
+    mime_type: str
+
+    @cached_property
+    def base64(self) -> str:
+        """The base64 of the image."""
+        return base64.b64encode(self.data).decode("utf-8")
+
+    @cached_property
+    def sha256(self) -> str:
+        """The content hash of the image."""
+        return hashlib.sha256(self.data).hexdigest()
+
+    @property
+    def data_url(self) -> str:
+        """The image as a data URL."""
+        return f"data:{self.mime_type};base64,{self.base64}"
+
+    @classmethod
+    def from_image(cls, image: Image.Image) -> "ImagePayload":
+        """Encode a PIL image as PNG."""
+        return cls(data=image_to_bytes(image), mime_type="image/png")
+
+
+def encode_image(image_path: str, image: Optional[Image.Image] = None) -> ImagePayload:
+    """Encode the image once, passing the original file bytes through when the format is already accepted.
+
+    Args:
+        image_path (str): The path of the source file.
+        image (Optional[Image.Image]): The opened image, used when re-encoding is needed.
+
+    Returns:
+        ImagePayload: The encoded image.
+    """
+    mime_type = get_mime_type(image_path)
+    if mime_type in PASSTHROUGH_MIME_TYPES:
+        return ImagePayload(data=Path(image_path).read_bytes(), mime_type=mime_type)
+
+    if image is None:
+        image = Image.open(image_path)
+    return ImagePayload.from_image(image)
+
+
+# PDFium is not thread-safe, even across documents, so every pypdfium2 call of the process is made while holding this lock
+PDFIUM_LOCK = threading.Lock()
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError as e:
+        raise ImportError("Rendering PDF pages requires pypdfium2, install it with `pip install 'structured-ocr[pdf]'`") from e
+    return pypdfium2
+
+
+def _render_page(pdf, index: int, dpi: int) -> Image.Image:
+    """Render one page of an open PDF. The caller holds `PDFIUM_LOCK`."""
+    page = pdf[index]
+    try:
+        # Converted while locked, so the image no longer refers to the PDFium bitmap
+        return page.render(scale=dpi / 72).to_pil().convert("RGB")
+    finally:
+        page.close()
+
+
+def is_multipage(file_path: str) -> bool:
+    """Whether the file is a PDF or TIFF, which are processed page by page."""
+    return get_mime_type(file_path) in MULTIPAGE_MIME_TYPES
+
+
+def count_pages(file_path: str) -> int:
+    """Count the pages of a PDF or the frames of an image without decoding them."""
+    if get_mime_type(file_path) == "application/pdf":
+        with PDFIUM_LOCK:
+            pdf = _pdfium().PdfDocument(file_path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+
+    with Image.open(file_path) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def load_page(file_path: str, index: int, dpi: int = 200) -> Image.Image:
+    """Decode a single page, leaving the rest of the document on disk.
+
+    PDF pages are rendered one at a time per process, see `PDFIUM_LOCK`.
+
+    Args:
+        file_path (str): The PDF, TIFF or image file.
+        index (int): The zero-based page index.
+        dpi (int): The PDF rendering resolution.
+
+    Returns:
+        Image.Image: The page in RGB.
+    """
+    if get_mime_type(file_path) == "application/pdf":
+        with PDFIUM_LOCK:
+            pdf = _pdfium().PdfDocument(file_path)
+            try:
+                return _render_page(pdf, index, dpi)
+            finally:
+                pdf.close()
+
+    with Image.open(file_path) as image:
+        image.seek(index)
+        return image.convert("RGB")
+
+
+def iter_pages(file_path: str | bytes, dpi: int = 200) -> Iterator[Image.Image]:
+    """Lazily decode the pages of a PDF or the frames of a TIFF, one at a time.
+
+    The lock on PDFium is taken for each page and released before it is yielded, so other threads can render while the caller works on the page.
+
+    Args:
+        file_path (str | bytes): The PDF, TIFF or image file, or its content.
+        dpi (int): The PDF rendering resolution.
+
+    Yields:
+        Image.Image: Each page in RGB.
+    """
+    mime_type = sniff_mime_type(file_path) if isinstance(file_path, bytes) else get_mime_type(file_path)
+    if mime_type == "application/pdf":
+        with PDFIUM_LOCK:
+            pdf = _pdfium().PdfDocument(file_path)
+            pages = len(pdf)
+        try:
+            for index in range(pages):
+                with PDFIUM_LOCK:
+                    image = _render_page(pdf, index, dpi)
+                yield image
+        finally:
+            with PDFIUM_LOCK:
+                pdf.close()
+        return
+
+    with Image.open(io.BytesIO(file_path) if isinstance(file_path, bytes) else file_path) as image:
+        for frame in ImageSequence.Iterator(image):
+            yield frame.convert("RGB")
+
+
+def downscale(array: np.ndarray, max_dimension: int) -> np.ndarray:
+    """Shrink the image so its longer side is at most `max_dimension`, keeping the aspect ratio."""
+    import cv2
+
+    height, width = array.shape[:2]
+    scale = max_dimension / max(height, width)
+    if scale >= 1:
+        return array
+    return cv2.resize(array, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def auto_crop(array: np.ndarray, margin: int = 8, min_area: float = 0.2) -> np.ndarray:
+    """Crop to the largest block of content, i.e. the scoreboard, dropping the game scene around it.
+
+    Args:
+        array (np.ndarray): The RGB image.
+        margin (int): Pixels kept around the detected region.
+        min_area (float): Minimum share of the image the region must cover, otherwise the image is kept whole.
+
+    Returns:
+        np.ndarray: The cropped image.
+    """
+    import cv2
+
+    gray = cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
+    # Merge the text and row borders into one blob
+    edges = cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, (25, 25)))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return array
+
+    x, y, w, h = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    height, width = array.shape[:2]
+    if w * h < min_area * width * height:
+        return array
+    return array[max(0, y - margin) : min(height, y + h + margin), max(0, x - margin) : min(width, x + w + margin)]
+
+
+def deskew(array: np.ndarray, max_angle: float = 10.0) -> np.ndarray:
+    """Rotate the image so the scoreboard rows are horizontal.
+
+    The skew is the median angle of the near-horizontal line segments; rotations under 0.1° or above `max_angle` are skipped.
+    """
+    import cv2
+
+    # The angle is estimated on a small copy, the rotation applies to the full image
+    gray = cv2.cvtColor(downscale(array, 1024), cv2.COLOR_RGB2GRAY)
+    edges = cv2.Canny(gray, 50, 150)
+    lines = cv2.HoughLinesP(edges, 1, np.pi / 1800, threshold=50, minLineLength=gray.shape[1] // 4, maxLineGap=10)
+    if lines is None:
+        return array
+
+    x1, y1, x2, y2 = lines[:, 0].T.astype(np.float64)
+    angles = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+    angles = angles[np.abs(angles) < max_angle]
+    if angles.size == 0:
+        return array
+
+    angle = float(np.median(angles))
+    if abs(angle) < 0.1:
+        return array
+    height, width = array.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+    return cv2.warpAffine(array, matrix, (width, height), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+
+def white_balance(array: np.ndarray) -> np.ndarray:
+    """Gray-world white balance, scaling each channel to the common mean."""
+    means = array.reshape(-1, 3).mean(axis=0)
+    gains = means.mean() / np.maximum(means, 1e-6)
+    return np.clip(array * gains, 0, 255).astype(np.uint8)
+
+
+def normalize_contrast(array: np.ndarray, grayscale: bool = False) -> np.ndarray:
+    """Equalize local contrast with CLAHE on the lightness channel, optionally dropping colour."""
+    import cv2
+
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    if grayscale:
+        return cv2.cvtColor(clahe.apply(cv2.cvtColor(array, cv2.COLOR_RGB2GRAY)), cv2.COLOR_GRAY2RGB)
+
+    lab = cv2.cvtColor(array, cv2.COLOR_RGB2LAB)
+    lab[..., 0] = clahe.apply(lab[..., 0])
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2RGB)
+
+
+def preprocess_image(
+    image: Image.Image,
+    max_dimension: Optional[int] = None,
+    crop: bool = False,
+    straighten: bool = False,
+    balance: bool = False,
+    contrast: bool = False,
+    grayscale: bool = False,
+) -> np.ndarray:
+    """Run the enabled preprocessing steps in order: crop, deskew, downscale, white balance, contrast.
+
+    Args:
+        image (Image.Image): The source image.
+        max_dimension (Optional[int]): Maximum length of the longer side.
+        crop (bool): Crop to the scoreboard region.
+        straighten (bool): Deskew.
+        balance (bool): Gray-world white balance.
+        contrast (bool): CLAHE contrast normalization.
+        grayscale (bool): Drop colour. Note the highlight colours identify 'me' and the squad.
+
+    Returns:
+        np.ndarray: The processed RGB image.
+    """
+    import cv2
+
+    array = np.asarray(image.convert("RGB"))
+    if crop:
+        array = auto_crop(array)
+    if straighten:
+        array = deskew(array)
+    if max_dimension:
+        array = downscale(array, max_dimension)
+    if balance:
+        array = white_balance(array)
+    if contrast or grayscale:
+        array = normalize_contrast(array, grayscale=grayscale) if contrast else cv2.cvtColor(cv2.cvtColor(array, cv2.COLOR_RGB2GRAY), cv2.COLOR_GRAY2RGB)
+    return array
+
+
+def encode_array(array: np.ndarray, image_format: str = "png", quality: int = 90) -> ImagePayload:
+    """Encode an RGB array as PNG, JPEG or WebP.
+
+    Args:
+        array (np.ndarray): The RGB image.
+        image_format (str): "png", "jpeg" or "webp".
+        quality (int): The JPEG/WebP quality from 1 to 100, ignored for PNG.
+
+    Returns:
+        ImagePayload: The encoded image.
+    """
+    import cv2
+
+    params = {
+        "png": (".png", [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+        "jpeg": (".jpg", [cv2.IMWRITE_JPEG_QUALITY, quality]),
+        "webp": (".webp", [cv2.IMWRITE_WEBP_QUALITY, quality]),
+    }
+    extension, flags = params[image_format]
+    ok, buffer = cv2.imencode(extension, cv2.cvtColor(array, cv2.COLOR_RGB2BGR), flags)
+    if not ok:
+        raise ValueError(f"Failed to encode image as {image_format}")
+    return ImagePayload(data=buffer.tobytes(), mime_type=get_mime_type(f"image{extension}"))
+
+
 def display_resize(image: Image.Image, size: tuple[int, int] = (1000, 1000)) -> None:
     """For ipynb, resize the image to 1000x1000 and display it."""
+    from IPython.display import display
+
     image.thumbnail(size, Image.Resampling.LANCZOS)
     display(image)
 
@@ -72,6 +402,8 @@ def draw_boxes(result: documentai.Document) -> Image.Image:
     Returns:
         Image.Image: The image with boxes drawn on it.
     """
+    import cv2
+
     page = result.pages[0]
     img = cv2.imdecode(np.frombuffer(page.image.content, np.uint8), cv2.IMREAD_COLOR)
 
@@ -93,6 +425,8 @@ def erase_boxes(result: documentai.Document) -> Image.Image:
     Returns:
         Image.Image: The image with boxes erased.
     """
+    import cv2
+
     page = result.pages[0]
     img = cv2.imdecode(np.frombuffer(page.image.content, np.uint8), cv2.IMREAD_COLOR)
 
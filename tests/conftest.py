@@ -0,0 +1,16 @@
+from pathlib import Path
+
+import pytest
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+
+
+@pytest.fixture
+def fixtures_dir() -> Path:
+    """The recorded provider responses, images and labels, see `tests/record_fixtures.py`."""
+    return FIXTURES_DIR
+
+
+@pytest.fixture
+def image_paths() -> list[str]:
+    return sorted(str(path) for path in (FIXTURES_DIR / "images").glob("*.png"))
@@ -0,0 +1,136 @@
+"""Record the replay fixtures of the pipeline tests from scripted provider responses.
+
+Usage:
+    python -m tests.record_fixtures
+
+Each image of `fixtures/images` has a scripted extraction, a correction when the extraction is off, and checker scores, answered by stand-in providers registered in place of the real routes and OCR backend. The calls are recorded through `replaying` like real ones, so the fixtures are keyed on the current prompts, schemas and images. Re-run it after changing any of them, and commit the regenerated `llm/` and `ocr/` files.
+"""
+
+import json
+import shutil
+from pathlib import Path
+from typing import Optional
+
+from google.cloud import documentai
+from PIL import Image, ImageDraw
+from pydantic import BaseModel
+from rich import print
+
+from structured_ocr.benchmarks.pipeline import run_benchmark
+from structured_ocr.benchmarks.replay import ReplaySettings
+from structured_ocr.llm_ocr.llm import LLM_PROVIDERS, register_llm_provider
+from structured_ocr.llm_ocr.schema import Criteria, Match
+from structured_ocr.ocr import OCR_BACKENDS, OCRBackend, register_ocr_backend
+from structured_ocr.utils import ImagePayload
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures"
+IMAGES_DIR = FIXTURES_DIR / "images"
+LABELS_DIR = FIXTURES_DIR / "labels"
+
+# The configurations the tests run, every call they make is recorded
+CONFIGURABLES = [
+    {"llm_ocr": "gemini-2.5-flash", "llm_checker": "openai/gpt-4.1-mini"},
+    {"llm_ocr": "gemini-2.5-flash", "llm_checker": "openai/gpt-4.1-mini", "use_ocr": True},
+]
+
+
+def _player(name: str, kills: int, deaths: int, kd: Optional[float] = None, level: int = 100, score: int = 1000) -> dict:
+    return {"name": name, "level": level, "kills": kills, "deaths": deaths, "assists": 2, "kd": round(kills / deaths, 2) if kd is None else kd, "score": score}
+
+
+def _match(side: str, prefix: str, enemies: int = 4) -> dict:
+    return {
+        "side": side,
+        "me": _player(f"{prefix}_me", 12, 4),
+        "squad": [_player(f"{prefix}_squad", 6, 3)],
+        "teammates": [_player(f"{prefix}_mate1", 5, 5), _player(f"{prefix}_mate2", 3, 6)],
+        "enemies": [_player(f"{prefix}_enemy{index}", 4 + index, 5) for index in range(1, enemies + 1)],
+    }
+
+
+# Image stem -> the ground truth, which the final result of every image matches
+LABELS = {
+    "clean": _match("Heroes", "clean"),
+    "kd_mismatch": _match("Villains", "kd"),
+    "short_lobby": _match("Heroes", "short", enemies=3),
+}
+
+# Image stem -> the first extraction where it differs from the label: a K/D off its kills and deaths, certainly wrong to the local checks
+DRAFTS = {"kd_mismatch": {**LABELS["kd_mismatch"], "enemies": [_player("kd_enemy1", 5, 5, kd=2.5), *LABELS["kd_mismatch"]["enemies"][1:]]}}
+
+# Image stem -> the checker scores, asked only where the local checks find the result suspicious
+CRITERIA = {"short_lobby": {"team_names": 10, "highlighted_player": 10, "player_data_accuracy": 10, "grouping": 9, "reasons": "Three enemies, the lobby was not full"}}
+
+
+def _write_images() -> None:
+    """Draw one small scoreboard per label, kept when already there so the fixture keys stay stable."""
+    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
+    LABELS_DIR.mkdir(parents=True, exist_ok=True)
+    for stem, label in LABELS.items():
+        image_path = IMAGES_DIR / f"{stem}.png"
+        if not image_path.exists():
+            image = Image.new("RGB", (240, 120), "black")
+            draw = ImageDraw.Draw(image)
+            draw.text((4, 4), label["side"], fill="white")
+            for row, player in enumerate([label["me"], *label["squad"], *label["teammates"], *label["enemies"]]):
+                draw.text((4, 16 + 10 * row), f"{player['name']} {player['kills']}/{player['deaths']}", fill="yellow" if row == 0 else "white")
+            image.save(image_path)
+        (LABELS_DIR / f"{stem}.json").write_text(json.dumps(label, indent=1) + "\n")
+
+
+def _stems() -> dict[bytes, str]:
+    return {path.read_bytes(): path.stem for path in IMAGES_DIR.glob("*.png")}
+
+
+def _scripted_llm(stems: dict[bytes, str]):
+    def run(model, prompt, reference_image=None, reference_text=None, schema=None, temperature=None) -> BaseModel:
+        stem = stems[reference_image.data if isinstance(reference_image, ImagePayload) else reference_image]
+        if schema is Criteria:
+            return Criteria.model_validate(CRITERIA[stem])
+        if schema is Match:
+            return Match.model_validate(DRAFTS.get(stem, LABELS[stem]))
+        # A partial schema of a correction, answered from the label
+        return schema.model_validate({field: LABELS[stem][field] for field in schema.model_fields})
+
+    async def arun(*args, **kwargs) -> BaseModel:
+        return run(*args, **kwargs)
+
+    return run, arun
+
+
+class ScriptedOCR(OCRBackend):
+    """Reads the label back as the OCR text of its image."""
+
+    def __init__(self):
+        self.stems = _stems()
+
+    def process(self, content: bytes, mime_type: str) -> documentai.Document:
+        label = LABELS[self.stems[content]]
+        players = [label["me"], *label["squad"], *label["teammates"], *label["enemies"]]
+        text = "\n".join([label["side"], *(f"{player['name']} {player['level']} {player['kills']} {player['deaths']} {player['assists']} {player['kd']} {player['score']}" for player in players)])
+        return documentai.Document(text=text, mime_type=mime_type)
+
+
+def main() -> None:
+    _write_images()
+    for stage in ("llm", "ocr"):
+        shutil.rmtree(FIXTURES_DIR / stage, ignore_errors=True)
+
+    providers, backend = dict(LLM_PROVIDERS), OCR_BACKENDS.get("documentai")
+    scripted = _scripted_llm(_stems())
+    for route in providers:
+        register_llm_provider(route, *scripted)
+    register_ocr_backend("documentai", ScriptedOCR)
+    try:
+        image_paths = sorted(str(path) for path in IMAGES_DIR.glob("*.png"))
+        for configurable in CONFIGURABLES:
+            print(run_benchmark(image_paths, str(FIXTURES_DIR), ReplaySettings(mode="record"), str(LABELS_DIR), configurable=configurable))
+    finally:
+        for route, (run, arun) in providers.items():
+            register_llm_provider(route, run, arun)
+        if backend is not None:
+            register_ocr_backend("documentai", backend)
+
+
+if __name__ == "__main__":
+    main()
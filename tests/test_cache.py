@@ -0,0 +1,53 @@
+import time
+from pathlib import Path
+
+from structured_ocr.llm_ocr.cache import SQLiteCache
+
+
+def test_get_and_set(tmp_path: Path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"))
+
+    assert cache.get("key") is None
+    cache.set("key", "value")
+    cache.set("bytes", b"\x00\x01")
+
+    assert cache.get("key") == "value"
+    assert cache.get("bytes") == b"\x00\x01"
+    assert len(cache) == 2
+    assert (cache.stats.hits, cache.stats.misses) == (2, 1)
+
+
+def test_expired_entries_are_misses(tmp_path: Path, monkeypatch):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60)
+    cache.set("key", "value")
+
+    later = time.time() + 61
+    monkeypatch.setattr(time, "time", lambda: later)
+
+    assert cache.get("key") is None
+    assert len(cache) == 0
+    assert cache.stats.evictions == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path: Path, monkeypatch):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    now = time.time()
+    for offset, key in enumerate(["a", "b", "c"]):
+        monkeypatch.setattr(time, "time", lambda offset=offset: now + offset)
+        cache.set(key, key)
+    monkeypatch.setattr(time, "time", lambda: now + 3)
+    cache.get("a")
+    # Eviction runs on the first write after every `EVICT_EVERY_WRITES`, so force a sweep
+    cache._evict(now + 4)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "a"
+    assert cache.get("c") == "c"
+
+
+def test_shared_across_connections(tmp_path: Path):
+    path = str(tmp_path / "cache.sqlite")
+    SQLiteCache(path, table="results").set("key", "value")
+
+    assert SQLiteCache(path, table="results").get("key") == "value"
+    assert SQLiteCache(path, table="other").get("key") is None
@@ -0,0 +1,37 @@
+from structured_ocr.llm_ocr.normalize import SEPARATOR, convert_texts, normalize_results
+from structured_ocr.llm_ocr.schema import Match
+
+
+def _match(side_note: str, name: str = "me") -> Match:
+    player = {"name": name, "level": 1, "kills": 1, "deaths": 1, "assists": 0, "kd": 1.0, "score": 10}
+    match = Match.model_validate({"side": "Heroes", "me": player, "squad": [], "teammates": [{**player, "name": "mate"}], "enemies": [{**player, "name": "enemy"}]})
+    # Player names are ASCII only, so the Chinese text goes into a field without validation
+    return match.model_copy(update={"side": side_note})
+
+
+def test_converts_every_result_in_order():
+    results = [_match("简体"), _match("Heroes"), _match("后来")]
+
+    normalized = normalize_results(results)
+
+    assert [result.side for result in normalized] == ["簡體", "Heroes", "後來"]
+
+
+def test_ascii_results_are_returned_untouched():
+    result = _match("Heroes")
+
+    assert normalize_results([result])[0] is result
+
+
+def test_nested_strings_are_converted():
+    result = _match("Heroes")
+    result.enemies[0].name = "敌人"
+
+    normalized = normalize_results([result])[0]
+
+    assert normalized.enemies[0].name == "敵人"
+    assert result.enemies[0].name == "敌人"
+
+
+def test_texts_containing_the_separator_are_converted_one_by_one():
+    assert convert_texts([f"简{SEPARATOR}体", "后"]) == [f"簡{SEPARATOR}體", "後"]
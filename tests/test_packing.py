@@ -0,0 +1,90 @@
+import threading
+from concurrent.futures import Future
+
+from structured_ocr.llm_ocr import packing
+from structured_ocr.llm_ocr.configuration import Configuration
+from structured_ocr.llm_ocr.packing import _close, _join, pack_schema
+from structured_ocr.llm_ocr.schema import Criteria, Match
+
+
+def test_pack_schema_wraps_one_result_per_image():
+    schema = pack_schema(Match)
+
+    assert schema is pack_schema(Match)
+    assert schema.__name__ == "MatchPack"
+    entry = schema.model_fields["results"].annotation.__args__[0]
+    assert entry.model_fields["image_id"].annotation is int
+    assert entry.model_fields["result"].annotation is Match
+
+
+def test_pack_schema_per_schema():
+    assert pack_schema(Criteria) is not pack_schema(Match)
+
+
+def test_join_fills_and_closes_a_pack():
+    key = ("test_join_fills_and_closes_a_pack",)
+
+    first = _join(key, {"index": 0}, 2)
+    second = _join(key, {"index": 1}, 2)
+
+    pack, _, opened, filled = first
+    assert (opened, filled) == (True, False)
+    assert second[0] is pack
+    assert second[2:] == (False, True)
+    assert pack.closed and pack.full.is_set()
+    assert [request["index"] for request, _ in pack.items] == [0, 1]
+    # A full pack is no longer open, the next document opens another
+    assert _join(key, {"index": 2}, 2)[0] is not pack
+
+
+def test_pack_closed_by_its_window_is_run_once():
+    key = ("test_pack_closed_by_its_window_is_run_once",)
+    pack, _, opened, _ = _join(key, {}, 4)
+
+    assert opened
+    assert _close(key, pack)
+    assert not _close(key, pack)
+    assert _join(key, {}, 4)[0] is not pack
+
+
+def test_concurrent_joins_fill_each_pack_exactly():
+    key = ("test_concurrent_joins_fill_each_pack_exactly",)
+    joined = []
+    lock = threading.Lock()
+
+    def join(index: int) -> None:
+        outcome = _join(key, {"index": index}, 4)
+        with lock:
+            joined.append(outcome)
+
+    threads = [threading.Thread(target=join, args=(index,)) for index in range(32)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    packs = {id(pack): pack for pack, *_ in joined}
+    assert len(packs) == 8
+    assert all(len(pack.items) == 4 and pack.closed for pack in packs.values())
+    assert sum(filled for *_, filled in joined) == 8
+
+
+def test_pack_retries_run_unhedged_on_the_shared_pool(monkeypatch):
+    calls = []
+
+    def run(configuration, **request):
+        calls.append((request["schema"], configuration.hedge_requests))
+        if request["schema"] is not Match:
+            raise TimeoutError("packed call timed out")
+        return Match.model_construct()
+
+    monkeypatch.setattr(packing, "hedged_run_llm", run)
+    pack = packing._Pack(2)
+    requests = [{"model": "gemini-2.5-flash", "prompt": "Extract", "reference_image": f"image-{index}", "schema": Match} for index in range(2)]
+    pack.items = [(request, Future()) for request in requests]
+
+    packing._run_pack(Configuration(hedge_requests=True), pack)
+
+    assert calls[0][1] is True
+    assert calls[1:] == [(Match, False), (Match, False)]
+    assert all(future.result() is not None for _, future in pack.items)
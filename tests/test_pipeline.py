@@ -0,0 +1,48 @@
+import shutil
+from pathlib import Path
+
+import pytest
+from rich.table import Table
+
+from structured_ocr.benchmarks.pipeline import run_benchmark
+from structured_ocr.benchmarks.replay import ReplaySettings
+
+from .record_fixtures import CONFIGURABLES
+
+
+def _rows(table: Table) -> dict[str, str]:
+    metrics, values = table.columns
+    return dict(zip(metrics._cells, values._cells))
+
+
+@pytest.mark.parametrize("configurable", CONFIGURABLES, ids=["llm", "ocr"])
+@pytest.mark.parametrize("runner", ["graph", "batch"])
+def test_replayed_benchmark(fixtures_dir: Path, image_paths: list[str], runner: str, configurable: dict):
+    rows = _rows(run_benchmark(image_paths, str(fixtures_dir), ReplaySettings(mode="replay"), str(fixtures_dir / "labels"), runner=runner, configurable=configurable))
+
+    assert rows["failed docs"] == "0"
+    assert rows["field accuracy"] == "1.000 on 3 labels"
+    # One extraction per image, a correction of the K/D mismatch and a checker call on the short lobby
+    assert rows["LLM calls/doc"] == "1.67"
+    assert rows["correction depth max"] == "1"
+    assert "0 recorded, 0 missed" in rows["provider calls"]
+
+
+def test_replay_miss_fails_the_image(fixtures_dir: Path, image_paths: list[str], tmp_path: Path):
+    unrecorded = tmp_path / "unrecorded.png"
+    shutil.copy(image_paths[0], unrecorded)
+    unrecorded.write_bytes(unrecorded.read_bytes() + b"\0")
+
+    rows = _rows(run_benchmark([*image_paths, str(unrecorded)], str(fixtures_dir), ReplaySettings(mode="replay"), configurable=CONFIGURABLES[0]))
+
+    assert rows["failed docs"] == "1"
+    assert "1 missed" in rows["provider calls"]
+
+
+def test_injected_errors_are_retried(fixtures_dir: Path, image_paths: list[str]):
+    settings = ReplaySettings(mode="replay", error_rate=0.3, seed=0)
+
+    rows = _rows(run_benchmark(image_paths, str(fixtures_dir), settings, str(fixtures_dir / "labels"), configurable=CONFIGURABLES[0]))
+
+    assert rows["failed docs"] == "0"
+    assert rows["field accuracy"] == "1.000 on 3 labels"
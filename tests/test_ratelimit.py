@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from structured_ocr.ratelimit import AdaptiveConcurrency, TokenBucket
+
+
+def test_bucket_allows_a_burst_then_delays():
+    bucket = TokenBucket(rate_per_minute=60, burst_seconds=2)
+
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(1.0, abs=0.05)
+    assert bucket.reserve() == pytest.approx(2.0, abs=0.05)
+
+
+def test_bucket_refills_over_time(monkeypatch):
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now)
+    bucket = TokenBucket(rate_per_minute=60, burst_seconds=1)
+    bucket.reserve()
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 0.5)
+    assert bucket.reserve() == pytest.approx(0.5)
+
+    monkeypatch.setattr(time, "monotonic", lambda: now + 10)
+    assert bucket.reserve() == 0.0
+
+
+def test_bucket_adjust_charges_and_refunds():
+    bucket = TokenBucket(rate_per_minute=600, burst_seconds=1)
+    bucket.reserve(10)
+
+    bucket.adjust(-10)
+    assert bucket.reserve(10) == 0.0
+    bucket.adjust(5)
+    assert bucket.reserve(1) == pytest.approx(0.6, abs=0.05)
+
+
+def test_concurrency_limit_is_aimd():
+    limiter = AdaptiveConcurrency(max_concurrency=8, min_concurrency=2)
+
+    limiter.on_throttle()
+    assert limiter.limit == 4
+    # A second throttle within the same round trip is the same congestion event
+    limiter.latency = 60
+    limiter.on_throttle()
+    assert limiter.limit == 4
+
+    for _ in range(4):
+        limiter.on_success(0.1)
+    assert limiter.limit == pytest.approx(5, abs=0.1)
+    for _ in range(100):
+        limiter.on_success(0.1)
+    assert limiter.limit == 8
+
+
+def test_limit_never_drops_below_the_minimum():
+    limiter = AdaptiveConcurrency(max_concurrency=4, min_concurrency=3)
+
+    for _ in range(5):
+        limiter._last_decrease = 0.0
+        limiter.on_throttle()
+
+    assert limiter.limit == 3
+
+
+def test_slots_are_handed_to_waiters_in_order():
+    limiter = AdaptiveConcurrency(max_concurrency=1)
+    limiter.acquire()
+    assert limiter.saturated
+    order = []
+
+    def wait(index: int) -> None:
+        limiter.acquire()
+        order.append(index)
+        limiter.release()
+
+    threads = [threading.Thread(target=wait, args=(index,)) for index in range(3)]
+    for index, thread in enumerate(threads):
+        thread.start()
+        # Queued one after the other, so the order of the waiters is known
+        while len(limiter._waiters) <= index:
+            time.sleep(0.001)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+
+    assert order == [0, 1, 2]
+    assert not limiter.saturated
+
+
+def test_cancelled_async_waiter_gives_up_its_place():
+    async def run() -> None:
+        limiter = AdaptiveConcurrency(max_concurrency=1)
+        await limiter.aacquire()
+        waiter = asyncio.create_task(limiter.aacquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        await asyncio.wait_for(limiter.aacquire(), 1)
+        assert limiter._in_flight == 1
+
+    asyncio.run(run())
@@ -0,0 +1,153 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from structured_ocr.llm_ocr import server
+from structured_ocr.llm_ocr.server import ExtractionService, ServiceOverloaded, ServiceSettings, create_app
+
+from .record_fixtures import CONFIGURABLES
+
+CONFIG = {"configurable": {**CONFIGURABLES[0], "use_result_cache": False, "use_stage_cache": False}}
+
+
+class StubGraph:
+    """Stands in for `abatch_run_graph`, answering each document with its spooled bytes after `delay` or once released."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.release = asyncio.Event()
+        self.batches: list[list[str]] = []
+        self.started = asyncio.Event()
+
+    async def __call__(self, image_paths: list[str], max_concurrency: int, config: dict, return_exceptions: bool, progress: bool) -> list[dict]:
+        self.batches.append(image_paths)
+        self.started.set()
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            await self.release.wait()
+        return [{"size": len(Path(image_path).read_bytes())} for image_path in image_paths]
+
+
+@pytest.fixture
+def png(image_paths: list[str]) -> bytes:
+    return Path(image_paths[0]).read_bytes()
+
+
+def _service(monkeypatch, tmp_path: Path, graph: StubGraph, **settings) -> ExtractionService:
+    monkeypatch.setattr(server, "abatch_run_graph", graph)
+    return ExtractionService(CONFIG, ServiceSettings(spool_dir=str(tmp_path), **settings))
+
+
+def test_identical_submits_share_one_execution(monkeypatch, tmp_path: Path, png: bytes):
+    async def run() -> None:
+        graph = StubGraph(delay=0.05)
+        service = _service(monkeypatch, tmp_path, graph)
+        results = await asyncio.gather(*(service.submit(png) for _ in range(5)))
+        await service.stop()
+
+        assert all(result is results[0] for result in results)
+        assert results[0] == {"size": len(png)}
+        assert [len(batch) for batch in graph.batches] == [1]
+        metrics = service.metrics()
+        assert (metrics.submitted, metrics.coalesced, metrics.completed) == (5, 4, 1)
+
+    asyncio.run(run())
+
+
+def test_full_queue_is_rejected(monkeypatch, tmp_path: Path, png: bytes):
+    async def run() -> None:
+        graph = StubGraph()
+        service = _service(monkeypatch, tmp_path, graph, max_queue=1, max_in_flight=1, batch_window=0)
+        running = asyncio.create_task(service.submit(png + b"\0"))
+        await graph.started.wait()
+        queued = asyncio.create_task(service.submit(png + b"\1"))
+        await asyncio.sleep(0.05)
+
+        with pytest.raises(ServiceOverloaded) as rejected:
+            await service.submit(png + b"\2")
+        assert rejected.value.retry_after >= 1
+
+        graph.release.set()
+        await asyncio.gather(running, queued)
+        await service.stop()
+
+    asyncio.run(run())
+
+
+def test_full_queue_answers_503_with_retry_after(monkeypatch, tmp_path: Path, png: bytes):
+    async def request(app, body: bytes) -> tuple[int, dict[bytes, bytes]]:
+        messages = iter([{"type": "http.request", "body": body}])
+        sent = []
+
+        async def receive() -> dict:
+            return next(messages)
+
+        async def send(message: dict) -> None:
+            sent.append(message)
+
+        await app({"type": "http", "method": "POST", "path": "/extract", "headers": [(b"content-type", b"image/png")]}, receive, send)
+        return sent[0]["status"], dict(sent[0]["headers"])
+
+    async def run() -> None:
+        graph = StubGraph()
+        monkeypatch.setattr(server, "abatch_run_graph", graph)
+        app = create_app(CONFIG, ServiceSettings(spool_dir=str(tmp_path), max_queue=1, max_in_flight=1, batch_window=0))
+        running = asyncio.create_task(request(app, png + b"\0"))
+        await graph.started.wait()
+        queued = asyncio.create_task(request(app, png + b"\1"))
+        await asyncio.sleep(0.05)
+
+        status, headers = await request(app, png + b"\2")
+        assert status == 503
+        assert int(headers[b"retry-after"]) >= 1
+
+        graph.release.set()
+        assert [status for status, _ in await asyncio.gather(running, queued)] == [200, 200]
+        await app.service.stop()
+
+    asyncio.run(run())
+
+
+def test_rejections_do_not_skew_the_metrics(monkeypatch, tmp_path: Path, png: bytes):
+    async def run() -> None:
+        graph = StubGraph(delay=0.1)
+        service = _service(monkeypatch, tmp_path, graph, max_queue=2, max_in_flight=1, batch_window=0)
+        outcomes = await asyncio.gather(*(service.submit(png + bytes([index])) for index in range(8)), return_exceptions=True)
+        await service.stop()
+
+        rejected = sum(isinstance(outcome, ServiceOverloaded) for outcome in outcomes)
+        metrics = service.metrics()
+        assert rejected > 0
+        assert (metrics.rejected, metrics.completed, metrics.failed) == (rejected, 8 - rejected, 0)
+        # Only executed documents count towards the latency that Retry-After is based on
+        assert metrics.latency["p50"] >= 0.1
+
+    asyncio.run(run())
+
+
+def test_stop_fails_the_queued_documents(monkeypatch, tmp_path: Path, png: bytes):
+    async def run() -> None:
+        graph = StubGraph()
+        service = _service(monkeypatch, tmp_path, graph, max_in_flight=1, batch_window=0)
+        running = asyncio.create_task(service.submit(png + b"\0"))
+        await graph.started.wait()
+        queued = [asyncio.create_task(service.submit(png + bytes([index]))) for index in range(1, 4)]
+        await asyncio.sleep(0.05)
+
+        stopping = asyncio.create_task(service.stop())
+        await asyncio.sleep(0.05)
+        # The running micro-batch is let finish
+        assert not stopping.done()
+        graph.release.set()
+        await stopping
+
+        assert await running == {"size": len(png) + 1}
+        for task in queued:
+            with pytest.raises(RuntimeError, match="stopped"):
+                await task
+        assert service.metrics().failed == 3
+        assert list(tmp_path.iterdir()) == []
+
+    asyncio.run(run())
@@ -0,0 +1,75 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from structured_ocr.benchmarks.replay import ReplaySettings, replaying
+from structured_ocr.llm_ocr import stream
+from structured_ocr.llm_ocr.stream import stream_run_graph
+
+from .record_fixtures import CONFIGURABLES
+
+
+class StubGraph:
+    """Stands in for `arun_graph`, finishing the images in the order of their delays and noting those cancelled."""
+
+    def __init__(self, delays: dict[str, float]):
+        self.delays = delays
+        self.cancelled: list[str] = []
+
+    async def __call__(self, image_path: str, config: dict) -> dict:
+        try:
+            await asyncio.sleep(self.delays[image_path])
+        except asyncio.CancelledError:
+            # Cleanup that awaits, like closing a client, only completes when the cancelled task is awaited
+            await asyncio.sleep(0)
+            self.cancelled.append(image_path)
+            raise
+        return {"image_path": image_path}
+
+
+def test_results_arrive_in_completion_order(monkeypatch):
+    monkeypatch.setattr(stream, "arun_graph", StubGraph({"slow": 0.05, "fast": 0.0}))
+
+    assert [image_path for image_path, _ in stream_run_graph(["slow", "fast"])] == ["fast", "slow"]
+
+
+def test_runs_inside_a_running_event_loop(monkeypatch):
+    monkeypatch.setattr(stream, "arun_graph", StubGraph({"a": 0.0, "b": 0.01}))
+
+    async def caller() -> list[str]:
+        return [image_path for image_path, _ in stream_run_graph(["a", "b"])]
+
+    assert asyncio.run(caller()) == ["a", "b"]
+
+
+@pytest.mark.filterwarnings("error")
+def test_stopping_early_cancels_the_documents_in_flight(monkeypatch):
+    graph = StubGraph({"a": 0.0, "b": 10.0, "c": 10.0})
+    monkeypatch.setattr(stream, "arun_graph", graph)
+
+    results = stream_run_graph(["a", "b", "c"])
+    assert next(results)[0] == "a"
+    results.close()
+
+    assert sorted(graph.cancelled) == ["b", "c"]
+
+
+def test_checkpoint_skips_completed_documents(fixtures_dir: Path, image_paths: list[str], tmp_path: Path):
+    unrecorded = tmp_path / "unrecorded.png"
+    unrecorded.write_bytes(Path(image_paths[0]).read_bytes() + b"\0")
+    sink_path = tmp_path / "results.jsonl"
+    config = {"configurable": {**CONFIGURABLES[0], "use_result_cache": False, "use_stage_cache": False}}
+
+    with replaying(str(fixtures_dir), ReplaySettings(mode="replay")) as stats:
+        first = dict(stream_run_graph([*image_paths, str(unrecorded)], str(sink_path), config=config))
+        second = dict(stream_run_graph([*image_paths, str(unrecorded)], str(sink_path), config=config))
+
+    assert sum(isinstance(outcome, Exception) for outcome in first.values()) == 1
+    # Only the failed document is run again
+    assert list(second) == [str(unrecorded)]
+    assert stats.misses == 2
+    records = [json.loads(line) for line in sink_path.read_text().splitlines()]
+    assert sum("result" in record for record in records) == 3
+    assert sum("error" in record for record in records) == 2
@@ -0,0 +1,48 @@
+from structured_ocr.llm_ocr.streaming import PartialJSONParser
+
+TEXT = '```json\n{"side": "Heroes", "me": {"name": "a\\"b", "kills": 3}, "enemies": [{"name": "x"}, {"name": "y"}], "note": null, "full": true}\n```'
+
+
+def test_reports_values_as_they_close():
+    parser = PartialJSONParser()
+
+    closed = parser.feed(TEXT)
+
+    assert closed == [
+        (("side",), "Heroes"),
+        (("me", "name"), 'a"b'),
+        (("me", "kills"), 3),
+        (("me",), {"name": 'a"b', "kills": 3}),
+        (("enemies", 0), {"name": "x"}),
+        (("enemies", 1), {"name": "y"}),
+        (("enemies",), [{"name": "x"}, {"name": "y"}]),
+        (("note",), None),
+        (("full",), True),
+        ((), None),
+    ]
+    assert parser.done
+
+
+def test_chunking_does_not_change_the_result():
+    parser = PartialJSONParser()
+
+    closed = [value for char in TEXT for value in parser.feed(char)]
+
+    assert closed == PartialJSONParser().feed(TEXT)
+    assert parser.document == TEXT.removeprefix("```json\n").removesuffix("\n```")
+
+
+def test_depth_limits_the_reported_values():
+    closed = PartialJSONParser(depth=1).feed(TEXT)
+
+    assert [path for path, _ in closed] == [("side",), ("me",), ("enemies",), ("note",), ("full",), ()]
+
+
+def test_incomplete_text_reports_only_closed_values():
+    parser = PartialJSONParser()
+
+    closed = parser.feed('{"side": "Heroes", "me": {"name": "a", "kil')
+
+    assert closed == [(("side",), "Heroes"), (("me", "name"), "a")]
+    assert not parser.done
+    assert parser.document == ""
@@ -0,0 +1,59 @@
+from structured_ocr.llm_ocr.schema import Match, Player
+from structured_ocr.llm_ocr.validation import validate_match
+
+
+def _player(name: str, kills: int = 4, deaths: int = 2, kd: float = 2.0) -> dict:
+    return {"name": name, "level": 10, "kills": kills, "deaths": deaths, "assists": 1, "kd": kd, "score": 100}
+
+
+def _match(enemies: int = 4, **overrides) -> Match:
+    return Match.model_validate(
+        {
+            "side": "Heroes",
+            "me": _player("me"),
+            "squad": [_player("squad")],
+            "teammates": [_player("mate1"), _player("mate2")],
+            "enemies": [_player(f"enemy{index}") for index in range(enemies)],
+            **overrides,
+        }
+    )
+
+
+def test_consistent_full_lobby_has_no_issues():
+    validation = validate_match(_match())
+
+    assert validation.hard == {}
+    assert validation.soft == {}
+    assert validation.criteria().model_dump(exclude={"reasons"}) == {"team_names": 10, "highlighted_player": 10, "player_data_accuracy": 10, "grouping": 10}
+
+
+def test_kd_off_kills_and_deaths_is_a_hard_issue():
+    validation = validate_match(_match(me=_player("me", kills=4, deaths=2, kd=3.0)))
+
+    assert list(validation.hard) == ["player_data_accuracy"]
+    assert "K/D 3.0" in validation.hard["player_data_accuracy"][0]
+    assert validation.criteria().player_data_accuracy == 6
+
+
+def test_zero_deaths_kd_equals_kills():
+    assert validate_match(_match(me=_player("me", kills=5, deaths=0, kd=5.0))).hard == {}
+
+
+def test_short_side_is_a_soft_issue():
+    validation = validate_match(_match(enemies=3))
+
+    assert validation.hard == {}
+    assert list(validation.soft) == ["grouping"]
+    assert validation.criteria().grouping == 8
+
+
+def test_merged_results_are_rechecked():
+    # A corrector merge skips validation, so out-of-bounds values and duplicates reach the checks
+    result = _match()
+    result.me = Player.model_construct(**{**_player("me"), "kills": 99, "kd": 49.5})
+    result.teammates[0] = result.enemies[0]
+
+    validation = validate_match(result)
+
+    assert any("kills" in issue for issue in validation.hard["player_data_accuracy"])
+    assert "enemy0 appears in both teammates and enemies" in validation.hard["grouping"]
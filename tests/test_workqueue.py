@@ -0,0 +1,214 @@
+import json
+import sqlite3
+import time
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from structured_ocr.benchmarks.replay import ReplaySettings, replaying
+from structured_ocr.llm_ocr import workqueue
+from structured_ocr.llm_ocr.workqueue import Job, SQLiteQueue, WorkerSettings, WorkerStats, run_worker
+
+from .record_fixtures import CONFIGURABLES
+
+
+@pytest.fixture
+def queue(tmp_path: Path):
+    queue = SQLiteQueue(str(tmp_path / "jobs.sqlite"))
+    yield queue
+    queue.close()
+
+
+def test_lease_takes_available_jobs_once(queue: SQLiteQueue):
+    job_ids = queue.enqueue(["a.png", "b.png", "c.png"], {"use_ocr": True})
+
+    leased = queue.lease("worker-1", 2, 60)
+    rest = queue.lease("worker-2", 5, 60)
+
+    assert all(job.status == "leased" and job.lease_owner == "worker-1" and job.attempts == 1 for job in leased)
+    assert leased[0].config == {"use_ocr": True}
+    # Jobs enqueued together are leased in any order, but each by one worker only
+    assert len(leased) == 2 and len(rest) == 1
+    assert {job.id for job in leased + rest} == set(job_ids)
+    assert queue.lease("worker-3", 5, 60) == []
+
+
+def test_ack_stores_the_result(queue: SQLiteQueue):
+    queue.enqueue(["a.png"])
+    job = queue.lease("worker-1", 1, 60)[0]
+
+    assert not queue.ack(job.id, "worker-2", {"side": "Heroes"})
+    assert queue.ack(job.id, "worker-1", {"side": "Heroes"})
+
+    done = queue.jobs("done")
+    assert [job.result for job in done] == [{"side": "Heroes"}]
+    assert queue.is_drained()
+
+
+def test_fail_retries_after_the_backoff(queue: SQLiteQueue):
+    queue.enqueue(["a.png"])
+    job = queue.lease("worker-1", 1, 60)[0]
+
+    assert queue.fail(job.id, "worker-2", "ValueError()") is None
+    assert queue.fail(job.id, "worker-1", "ValueError()", retry_after=60) == "pending"
+
+    assert queue.lease("worker-1", 1, 60) == []
+    assert queue.jobs("pending")[0].error == "ValueError()"
+    assert not queue.is_drained()
+
+
+def test_release_keeps_the_attempt(queue: SQLiteQueue):
+    queue.enqueue(["a.png"])
+    job = queue.lease("worker-1", 1, 60)[0]
+
+    assert not queue.release(job.id, "worker-2")
+    assert queue.release(job.id, "worker-1")
+
+    released = queue.lease("worker-2", 1, 60)[0]
+    assert released.id == job.id
+    assert released.attempts == 1
+
+
+def test_expired_lease_is_taken_over(queue: SQLiteQueue):
+    queue.enqueue(["a.png"])
+    job = queue.lease("worker-1", 1, 0.01)[0]
+    time.sleep(0.02)
+
+    taken = queue.lease("worker-2", 1, 60)
+
+    assert [(job.id, job.lease_owner, job.attempts) for job in taken] == [(job.id, "worker-2", 2)]
+    assert not queue.extend(job.id, "worker-1", 60)
+    assert not queue.ack(job.id, "worker-1", {})
+    assert queue.ack(job.id, "worker-2", {})
+
+
+def test_failed_jobs_go_to_the_dead_letters(queue: SQLiteQueue):
+    queue.enqueue(["a.png"], max_attempts=2)
+
+    job = queue.lease("worker-1", 1, 60)[0]
+    assert queue.fail(job.id, "worker-1", "ValueError()") == "pending"
+    job = queue.lease("worker-1", 1, 60)[0]
+    assert queue.fail(job.id, "worker-1", "ValueError()") == "dead"
+
+    dead = queue.jobs("dead")
+    assert [(job.attempts, job.error) for job in dead] == [(2, "ValueError()")]
+    assert queue.is_drained()
+
+
+def test_expired_lease_out_of_attempts_is_dead(queue: SQLiteQueue):
+    queue.enqueue(["a.png"], max_attempts=1)
+    queue.lease("worker-1", 1, 0.01)
+    time.sleep(0.02)
+
+    assert queue.lease("worker-2", 1, 60) == []
+    assert [job.error for job in queue.jobs("dead")] == ["lease expired"]
+
+
+def test_requeue_dead_resets_the_attempts(queue: SQLiteQueue):
+    first, second = queue.enqueue(["a.png", "b.png"], max_attempts=1)
+    for job in queue.lease("worker-1", 2, 60):
+        queue.fail(job.id, "worker-1", "ValueError()")
+
+    assert queue.requeue_dead([first]) == 1
+    assert [job.id for job in queue.jobs("dead")] == [second]
+    assert queue.requeue_dead() == 1
+
+    requeued = queue.lease("worker-1", 2, 60)
+    assert {job.id for job in requeued} == {first, second}
+    assert all(job.attempts == 1 for job in requeued)
+
+
+class LockedOnceQueue(SQLiteQueue):
+    """Fails the first call of `locked`, like a SQLite file locked by another process for longer than the timeout."""
+
+    def __init__(self, path: str, locked: str):
+        super().__init__(path)
+        self.locked = locked
+
+    def _call(self, name: str) -> None:
+        if self.locked == name:
+            self.locked = None
+            raise sqlite3.OperationalError("database is locked")
+
+    def lease(self, worker_id: str, count: int, lease_seconds: float) -> list[Job]:
+        self._call("lease")
+        return super().lease(worker_id, count, lease_seconds)
+
+    def ack(self, job_id: str, worker_id: str, result: dict[str, Any]) -> bool:
+        self._call("ack")
+        return super().ack(job_id, worker_id, result)
+
+    def is_drained(self) -> bool:
+        self._call("is_drained")
+        return super().is_drained()
+
+    def report(self, stats: WorkerStats) -> None:
+        self._call("report")
+        super().report(stats)
+
+
+@pytest.fixture
+def extracted(monkeypatch):
+    async def arun_graph(image_path: str, config: dict) -> dict:
+        return {"image_path": image_path}
+
+    monkeypatch.setattr(workqueue, "arun_graph", arun_graph)
+
+
+@pytest.mark.usefixtures("extracted")
+def test_worker_survives_a_failed_ack(tmp_path: Path):
+    queue = LockedOnceQueue(str(tmp_path / "jobs.sqlite"), "ack")
+    queue.enqueue(["a.png"])
+
+    stats = run_worker(queue, WorkerSettings(worker_id="worker-1", lease_seconds=0.3, poll_seconds=0.05, drain=True))
+
+    # The unstored result is extracted again once the lease runs out
+    assert (stats.queue_errors, stats.succeeded) == (1, 1)
+    assert [(job.attempts, job.result) for job in queue.jobs("done")] == [(2, {"image_path": "a.png"})]
+
+
+@pytest.mark.usefixtures("extracted")
+@pytest.mark.parametrize("locked", ["lease", "is_drained", "report"])
+def test_worker_survives_queue_errors(tmp_path: Path, locked: str):
+    queue = LockedOnceQueue(str(tmp_path / "jobs.sqlite"), locked)
+    queue.enqueue(["a.png"])
+
+    stats = run_worker(queue, WorkerSettings(worker_id="worker-1", poll_seconds=0.05, report_seconds=0.01, drain=True))
+
+    assert (stats.queue_errors, stats.succeeded) == (1, 1)
+    assert queue.counts()["done"] == 1
+    assert queue.locked is None
+
+
+def _replay_worker(url: str, fixtures_dir: str) -> None:
+    with replaying(fixtures_dir, ReplaySettings(mode="replay")):
+        run_worker(url, WorkerSettings(concurrency=2, poll_seconds=0.05, retry_base_seconds=0, drain=True))
+
+
+def test_worker_processes_drain_the_queue(tmp_path: Path, fixtures_dir: Path, image_paths: list[str]):
+    url = str(tmp_path / "jobs.sqlite")
+    queue = SQLiteQueue(url)
+    unrecorded = tmp_path / "unrecorded.png"
+    unrecorded.write_bytes(Path(image_paths[0]).read_bytes() + b"\0")
+    config = {**CONFIGURABLES[0], "use_result_cache": False, "use_stage_cache": False}
+    queue.enqueue(image_paths, config)
+    queue.enqueue([str(unrecorded)], config, max_attempts=2)
+
+    # Spawned like the worker processes of the CLI
+    processes = [get_context("spawn").Process(target=_replay_worker, args=(url, str(fixtures_dir))) for _ in range(2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+
+    assert [process.exitcode for process in processes] == [0, 0]
+    assert queue.counts() == {"pending": 0, "leased": 0, "done": 3, "dead": 1}
+    labels = {path.stem: json.loads(path.read_text()) for path in (fixtures_dir / "labels").glob("*.json")}
+    assert {Path(job.image_path).stem: job.result for job in queue.jobs("done")} == labels
+    assert queue.jobs("dead")[0].attempts == 2
+    workers = queue.workers()
+    assert len(workers) == 2
+    assert sum(worker.succeeded for worker in workers) == 3
+    queue.close()